@@ -27,13 +27,17 @@ import os
 import re
 import tarfile
 import shutil
+import filecmp
+import shlex
 from subprocess import call
 import time
+import threading
 from datetime import datetime
 from collections import namedtuple
 import psutil
 from uuid import uuid4
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 from conf import CCA_HOME, FB_DIR, WORK_DIR, FACT_DIR, ONT_DIR
 import virtuoso_ini
@@ -47,8 +51,27 @@ TEMP_DIRS = [
 
 OUTDIR_NAME = '_EBT_'
 
+CACHE_DIR_NAME = 'cache'
+
+HASH_CACHE_FILE_NAME = 'file_hashes.json' # in CACHE_DIR_NAME
+
+PROFILE_DIR_NAME = 'profile'
+
+FB_STATE_DIR_NAME = 'fb_state'
+
+FB_STORE_DIR_NAME = 'fb_store'
+
+LOCAL_STORE_THRESH = 0 # MB of fact files (0: always use virtuoso)
+
+FINGERPRINT_EXCLUDE = [OUTDIR_NAME, '.git', '.svn']
+
 STAT_FILE_NAME = 'status'
 
+# files parsed by shards; other files are left to the final pass over proj_dir
+PARSE_EXTS = ['.f', '.for', '.f90', '.h90', '.f95', '.f03', '.f08', '.cpp', '.hpp', '.cc', '.hh']
+
+PARSE_CHUNK_SIZE = 256 # files per parsesrc invocation
+
 DEFAULT_PW = 'ebt'
 DEFAULT_PORT = 1111
 
@@ -65,15 +88,28 @@ FB_FILES = [ os.path.join(FB_DIR, 'virtuoso'+x) for x in ['-temp.db',
                                                           '.ini',
                                                       ]]
 
+# empty databases with the ontologies loaded
+TEMPLATE_DIR = os.path.join(os.path.dirname(FB_DIR), 'template')
+TEMPLATE_FILES = [ os.path.join(FB_DIR, 'virtuoso'+x) for x in ['.db', '.trx'] ]
+TEMPLATE_PW = 'dba' # password of a new database, changed by start_virtuoso
+
 SCRIPTS_PATH = os.path.join(CCA_HOME, 'scripts')
 
 sys.path.append(SCRIPTS_PATH)
 
 import virtuoso
+import sparql
+from sparql import SLOW_QUERY_THRESH
+import localstore
+import fact_state
+import fb_store
+from ns import FB_NS
+from factutils.fileid import HashCache
 import proc
 import load_into_virtuoso
 import load_ont_into_virtuoso
 import materialize_fact_for_tuning
+from materialize_fact import DEFAULT_NWORKERS as MATERIALIZE_WORKERS
 from outline_for_flops import Outline as OutlineForFlops
 from outline_for_survey_cpp import Outline as OutlineForSurveyCpp
 from outline_for_survey_fortran import Outline as OutlineForSurveyFortran
@@ -191,7 +227,13 @@ def is_virtuoso_running():
     return b
 
 
-def start_virtuoso(mem=4, pw=DEFAULT_PW, port=DEFAULT_PORT):
+def get_nconns(nworkers=0, mat_workers=MATERIALIZE_WORKERS, nloaders=virtuoso.DEFAULT_NLOADERS):
+    # the largest of the connection pools, which are used one after another
+    return max(virtuoso.DEFAULT_POOL_SIZE, nworkers + 1, # analyzers
+               nloaders + 2,                             # loaders
+               mat_workers)                              # materializers
+
+def start_virtuoso(mem=4, pw=DEFAULT_PW, port=DEFAULT_PORT, set_pw=True, nconns=0, src_root=None):
     stat = 0
     if is_virtuoso_running():
         log('virtuoso is already running')
@@ -199,32 +241,83 @@ def start_virtuoso(mem=4, pw=DEFAULT_PW, port=DEFAULT_PORT):
     else:
         if ensure_dir(FB_DIR):
             fname = os.path.join(FB_DIR, 'virtuoso.ini')
-            virtuoso_ini.gen_ini(FB_DIR, FACT_DIR, ONT_DIR, fname,
-                                 mem=mem, port=port)
+            params = virtuoso_ini.gen_ini(FB_DIR, FACT_DIR, ONT_DIR, fname,
+                                          mem=mem, port=port, src_root=src_root,
+                                          nconns=nconns)
+            log('virtuoso settings%s: %s' % (' (auto)' if mem == virtuoso_ini.AUTO_MEM else '',
+                                             ', '.join('%s=%s' % x for x in sorted(params.items()))))
 
             v = virtuoso.base(dbdir=FB_DIR, port=port)
             rc = v.start_server()
-            if rc == 0:
+            if rc == 0 and set_pw:
                 rc = v.set_password(pw)
             if rc != 0:
                 stat = 1
     return stat
 
-def load_fact(proj_id, pw=DEFAULT_PW, port=DEFAULT_PORT):
+def load_fact(proj_id, pw=DEFAULT_PW, port=DEFAULT_PORT, checkpoint=virtuoso.CKPT_ADAPTIVE):
     fdir = os.path.join(FACT_DIR, proj_id)
     rc = load_into_virtuoso.load(proj_id,
                                  FB_DIR,
                                  fdir,
                                  ['.nt.gz'],
                                  pw=pw,
-                                 port=port)
+                                 port=port,
+                                 checkpoint=checkpoint)
+    return rc
+
+def load_fact_stream(proj_id, is_done, pw=DEFAULT_PW, port=DEFAULT_PORT,
+                     checkpoint=virtuoso.CKPT_ADAPTIVE):
+    fdir = os.path.join(FACT_DIR, proj_id)
+    rc = load_into_virtuoso.load_stream(proj_id,
+                                        FB_DIR,
+                                        fdir,
+                                        ['.nt.gz'],
+                                        is_done,
+                                        pw=pw,
+                                        port=port,
+                                        checkpoint=checkpoint)
+    return rc
+
+def update_fact(proj_id, state, pw=DEFAULT_PW, port=DEFAULT_PORT):
+    fdir = os.path.join(FACT_DIR, proj_id)
+    rc = load_into_virtuoso.update(proj_id,
+                                   FB_DIR,
+                                   fdir,
+                                   ['.nt.gz'],
+                                   state,
+                                   pw=pw,
+                                   port=port)
     return rc
 
 def load_ont(pw=DEFAULT_PW, port=DEFAULT_PORT):
     return load_ont_into_virtuoso.load(FB_DIR, ONT_DIR, pw=pw, port=port)
 
-def materialize(proj_id, pw=DEFAULT_PW, port=DEFAULT_PORT):
-    return materialize_fact_for_tuning.materialize(proj_id, pw=pw, port=port)
+def load_local(proj_id):
+    stat = 0
+    try:
+        store = localstore.get_store()
+        store.load_ont(ONT_DIR)
+        store.load_facts(FB_NS+proj_id, os.path.join(FACT_DIR, proj_id))
+        log('%d triples loaded' % len(store))
+    except Exception as e:
+        log('failed to load facts into local store: %s' % e)
+        stat = 1
+    return stat
+
+def use_local_store(proj_id, thresh=LOCAL_STORE_THRESH):
+    b = False
+    if thresh > 0 and localstore.is_available():
+        sz = localstore.get_data_size(os.path.join(FACT_DIR, proj_id))
+        log('fact size: %d bytes' % sz)
+        b = sz < thresh * 1024 * 1024
+    return b
+
+def materialize(proj_id, method='odbc', pw=DEFAULT_PW, port=DEFAULT_PORT, profiler=None,
+                nworkers=MATERIALIZE_WORKERS):
+    return materialize_fact_for_tuning.materialize(proj_id, method=method, pw=pw, port=port,
+                                                   profiler=profiler, nworkers=nworkers,
+                                                   ver_dir=os.path.join(FACT_DIR, proj_id+'.ver'))
 
 def clear_fb():
     stat = 0
@@ -261,13 +354,92 @@ def clear_temp():
     return stat
 
 
-def reset_virtuoso(pw=DEFAULT_PW, port=DEFAULT_PORT, backup_fb=None):
-    stat = 0
+def move_files(paths, dest):
+    if not ensure_dir(dest):
+        return 1
+    try:
+        for p in paths:
+            if os.path.exists(p):
+                log('moving "%s" to "%s"...' % (p, dest))
+                shutil.move(p, os.path.join(dest, os.path.basename(p)))
+    except Exception as e:
+        log(str(e))
+        return 1
+    return 0
+
+def shutdown_virtuoso(pw=DEFAULT_PW, port=DEFAULT_PORT):
     if is_virtuoso_running():
         v = virtuoso.base(dbdir=FB_DIR, pw=pw, port=port)
         rc = v.shutdown_server()
         if rc != 0 or is_virtuoso_running():
             return 1
+    return 0
+
+def save_fb(dest, pw=DEFAULT_PW, port=DEFAULT_PORT):
+    rc = shutdown_virtuoso(pw=pw, port=port)
+    if rc == 0:
+        rc = move_files(FB_FILES, dest)
+    return rc
+
+def restore_fb(src):
+    return move_files([os.path.join(src, os.path.basename(f)) for f in FB_FILES], FB_DIR)
+
+def get_snapshot_key(proj_dir, proj_id, src_fp=None, cache=None):
+    if src_fp == None:
+        src_fp = sparql.compute_fingerprint(proj_dir, exclude=FINGERPRINT_EXCLUDE, cache=cache)
+    return fb_store.compute_key(proj_id, src_fp, PARSESRC_CMD, ONT_DIR)
+
+def restore_snapshot(store, key, mem=4, pw=DEFAULT_PW, port=DEFAULT_PORT, nconns=0):
+    if shutdown_virtuoso(pw=pw, port=port) != 0 or clear_fb() != 0:
+        return 1
+    if not ensure_dir(FB_DIR):
+        return 1
+    rc = store.restore(key, FB_FILES, FB_DIR)
+    if rc == 0:
+        rc = start_virtuoso(mem=mem, pw=pw, port=port, set_pw=False, nconns=nconns)
+    return rc
+
+def save_snapshot(store, key, ver, pw=DEFAULT_PW, port=DEFAULT_PORT):
+    rc = shutdown_virtuoso(pw=pw, port=port)
+    if rc == 0:
+        rc = store.save(key, FB_FILES, ver, pw)
+    return rc
+
+def get_template_key():
+    return fb_store.compute_template_key(virtuoso.SERVER_CMD, ONT_DIR,
+                                         load_ont_into_virtuoso.GRAPH_URI,
+                                         load_ont_into_virtuoso.RULE_NAME)
+
+def build_template(template, key, mem=4, port=DEFAULT_PORT):
+    rc = start_virtuoso(mem=mem, pw=TEMPLATE_PW, port=port, set_pw=False)
+    if rc == 0:
+        rc = load_ont(pw=TEMPLATE_PW, port=port)
+    if rc == 0:
+        rc = shutdown_virtuoso(pw=TEMPLATE_PW, port=port)
+    if rc == 0:
+        rc = template.save(key, TEMPLATE_FILES, None, TEMPLATE_PW)
+    return rc
+
+def clone_template(template, mem=4, port=DEFAULT_PORT):
+    if is_virtuoso_running() or not ensure_dir(FB_DIR) or clear_fb() != 0:
+        return 1
+    key = get_template_key()
+    if template.lookup(key):
+        log('cloning database template "%s"...' % key)
+        rc = template.restore(key, TEMPLATE_FILES, FB_DIR)
+    else:
+        log('building database template "%s"...' % key)
+        rc = build_template(template, key, mem=mem, port=port)
+    if rc != 0:
+        shutdown_virtuoso(pw=TEMPLATE_PW, port=port)
+        clear_fb()
+    return rc
+
+def reset_virtuoso(pw=DEFAULT_PW, port=DEFAULT_PORT, backup_fb=None):
+    stat = 0
+    localstore.reset_store()
+    if shutdown_virtuoso(pw=pw, port=port) != 0:
+        return 1
 
     if backup_fb:
         try:
@@ -280,16 +452,107 @@ def reset_virtuoso(pw=DEFAULT_PW, port=DEFAULT_PORT, backup_fb=None):
     return stat
         
 
-def parse(proj_dir, proj_id, ver):
+def get_parse_args(proj_dir, proj_id, ver, cache_dir, fact_dir):
     args = ' -fact -fact:ast'
-    args += ' -cache %s' % os.path.join(WORK_DIR, 'parsesrc')
-    args += ' -fact:into-directory %s' % os.path.join(FACT_DIR, proj_id)
+    args += ' -cache %s' % cache_dir
+    args += ' -fact:into-directory %s' % fact_dir
     args += ' -fact:project %s' % proj_id
     args += ' -fact:project-root %s' % proj_dir
     args += ' -fact:version VARIANT:%s -fact:add-versions' % ver
     args += ' -fact:encoding:FDLCO -fact:size-thresh 100000'
     #args += ' -parser:cpp'
     #args += ' -parser:fortran'
+    return args
+
+def find_source_files(proj_dir, exts=PARSE_EXTS, exclude=FINGERPRINT_EXCLUDE):
+    l = [] # (size * path) list
+    for (dpath, dns, fns) in os.walk(proj_dir):
+        dns[:] = sorted(x for x in dns if x not in exclude and not x.startswith('.'))
+        for fn in sorted(fns):
+            if os.path.splitext(fn)[1].lower() in exts:
+                path = os.path.join(dpath, fn)
+                if os.path.isfile(path):
+                    l.append((os.path.getsize(path), path))
+    return l
+
+def mkshards(files, n):
+    # every file goes to exactly one shard, even if it is reachable by several paths
+    tbl = {} # real path -> (size * path)
+    for (sz, path) in files:
+        tbl.setdefault(os.path.realpath(path), (sz, path))
+    shards = [[] for i in range(n)]
+    sizes = [0] * n
+    for (sz, path) in sorted(tbl.values(), reverse=True):
+        i = sizes.index(min(sizes))
+        shards[i].append(path)
+        sizes[i] += sz
+    return [x for x in shards if x]
+
+class MergeConflict(Exception):
+    pass
+
+def merge_dir(src, dest, strict=False):
+    # moves the contents of src into dest; on a name clash, dest is kept
+    # unless strict is set, in which case different contents are an error
+    if not os.path.exists(dest):
+        ensure_dir(os.path.dirname(dest))
+        shutil.move(src, dest)
+        return
+    for fn in sorted(os.listdir(src)):
+        s = os.path.join(src, fn)
+        d = os.path.join(dest, fn)
+        if os.path.isdir(s) and not os.path.islink(s):
+            merge_dir(s, d, strict=strict)
+        elif not os.path.exists(d):
+            shutil.move(s, d)
+        elif strict and not filecmp.cmp(s, d, shallow=False):
+            raise MergeConflict('"%s" clashes with "%s"' % (s, d))
+    rmdir(src)
+
+def parse_shard(i, paths, proj_dir, proj_id, ver):
+    cache_dir = os.path.join(WORK_DIR, 'parsesrc.%d' % i)
+    fact_dir = os.path.join(FACT_DIR, '%s.%d' % (proj_id, i))
+    args = get_parse_args(proj_dir, proj_id, ver, cache_dir, fact_dir)
+    rc = 0
+    for j in range(0, len(paths), PARSE_CHUNK_SIZE):
+        files = ' '.join(shlex.quote(x) for x in paths[j:j+PARSE_CHUNK_SIZE])
+        if proc.system('%s%s %s' % (PARSESRC_CMD, args, files)) != 0:
+            rc = 1
+    return (cache_dir, fact_dir, rc)
+
+def parse_shards(proj_dir, proj_id, ver, nworkers):
+    # fills the cache and the fact directory with per-file results
+    stat = 0
+    shards = mkshards(find_source_files(proj_dir), nworkers)
+    log('parsing %d files in %d shards...' % (sum(len(x) for x in shards), len(shards)))
+    cache_dir = os.path.join(WORK_DIR, 'parsesrc')
+    fact_dir = os.path.join(FACT_DIR, proj_id)
+    with ThreadPoolExecutor(max_workers=len(shards) or 1) as executor:
+        fs = [executor.submit(parse_shard, i, x, proj_dir, proj_id, ver) for (i, x) in enumerate(shards)]
+        for f in fs:
+            (sc, sf, rc) = f.result()
+            if rc != 0:
+                log('shard failed (files are parsed again): "%s"' % sc)
+            if os.path.exists(sc):
+                merge_dir(sc, cache_dir)
+            if os.path.exists(sf):
+                try: # shards are disjoint, so they never produce the same fact file
+                    merge_dir(sf, fact_dir, strict=True)
+                except MergeConflict as e:
+                    log('failed to merge shard: %s' % e)
+                    stat = 1
+                    rmdir(sf)
+    return stat
+
+def parse(proj_dir, proj_id, ver, nworkers=1):
+    if nworkers > 1:
+        if parse_shards(proj_dir, proj_id, ver, nworkers) != 0:
+            return 1
+
+    # cached files only get their version facts emitted here
+    args = get_parse_args(proj_dir, proj_id, ver,
+                          os.path.join(WORK_DIR, 'parsesrc'),
+                          os.path.join(FACT_DIR, proj_id))
     args += ' %s' % proj_dir
 
     cmd = '%s%s' % (PARSESRC_CMD, args)
@@ -299,36 +562,117 @@ def parse(proj_dir, proj_id, ver):
     return rc
 
 
+class ParseThread(threading.Thread):
+    def __init__(self, proj_dir, proj_id, ver, nworkers=1):
+        threading.Thread.__init__(self)
+        self._args = (proj_dir, proj_id, ver)
+        self._nworkers = nworkers
+        self.rc = None
+
+    def run(self):
+        self.rc = parse(*self._args, nworkers=self._nworkers)
+
+    def is_done(self):
+        return not self.is_alive()
+
+
 def build_fb(proj_dir, proj_id, mem=4, pw=DEFAULT_PW, port=DEFAULT_PORT,
-             set_status=None):
+             set_status=None, profiler=None, method='odbc', state=None, parse_ver=None,
+             parse_workers=1, template=None, mat_workers=MATERIALIZE_WORKERS, nconns=0):
 
     if set_status == None:
         set_status = lambda mes: log(mes)
 
+    if method == 'local':
+        set_status('loading facts into local store...')
+        rc = load_local(proj_id)
+        if rc != 0:
+            set_status('faild to load facts')
+            return rc
+
+        set_status('materializing facts...')
+        rc = materialize(proj_id, method=method, profiler=profiler)
+        if rc != 0:
+            set_status('faild to materialize facts')
+        return rc
+
+    restored = False
+    if state and state.is_valid():
+        set_status('restoring FB...')
+        restored = restore_fb(state.get_fb_dir()) == 0
+
+    # an FB that is not kept needs no checkpoints until loading is done
+    ckpt = virtuoso.CKPT_ADAPTIVE if state else virtuoso.CKPT_BULK
+
+    # parse concurrently with loading
+    parser = None
+    if parse_ver and not restored:
+        set_status('parsing source files...')
+        parser = ParseThread(proj_dir, proj_id, parse_ver, nworkers=parse_workers)
+        parser.start()
+
+    # start from an FB with the ontologies loaded
+    templated = False
+    if template and not restored:
+        set_status('preparing FB from template...')
+        templated = clone_template(template, mem=mem, port=port) == 0
+
     # start virtuoso
     set_status('starting virtuoso...')
-    rc = start_virtuoso(mem=mem, pw=pw, port=port)
+    # facts are not there yet when parsing concurrently
+    src_root = proj_dir if parser else None
+    rc = start_virtuoso(mem=mem, pw=pw, port=port, set_pw=not restored,
+                        nconns=nconns, src_root=src_root)
     if rc != 0:
         set_status('failed to start virtuoso')
+        if parser:
+            parser.join()
         return rc
 
-    # load facts
-    set_status('loading facts...')
-    rc = load_fact(proj_id, pw=pw, port=port)
-    if rc != 0:
-        set_status('faild to load facts')
-        return rc
+    if restored:
+        # update facts of changed files
+        set_status('updating facts...')
+        rc = update_fact(proj_id, state, pw=pw, port=port)
+        if rc != 0:
+            set_status('faild to update facts')
+            return rc
+
+    elif parser:
+        # load facts as they are produced
+        set_status('parsing source files and loading facts...')
+        rc = load_fact_stream(proj_id, parser.is_done, pw=pw, port=port, checkpoint=ckpt)
+        parser.join()
+        if parser.rc != 0:
+            set_status('faild to parse source files')
+            return parser.rc
+        if rc != 0:
+            set_status('faild to load facts')
+            return rc
 
-    # load ontologies
-    set_status('loading ontologies...')
-    rc = load_ont(pw=pw, port=port)
-    if rc != 0:
-        set_status('faild to load ontologies')
-        return rc
+    else:
+        # load facts
+        set_status('loading facts...')
+        rc = load_fact(proj_id, pw=pw, port=port, checkpoint=ckpt)
+        if rc != 0:
+            set_status('faild to load facts')
+            return rc
+
+    if not restored:
+        if state:
+            state.record(os.path.join(FACT_DIR, proj_id))
+
+    if not restored and not templated:
+        # load ontologies
+        set_status('loading ontologies...')
+        rc = load_ont(pw=pw, port=port)
+        if rc != 0:
+            set_status('faild to load ontologies')
+            return rc
 
     # materialize facts
     set_status('materializing facts...')
-    rc = materialize(proj_id, pw=pw, port=port)
+    rc = materialize(proj_id, method=method, pw=pw, port=port, profiler=profiler,
+                     nworkers=mat_workers)
     if rc != 0:
         set_status('faild to materialize facts')
         return rc
@@ -352,12 +696,52 @@ def create_argparser(desc):
                         help='keep FB')
 
     parser.add_argument('-m', '--mem', dest='mem', metavar='GB', type=int,
-                        choices=[2, 4, 8, 16, 32, 48, 64], default=4,
-                        help='set available memory (GB)')
+                        choices=[0, 2, 4, 8, 16, 32, 48, 64], default=4,
+                        help='set available memory (GB, 0: auto)')
 
     parser.add_argument('-p', '--port', dest='port', default=DEFAULT_PORT,
                         metavar='PORT', type=int, help='set port number')
 
+    parser.add_argument('-j', '--nworkers', dest='nworkers', default=0,
+                        metavar='N', type=int, help='execute metrics queries on N connections concurrently')
+
+    parser.add_argument('-c', '--cache', dest='cache', action='store_true',
+                        help='cache query results and reuse them for unchanged source trees')
+
+    parser.add_argument('--profile', dest='profile', action='store_true',
+                        help='write a profile of SPARQL queries for each stage')
+
+    parser.add_argument('--slow-query-thresh', dest='slow_thresh', default=SLOW_QUERY_THRESH,
+                        metavar='SEC', type=float, help='log queries taking longer than SEC seconds')
+
+    parser.add_argument('--local-store-thresh', dest='local_thresh', default=LOCAL_STORE_THRESH,
+                        metavar='MB', type=int,
+                        help='use an in-process store instead of virtuoso for facts smaller than MB')
+
+    parser.add_argument('-i', '--incremental', dest='incremental', action='store_true',
+                        help='keep FB and load facts of changed files only on re-analysis')
+
+    parser.add_argument('--snapshot', dest='snapshot', action='store_true',
+                        help='reuse an FB built for the same source tree, parser and queries')
+
+    parser.add_argument('--snapshot-dir', dest='snapshot_dir', metavar='DIR', default=None,
+                        help='set directory of FB snapshots (in the output directory by default)')
+
+    parser.add_argument('--no-template', dest='template', action='store_false',
+                        help='load ontologies into each FB instead of cloning a database template')
+
+    parser.add_argument('--template-dir', dest='template_dir', metavar='DIR', default=TEMPLATE_DIR,
+                        help='set directory of database templates')
+
+    parser.add_argument('--parse-workers', dest='parse_workers', default=1,
+                        metavar='N', type=int, help='parse source files with N parsesrc processes')
+
+    parser.add_argument('--mat-workers', dest='mat_workers', default=MATERIALIZE_WORKERS,
+                        metavar='N', type=int, help='execute independent materialization queries on N connections')
+
+    parser.add_argument('--pipeline', dest='pipeline', action='store_true',
+                        help='load facts while source files are being parsed')
+
     parser.add_argument('--proj', dest='proj', metavar='PROJ_ID', default=None,
                         help='set project id (generated from proj_dir by default)')
 
@@ -382,9 +766,26 @@ def get_dest_root(proj_dir):
 
 
 class AnalyzerBase(object):
-    def __init__(self, mem=4, pw=None, port=DEFAULT_PORT):
+    def __init__(self, mem=4, pw=None, port=DEFAULT_PORT, nworkers=0, cache=False,
+                 profile=False, slow_thresh=SLOW_QUERY_THRESH, local_thresh=LOCAL_STORE_THRESH,
+                 incremental=False, pipeline=False, parse_workers=1,
+                 snapshot=False, snapshot_dir=None, template=True, template_dir=TEMPLATE_DIR,
+                 mat_workers=MATERIALIZE_WORKERS):
         self._mem = mem
         self._port = port
+        self._nworkers = nworkers
+        self._use_cache = cache
+        self._local_thresh = local_thresh
+        self._incremental = incremental
+        self._pipeline = pipeline
+        self._parse_workers = parse_workers
+        self._mat_workers = mat_workers
+        self._snapshot = snapshot
+        self._snapshot_dir = snapshot_dir
+        self._template = None
+        if template and ensure_dir(template_dir):
+            self._template = fb_store.FBStore(template_dir, max_snapshots=1)
+        self._method = 'odbc'
 
         if pw == None:
             self._pw = gen_password()
@@ -393,9 +794,124 @@ class AnalyzerBase(object):
 
         log('pw=%s port=%d' % (self._pw, self._port))
 
+        self._pool = None
+        self._result_cache = None
+        self._fingerprint = None
+        self._fb_key = None
+        self._hash_cache = None
+
+        self._profiler = None
+        if profile:
+            self._profiler = sparql.QueryProfiler(slow_thresh=slow_thresh)
+
+    def get_result_cache(self):
+        return self._result_cache
+
+    def get_profiler(self):
+        return self._profiler
+
+    def save_profile(self, dest_root, stage):
+        if self._profiler:
+            try:
+                self._profiler.save(os.path.join(dest_root, PROFILE_DIR_NAME), stage)
+            except Exception as e:
+                log('failed to save query profile: %s' % e)
+
+    def save_hash_cache(self):
+        try:
+            self._hash_cache.save()
+        except Exception as e:
+            log('failed to save file hashes: %s' % e)
+
+    def get_fingerprint(self, proj_dir, dest_root):
+        # computed once per analysis, for both the result cache and the snapshot key
+        if self._fingerprint == None:
+            log('computing source tree fingerprint...')
+            cache_dir = os.path.join(dest_root, CACHE_DIR_NAME)
+            self._hash_cache = HashCache(os.path.join(cache_dir, HASH_CACHE_FILE_NAME))
+            self._fingerprint = sparql.compute_fingerprint(proj_dir, exclude=FINGERPRINT_EXCLUDE,
+                                                           cache=self._hash_cache)
+            self.save_hash_cache()
+        return self._fingerprint
+
+    def get_fb_key(self, proj_dir, proj_id, dest_root):
+        # everything the FB is built from: sources, parser, ontologies and queries
+        if self._fb_key == None:
+            log('computing FB key...')
+            self._fb_key = get_snapshot_key(proj_dir, proj_id,
+                                            src_fp=self.get_fingerprint(proj_dir, dest_root))
+        return self._fb_key
+
+    def setup_result_cache(self, proj_dir, proj_id, dest_root):
+        cache_dir = os.path.join(dest_root, CACHE_DIR_NAME)
+        fb_key = self.get_fb_key(proj_dir, proj_id, dest_root)
+        # queries are built by the scripts, so results are also keyed on them
+        code_fp = sparql.compute_fingerprint(SCRIPTS_PATH, exts=['.py'], cache=self._hash_cache)
+        self.save_hash_cache()
+        log('fingerprint: %s (FB: %s, code: %s)' % (self._fingerprint, fb_key, code_fp))
+        self._result_cache = sparql.ResultCache(cache_dir, fb_store.combine_keys([fb_key, code_fp]))
+        return self._result_cache
+
+    def setup_snapshot_store(self, proj_dir, proj_id, dest_root):
+        store_dir = self._snapshot_dir
+        if store_dir == None:
+            store_dir = os.path.join(dest_root, FB_STORE_DIR_NAME)
+        if not ensure_dir(store_dir):
+            return (None, None)
+        key = self.get_fb_key(proj_dir, proj_id, dest_root)
+        log('snapshot key: %s' % key)
+        return (fb_store.FBStore(store_dir), key)
+
+    def get_method(self):
+        return self._method
+
+    def get_nconns(self):
+        return get_nconns(nworkers=self._nworkers, mat_workers=self._mat_workers)
+
+    def get_pool(self):
+        if self._method != 'odbc':
+            return None
+        if self._pool == None:
+            maxsize = max(virtuoso.DEFAULT_POOL_SIZE, self._nworkers + 1)
+            self._pool = sparql.get_pool(pw=self._pw, port=self._port, maxsize=maxsize)
+        return self._pool
+
+    def close_pool(self):
+        if self._pool:
+            self._pool.close()
+            self._pool = None
+
     def analyze_facts(self, proj_dir, proj_id, ver, dest_root):
         pass
 
+    def build(self, proj_dir, proj_id, ver, dest_root, set_status, state=None, allow_local=True):
+        pipelined = self._pipeline and not (state and state.is_valid())
+
+        # parse
+        if not pipelined:
+            set_status('parsing source files...')
+            rc = parse(proj_dir, proj_id, ver, nworkers=self._parse_workers)
+            if rc != 0:
+                set_status('faild to parse source files')
+                return rc
+
+        # build FB
+        self._method = 'odbc'
+        if allow_local and not pipelined and not state and use_local_store(proj_id, thresh=self._local_thresh):
+            self._method = 'local'
+        set_status('building FB (%s)...' % self._method)
+        rc = build_fb(proj_dir, proj_id,
+                      mem=self._mem, pw=self._pw, port=self._port,
+                      set_status=set_status, profiler=self._profiler,
+                      method=self._method, state=state,
+                      parse_ver=ver if pipelined else None,
+                      parse_workers=self._parse_workers,
+                      template=self._template,
+                      mat_workers=self._mat_workers,
+                      nconns=self.get_nconns())
+        self.save_profile(dest_root, 'build_fb')
+        return rc
+
     def analyze_dir(self, proj_dir, proj_id=None, keep_fb=False):
         log('analyzing "%s"...' % proj_dir)
 
@@ -418,22 +934,63 @@ class AnalyzerBase(object):
 
         ver = get_custom_timestamp()
 
-        clear_dir(dest_root, exclude=['log'])
-
-        # parse
-        set_status('parsing source files...')
-        rc = parse(proj_dir, proj_id, ver)
-        if rc != 0:
-            set_status('faild to parse source files')
-            return
+        state = None
+        if self._incremental:
+            state = fact_state.FactState(os.path.join(dest_root, FB_STATE_DIR_NAME))
+            if state.is_valid():
+                ver = state.get_version()
+                self._pw = state.get_password()
+                log('updating FB (ver=%s)...' % ver)
+            else:
+                state.reset(ver, self._pw)
+
+        clear_dir(dest_root, exclude=['log', CACHE_DIR_NAME, FB_STATE_DIR_NAME, FB_STORE_DIR_NAME])
+
+        self._fingerprint = None
+        self._fb_key = None
+
+        cache = None
+        if self._use_cache:
+            cache = self.setup_result_cache(proj_dir, proj_id, dest_root)
+
+        store = None
+        key = None
+        meta = None
+        if self._snapshot and not (cache and cache.is_complete()):
+            (store, key) = self.setup_snapshot_store(proj_dir, proj_id, dest_root)
+            if store:
+                meta = store.lookup(key)
+
+        if cache and cache.is_complete():
+            ver = cache.get_version()
+            set_status('using cached query results (ver=%s)...' % ver)
+            state = None
+
+            def build_on_miss():
+                set_status('building FB for queries missing from the cache...')
+                if self.build(proj_dir, proj_id, ver, dest_root, set_status, allow_local=False) != 0:
+                    raise RuntimeError('failed to build FB')
+                set_status('analyzing facts...')
+
+            cache.set_miss_handler(build_on_miss)
+
+        elif meta:
+            ver = meta['ver']
+            self._pw = meta['pw']
+            set_status('restoring FB snapshot (ver=%s)...' % ver)
+            log('pw=%s' % self._pw)
+            rc = restore_snapshot(store, key, mem=self._mem, pw=self._pw, port=self._port,
+                                  nconns=self.get_nconns())
+            if rc != 0:
+                set_status('failed to restore FB snapshot')
+                return
+            state = None
+            store = None
 
-        # build FB
-        set_status('building FB...')
-        rc = build_fb(proj_dir, proj_id,
-                      mem=self._mem, pw=self._pw, port=self._port,
-                      set_status=set_status)
-        if rc != 0:
-            return
+        else:
+            rc = self.build(proj_dir, proj_id, ver, dest_root, set_status, state=state)
+            if rc != 0:
+                return
 
         backup_fb = None
         if keep_fb:
@@ -445,9 +1002,30 @@ class AnalyzerBase(object):
             self.analyze_facts(proj_dir, proj_id, ver, dest_root)
         except Exception as e:
             set_status('failed to analyze facts: %s' % e)
+            self.save_profile(dest_root, 'analyze_facts')
+            self.close_pool()
+            sparql.clear_uri_table()
             reset_virtuoso(pw=self._pw, port=self._port, backup_fb=backup_fb)
             return
 
+        self.save_profile(dest_root, 'analyze_facts')
+
+        self.close_pool()
+        sparql.clear_uri_table()
+
+        if cache:
+            cache.mark_complete(ver)
+
+        if store and self._method == 'odbc':
+            set_status('saving FB snapshot...')
+            save_snapshot(store, key, ver, pw=self._pw, port=self._port)
+
+        if state:
+            set_status('saving FB...')
+            if save_fb(state.get_fb_dir(), pw=self._pw, port=self._port) == 0:
+                state.save()
+            backup_fb = None
+
         # cleanup
         set_status('cleaning up temporary files...')
         reset_virtuoso(pw=self._pw, port=self._port, backup_fb=backup_fb)
@@ -30,12 +30,16 @@ from common import AnalyzerBase, OutlineForFlops, create_argparser
 class Analyzer(AnalyzerBase):
     def analyze_facts(self, proj_dir, proj_id, ver, dest_root, lang='fortran'):
         ol = OutlineForFlops(proj_id,
-                             method='odbc',
+                             method=self.get_method(),
                              pw=self._pw,
                              port=self._port,
                              proj_dir=os.path.dirname(proj_dir),
                              ver=ver,
-                             simple_layout=True)
+                             simple_layout=True,
+                             pool=self.get_pool(),
+                             nworkers=self._nworkers,
+                             cache=self.get_result_cache(),
+                             profiler=self.get_profiler())
 
         ol.gen_data(lang, outdir=dest_root, keep_rev=True)
 
@@ -46,7 +50,13 @@ def main():
 
     args = parser.parse_args()
 
-    a = Analyzer(mem=args.mem, pw=args.pw, port=args.port)
+    a = Analyzer(mem=args.mem, pw=args.pw, port=args.port, nworkers=args.nworkers,
+                 cache=args.cache, profile=args.profile, slow_thresh=args.slow_thresh,
+                 local_thresh=args.local_thresh, incremental=args.incremental,
+                 pipeline=args.pipeline, parse_workers=args.parse_workers,
+                 snapshot=args.snapshot, snapshot_dir=args.snapshot_dir,
+                 template=args.template, template_dir=args.template_dir,
+                 mat_workers=args.mat_workers)
 
     a.analyze_dir(args.proj_dir, proj_id=args.proj)
 
@@ -25,7 +25,8 @@ import os
 
 from common import log, cca_path, create_argparser, predict_kernels, collect_readme
 from common import AnalyzerBase, OutlineForSurveyCpp, OutlineForSurveyFortran
-from common import METRICS_DIR, TARGET_DIR_NAME, DEFAULT_PORT
+from common import METRICS_DIR, TARGET_DIR_NAME, DEFAULT_PORT, SLOW_QUERY_THRESH, LOCAL_STORE_THRESH
+from common import TEMPLATE_DIR, MATERIALIZE_WORKERS
 
 MODEL = 'minami'
 
@@ -45,8 +46,17 @@ OMIT_TBL = {
 
 class Analyzer(AnalyzerBase):
 
-    def __init__(self, mem=4, pw=None, port=DEFAULT_PORT, all_roots=False, all_sps=False):
-        AnalyzerBase.__init__(self, mem=mem, pw=pw, port=port)
+    def __init__(self, mem=4, pw=None, port=DEFAULT_PORT, all_roots=False, all_sps=False,
+                 nworkers=0, cache=False, profile=False, slow_thresh=SLOW_QUERY_THRESH,
+                 local_thresh=LOCAL_STORE_THRESH, incremental=False, pipeline=False,
+                 parse_workers=1, snapshot=False, snapshot_dir=None, template=True,
+                 template_dir=TEMPLATE_DIR, mat_workers=MATERIALIZE_WORKERS):
+        AnalyzerBase.__init__(self, mem=mem, pw=pw, port=port, nworkers=nworkers, cache=cache,
+                              profile=profile, slow_thresh=slow_thresh, local_thresh=local_thresh,
+                              incremental=incremental, pipeline=pipeline,
+                              parse_workers=parse_workers, snapshot=snapshot,
+                              snapshot_dir=snapshot_dir, template=template,
+                              template_dir=template_dir, mat_workers=mat_workers)
         self._all_roots = all_roots
         self._all_sps = all_sps
 
@@ -61,13 +71,17 @@ class Analyzer(AnalyzerBase):
         for lang in ('cpp', 'fortran'):
             log('outlining {} source code...'.format(lang))
             ol = OUTLINE_TBL[lang](proj_id,
-                                   method='odbc',
+                                   method=self.get_method(),
                                    pw=self._pw,
                                    port=self._port,
                                    proj_dir=proj_parent_dir,
                                    ver=ver,
                                    simple_layout=True,
-                                   all_sps=self._all_sps)
+                                   all_sps=self._all_sps,
+                                   pool=self.get_pool(),
+                                   nworkers=self._nworkers,
+                                   cache=self.get_result_cache(),
+                                   profiler=self.get_profiler())
 
             ol.gen_data(lang, dest_root, omitted=OMIT_TBL[lang], all_roots=self._all_roots)
 
@@ -105,7 +119,13 @@ def main():
     args = parser.parse_args()
 
     a = Analyzer(mem=args.mem, pw=args.pw, port=args.port, all_roots=args.all_roots,
-                 all_sps=args.all_sps)
+                 all_sps=args.all_sps, nworkers=args.nworkers, cache=args.cache,
+                 profile=args.profile, slow_thresh=args.slow_thresh,
+                 local_thresh=args.local_thresh, incremental=args.incremental,
+                 pipeline=args.pipeline, parse_workers=args.parse_workers,
+                 snapshot=args.snapshot, snapshot_dir=args.snapshot_dir,
+                 template=args.template, template_dir=args.template_dir,
+                 mat_workers=args.mat_workers)
 
     a.analyze_dir(args.proj_dir, proj_id=args.proj, keep_fb=args.keep_fb)
 
@@ -22,9 +22,14 @@
 
 __author__ = 'Masatomo Hashimoto <m.hashimoto@stair.center>'
 
+import os
+import psutil
+
 
 DEFAULT_PORT = 1111
 
+AUTO_MEM = 0 # derive settings from the host and the facts
+
 DEFAULT_BUFSIZES = (340000, 250000)
 
 BUFSIZE_TBL = {
@@ -37,6 +42,37 @@ BUFSIZE_TBL = {
     64 : (5450000, 4000000),
 }
 
+DEFAULT_PARAMS = {
+    'nthreads'  : 10,
+    'nconns'    : 10,
+    'qmem'      : '2G',
+    'tpq'       : 4,
+    'aqthreads' : 10,
+    'cost_time' : 400,
+    'exec_time' : 60,
+}
+
+BUFFER_SIZE = 8192 + 512 # bytes per buffer including overhead
+
+MEM_RATIO = 0.8          # of available memory for virtuoso
+BUFFER_MEM_RATIO = 0.66  # of virtuoso's memory for buffers
+QUERY_MEM_RATIO = 0.15   # of virtuoso's memory for query execution
+DIRTY_BUFFER_RATIO = 0.75
+
+DB_FACT_RATIO = 4        # estimated database size / compressed fact size
+FACT_SRC_RATIO = 2       # estimated compressed fact size / source size
+MIN_BUFFERS = 10000
+
+SEC_PER_FACT_GB = 60     # SPARQL execution time allowed per GB of facts
+MAX_EXEC_TIME = 3600 # sec
+
+CONN_MARGIN = 4 # connections for isql and other ad hoc clients
+
+CGROUP_MEM_FILES = [ # (limit, usage) list
+    ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+    ('/sys/fs/cgroup/memory/memory.limit_in_bytes', '/sys/fs/cgroup/memory/memory.usage_in_bytes'),
+]
+
 INI_FMT = '''
 [Database]
 DatabaseFile			= %(db_root)s/virtuoso.db
@@ -61,8 +97,8 @@ ServerPort			= %(port)d
 LiteMode			= 0
 DisableUnixSocket		= 1
 DisableTcpSocket		= 0
-MaxClientConnections		= 10
-CheckpointInterval		= -1
+MaxClientConnections		= %(nconns)d
+%(server_threads)sCheckpointInterval		= -1
 O_DIRECT			= 0
 CaseMode			= 2
 MaxStaticCursorRows		= 5000
@@ -84,12 +120,12 @@ TransactionAfterImageLimit      = 500000000
 PrefixResultNames               = 0
 MacSpotlight                    = 0
 IndexTreeMaps                   = 64
-MaxQueryMem 		 	= 2G
+MaxQueryMem 		 	= %(qmem)s
 VectorSize 		 	= 1000
 MaxVectorSize 		 	= 1000000
 AdjustVectorSize 	 	= 0
-ThreadsPerQuery 	 	= 4
-AsyncQueueMaxThreads 	 	= 10
+ThreadsPerQuery 	 	= %(tpq)d
+AsyncQueueMaxThreads 	 	= %(aqthreads)d
 
 NumberOfBuffers = %(nbufs)d
 MaxDirtyBuffers = %(mdbufs)d
@@ -103,7 +139,7 @@ EnabledDavVSP			= 0
 HTTPProxyEnabled		= 0
 TempASPXDir			= 0
 DefaultMailServer		= localhost:25
-ServerThreads			= 10
+ServerThreads			= %(nthreads)d
 MaxKeepAlives			= 10
 KeepAliveTimeout		= 10
 MaxCachedProxyConnections	= 10
@@ -143,20 +179,112 @@ DefaultHost			= localhost:8890
 
 [SPARQL]
 ResultSetMaxRows           	= 10000
-MaxQueryCostEstimationTime 	= 400
-MaxQueryExecutionTime      	= 60
+MaxQueryCostEstimationTime 	= %(cost_time)d
+MaxQueryExecutionTime      	= %(exec_time)d
 DefaultQuery               	= select distinct ?Concept where {[] a ?Concept} LIMIT 100
 DeferInferenceRulesInit    	= 0
 '''
 
-def gen_ini(db_root, fact_root, ont_root, outfile, mem=4, port=DEFAULT_PORT):
-    nbufs, mdbufs = BUFSIZE_TBL.get(mem, DEFAULT_BUFSIZES)
-    ini = INI_FMT % {'db_root':db_root,
-                     'port':port,
-                     'fact_root':fact_root,
-                     'ont_root':ont_root,
-                     'nbufs':nbufs,
-                     'mdbufs':mdbufs}
+def get_available_memory():
+    avail = psutil.virtual_memory().available
+    for (lim_file, usage_file) in CGROUP_MEM_FILES:
+        try:
+            with open(lim_file, 'r') as f:
+                lim = f.read().strip()
+            with open(usage_file, 'r') as f:
+                usage = int(f.read().strip())
+            if lim.isdigit():
+                avail = min(avail, int(lim) - usage)
+            break
+        except (OSError, ValueError):
+            pass
+    return max(0, avail)
+
+def get_fact_size(fact_root):
+    sz = 0
+    for (dpath, dns, fns) in os.walk(fact_root):
+        for fn in fns:
+            if fn.endswith('.nt.gz'):
+                sz += os.path.getsize(os.path.join(dpath, fn))
+    return sz
+
+def get_src_size(src_root):
+    sz = 0
+    for (dpath, dns, fns) in os.walk(src_root):
+        dns[:] = [dn for dn in dns if not dn.startswith('.')]
+        for fn in fns:
+            path = os.path.join(dpath, fn)
+            if os.path.isfile(path) and not os.path.islink(path):
+                sz += os.path.getsize(path)
+    return sz
+
+def get_auto_params(fact_size, avail=None, ncpus=None):
+    if avail == None:
+        avail = get_available_memory()
+    if ncpus == None:
+        ncpus = os.cpu_count() or 1
+
+    vmem = avail * MEM_RATIO
+
+    nbufs = int(vmem * BUFFER_MEM_RATIO / BUFFER_SIZE)
+    if fact_size > 0: # no more buffers than the database will need
+        nbufs = min(nbufs, int(fact_size * DB_FACT_RATIO / BUFFER_SIZE))
+    nbufs = max(MIN_BUFFERS, nbufs)
+
+    qmem = max(256, int(vmem * QUERY_MEM_RATIO / (1024 * 1024)))
+
+    exec_time = DEFAULT_PARAMS['exec_time']
+    exec_time = max(exec_time, min(MAX_EXEC_TIME, int(SEC_PER_FACT_GB * fact_size / (1024 ** 3))))
+    cost_time = int(exec_time * DEFAULT_PARAMS['cost_time'] / DEFAULT_PARAMS['exec_time'])
+
+    nthreads = max(DEFAULT_PARAMS['nthreads'], ncpus + 2)
+
+    params = {
+        'nbufs'     : nbufs,
+        'mdbufs'    : int(nbufs * DIRTY_BUFFER_RATIO),
+        'nthreads'  : nthreads,
+        'nconns'    : max(DEFAULT_PARAMS['nconns'], nthreads),
+        'qmem'      : '%dM' % qmem,
+        'tpq'       : max(1, min(ncpus, 16)),
+        'aqthreads' : max(DEFAULT_PARAMS['aqthreads'], ncpus),
+        'cost_time' : cost_time,
+        'exec_time' : exec_time,
+    }
+    return params
+
+def get_params(mem=4, fact_root=None, src_root=None, nconns=0):
+    if mem == AUTO_MEM:
+        fact_size = 0
+        if src_root: # facts are yet to be produced
+            fact_size = get_src_size(src_root) * FACT_SRC_RATIO
+        elif fact_root:
+            fact_size = get_fact_size(fact_root)
+        params = get_auto_params(fact_size)
+    else:
+        params = DEFAULT_PARAMS.copy()
+        nbufs, mdbufs = BUFSIZE_TBL.get(mem, DEFAULT_BUFSIZES)
+        params['nbufs'] = nbufs
+        params['mdbufs'] = mdbufs
+
+    if nconns > 0:
+        params['nconns'] = max(params['nconns'], nconns + CONN_MARGIN)
+
+    return params
+
+def gen_ini(db_root, fact_root, ont_root, outfile, mem=4, port=DEFAULT_PORT,
+            src_root=None, nconns=0):
+    params = get_params(mem=mem, fact_root=fact_root, src_root=src_root, nconns=nconns)
+    d = {'db_root':db_root,
+         'port':port,
+         'fact_root':fact_root,
+         'ont_root':ont_root,
+         'server_threads':''}
+    d.update(params)
+    if mem == AUTO_MEM:
+        d['server_threads'] = 'ServerThreads\t\t\t= %(nthreads)d\n' % params
+    ini = INI_FMT % d
 
     with open(outfile, 'w') as f:
         f.write(ini)
+
+    return params
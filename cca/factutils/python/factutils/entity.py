@@ -19,22 +19,27 @@
 '''
 
 
+from functools import lru_cache
+
 import RDF
 
-from .const import ENTITY_NS, EXTERNAL_NS, SEP
+from .const import ENTITY_NS, EXTERNAL_NS, SEP, SUB_SEP
 from .exn import Invalid_argument
 from .rdf import Resource
-from .range import LCRange, ORange, LORange, LCORange, MAX_RANGE
-from .fileid import FileDigest, FileDesc
+from .range import LCRange, ORange, LORange, LCORange, MAX_RANGE, compo_to_int, RangeIndex
+from .fileid import FileDigest, FileDesc, hash_algo_tbl
 from . import fileid
 from . import range
 
 import pathsetup
 import dp
 
+ENTITY_NS_LEN = len(ENTITY_NS)
 
 
 class External(Resource):
+    __slots__ = ()
+
     def __init__(self, sym=None, **args):
         nd = args.get('node', None)
         if nd != None:
@@ -49,13 +54,15 @@ class External(Resource):
     def __str__(self):
         return '<%s>' % self.get_uri()
 
+# the encoding and the local name are not stored since they are parts
+# of the URI of the node
 class SourceCodeEntity(Resource):
+    __slots__ = ('_file_id', '_range')
+
     def __init__(self, **args):
         Resource.__init__(self)
-        self._enc = None
         self._file_id = None
         self._range = MAX_RANGE
-        self._local_name = None
         self._node = None
         self._valid = False
 
@@ -119,28 +126,24 @@ class SourceCodeEntity(Resource):
 
 
         if self._file_id and self._range:
-            self._enc = self._file_id.get_enc()
+            enc = self._file_id.get_enc()
 
             self._valid = self._file_id.is_valid() & self._range.is_valid()
 
             if self._range == MAX_RANGE:
-                compos = [self._enc, self._file_id.encode()]
+                compos = [enc, self._file_id.encode()]
             else:
-                self._enc += self._range.get_enc()
-                compos = [self._enc, self._file_id.encode(), self._range.encode()]
+                enc += self._range.get_enc()
+                compos = [enc, self._file_id.encode(), self._range.encode()]
 
-            self._local_name = SEP.join(compos)
-            uri = RDF.Uri(ENTITY_NS + self._local_name)
+            uri = RDF.Uri(ENTITY_NS + SEP.join(compos))
             self._node = RDF.Node(uri)
 
         elif self._node:
             uri_str = str(self._node.uri)
             if uri_str.startswith(ENTITY_NS):
-                self._local_name = uri_str.replace(ENTITY_NS, '')
-
                 try:
-                    compos = self._local_name.split(SEP)
-                    self._enc = compos[0]
+                    compos = uri_str[ENTITY_NS_LEN:].split(SEP)
                     self._file_id = fileid.from_encoded(compos[1])
                     try:
                         self._range = range.from_encoded(compos[2])
@@ -166,7 +169,10 @@ class SourceCodeEntity(Resource):
 
 
     def get_encoding(self):
-        return self._enc
+        lname = self.get_local_name()
+        if lname == None:
+            return None
+        return lname.split(SEP, 1)[0]
 
     def get_range(self):
         return self._range
@@ -178,7 +184,12 @@ class SourceCodeEntity(Resource):
         return self._node.uri
 
     def get_local_name(self):
-        return self._local_name
+        if self._node is None:
+            return None
+        uri_str = str(self._node.uri)
+        if uri_str.startswith(ENTITY_NS):
+            return uri_str[ENTITY_NS_LEN:]
+        return None
 
     def contains(self, other):
         b = False
@@ -190,3 +201,145 @@ class SourceCodeEntity(Resource):
 
     def is_file(self):
         return self._range == MAX_RANGE
+
+
+
+DECODE_CACHE_SIZE = 65536
+
+RANGE_TBL = { # number of components -> range class
+    6 : LCORange,
+    4 : LCRange,
+    2 : ORange,
+}
+
+
+def _to_int(s):
+    try:
+        return int(s)
+    except ValueError:
+        return compo_to_int(s)
+
+
+def _decode_file_id(encoded):
+    compos = encoded.split(SUB_SEP, 1)
+    if compos[0] in hash_algo_tbl:
+        return FileDigest(compos[0], digest=compos[1])
+    return fileid.from_encoded(encoded)
+
+
+def _decode_range(encoded):
+    compos = encoded.split(SUB_SEP)
+    cls = RANGE_TBL.get(len(compos), None)
+    if cls == None:
+        return None
+    return cls(*[_to_int(x) for x in compos])
+
+
+# a read-only counterpart of SourceCodeEntity(uri=...) that needs no librdf
+class DecodedEntity(object):
+    __slots__ = ('_uri', '_file_id', '_range', '_valid')
+
+    def __init__(self, uri):
+        self._uri = uri
+        self._file_id = None
+        self._range = MAX_RANGE
+        self._valid = False
+
+        if uri.startswith(ENTITY_NS):
+            try:
+                compos = uri[ENTITY_NS_LEN:].split(SEP)
+                self._file_id = _decode_file_id(compos[1])
+                if len(compos) > 2:
+                    self._range = _decode_range(compos[2])
+                self._valid = self._file_id.is_valid() & self._range.is_valid()
+            except Exception:
+                self._valid = False
+
+    def __str__(self):
+        return '<%s>' % self._uri
+
+    def is_valid(self):
+        return self._valid
+
+    def get_encoding(self):
+        lname = self.get_local_name()
+        if lname == None:
+            return None
+        return lname.split(SEP, 1)[0]
+
+    def get_range(self):
+        return self._range
+
+    def get_file_id(self):
+        return self._file_id
+
+    def get_uri(self):
+        return self._uri
+
+    def get_local_name(self):
+        if self._uri.startswith(ENTITY_NS):
+            return self._uri[ENTITY_NS_LEN:]
+        return None
+
+    def contains(self, other):
+        b = False
+        if self._file_id == other._file_id:
+            b = self._range.contains(other._range)
+        return b
+
+    def is_file(self):
+        return self._range == MAX_RANGE
+
+
+@lru_cache(maxsize=DECODE_CACHE_SIZE)
+def from_uri(uri):
+    return DecodedEntity(str(uri))
+
+
+# indexes entities by file id and range to find the constructs that
+# enclose an entity etc. without comparing every pair
+class EntityIndex(dp.base):
+    def __init__(self, ents=()):
+        self._tbl = {} # file id -> RangeIndex
+        for ent in ents:
+            self.add(ent)
+
+    def __len__(self):
+        return sum([len(idx) for idx in self._tbl.values()])
+
+    def add(self, ent, value=None):
+        fid = ent.get_file_id()
+        if fid == None:
+            return
+        try:
+            idx = self._tbl[fid]
+        except KeyError:
+            idx = RangeIndex()
+            self._tbl[fid] = idx
+        if value == None:
+            value = ent
+        idx.add(ent.get_range(), value)
+
+    def get_index(self, fid):
+        return self._tbl.get(fid, None)
+
+    def _query(self, ent, meth):
+        idx = self._tbl.get(ent.get_file_id(), None)
+        if idx == None:
+            return []
+        return getattr(idx, meth)(ent.get_range())
+
+    def get_containing(self, ent):
+        return self._query(ent, 'get_containing')
+
+    def get_contained(self, ent):
+        return self._query(ent, 'get_contained')
+
+    def get_overlapping(self, ent):
+        return self._query(ent, 'get_overlapping')
+
+    def get_enclosing(self, ent): # the innermost one other than ent
+        for v in reversed(self.get_containing(ent)):
+            if v != ent:
+                return v
+        return None
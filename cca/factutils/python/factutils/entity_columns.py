@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+'''
+  Factutils: columnar decoding of source code entity URIs
+
+  Copyright 2012-2020 Codinuum Software Lab <https://codinuum.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+'''
+
+# Decodes a column of entity URIs into parallel arrays instead of
+# SourceCodeEntity objects. Missing components are -1.
+
+import numpy as np
+
+from .const import ENTITY_NS, SEP, SUB_SEP
+from .fileid import FidEnc, hash_algo_tbl
+
+ENTITY_NS_LEN = len(ENTITY_NS)
+
+# range kinds
+K_INVALID = 0
+K_MAX     = 1
+K_O       = 2
+K_LC      = 3
+K_LO      = 4
+K_LCO     = 5
+
+LAYOUT_TBL = { # location encoding -> (kind, columns)
+    'O'   : (K_O,   ('so', 'eo')),
+    'LC'  : (K_LC,  ('sl', 'sc', 'el', 'ec')),
+    'LO'  : (K_LO,  ('sl', 'so', 'el', 'eo')),
+    'LCO' : (K_LCO, ('sl', 'sc', 'so', 'el', 'ec', 'eo')),
+}
+
+# used when the encoding does not tell the location kind or does not
+# agree with the number of components (as range.from_encoded)
+NCOMPOS_TBL = {
+    2 : 'O',
+    4 : 'LC',
+    6 : 'LCO',
+}
+
+COLUMNS = ('sl', 'sc', 'so', 'el', 'ec', 'eo')
+
+
+def get_loc_enc(enc):
+    for fenc in (FidEnc.PVF, FidEnc.FD):
+        if enc.startswith(fenc):
+            return enc[len(fenc):]
+    return None
+
+
+def compo_to_int(s): # as range.compo_to_int
+    try:
+        return int(s)
+    except ValueError:
+        return -1
+
+
+def get_fid_value(encoded):
+    compos = encoded.split(SUB_SEP, 1)
+    if compos[0] in hash_algo_tbl:
+        return compos[1] # as FileDigest.get_value()
+    return encoded
+
+
+class EntityColumns(object):
+    def __init__(self, n):
+        self.fids = []  # fid index -> value of file id
+        self.fid = np.full(n, -1, dtype=np.int32)
+        self.kind = np.zeros(n, dtype=np.int8)
+        for c in COLUMNS:
+            setattr(self, c, np.full(n, -1, dtype=np.int64))
+        self.valid = np.zeros(n, dtype=bool)
+
+    def __len__(self):
+        return len(self.fid)
+
+    def get_fid(self, i):
+        return self.fids[self.fid[i]] if self.fid[i] >= 0 else None
+
+
+def decode_uris(uris):
+    uris = list(uris)
+    cols = EntityColumns(len(uris))
+
+    fid_tbl = {} # encoded file id -> index
+    groups = {}  # location encoding -> (row indices, range strings)
+    max_rows = []
+
+    for (i, uri) in enumerate(uris):
+        if not uri or not uri.startswith(ENTITY_NS):
+            continue
+        compos = uri[ENTITY_NS_LEN:].split(SEP)
+        if len(compos) < 2:
+            continue
+
+        fenc = compos[1]
+        fi = fid_tbl.get(fenc, None)
+        if fi == None:
+            fi = len(cols.fids)
+            fid_tbl[fenc] = fi
+            cols.fids.append(get_fid_value(fenc))
+        cols.fid[i] = fi
+
+        if len(compos) < 3:
+            max_rows.append(i)
+            continue
+
+        r = compos[2]
+        n = r.count(SUB_SEP) + 1
+        loc = get_loc_enc(compos[0])
+        if loc not in LAYOUT_TBL or len(LAYOUT_TBL[loc][1]) != n:
+            loc = NCOMPOS_TBL.get(n, None)
+            if loc == None:
+                continue
+        try:
+            g = groups[loc]
+        except KeyError:
+            g = ([], [])
+            groups[loc] = g
+        g[0].append(i)
+        g[1].append(r)
+
+    if max_rows:
+        cols.kind[max_rows] = K_MAX
+        cols.sl[max_rows] = 1
+        cols.sc[max_rows] = 0
+        cols.so[max_rows] = 0
+        cols.valid[max_rows] = True
+
+    for (loc, (rows, rs)) in groups.items():
+        (kind, names) = LAYOUT_TBL[loc]
+        ncols = len(names)
+        rows = np.array(rows, dtype=np.int64)
+
+        # parse all the ranges of the same layout at once ('U': unknown)
+        toks = SUB_SEP.join(rs).split(SUB_SEP)
+        try:
+            vals = np.array([t if t != 'U' else '-1' for t in toks], dtype=np.int64)
+        except ValueError: # malformed components are -1 as in range.from_encoded
+            vals = np.array([compo_to_int(t) for t in toks], dtype=np.int64)
+        vals = vals.reshape(-1, ncols)
+
+        for (k, name) in enumerate(names):
+            getattr(cols, name)[rows] = vals[:, k]
+        cols.kind[rows] = kind
+
+        valid = np.ones(len(rows), dtype=bool)
+        if 'sc' in names:
+            sl, el = vals[:, names.index('sl')], vals[:, names.index('el')]
+            sc, ec = vals[:, names.index('sc')], vals[:, names.index('ec')]
+            valid &= np.where(sl == el, sc <= ec, sl < el)
+        elif 'sl' in names:
+            valid &= vals[:, names.index('sl')] <= vals[:, names.index('el')]
+        if 'so' in names:
+            valid &= vals[:, names.index('so')] <= vals[:, names.index('eo')]
+        cols.valid[rows] = valid
+
+    return cols
@@ -18,11 +18,16 @@
   limitations under the License.
 '''
 
+import io
 import os
+import mmap
+import json
 import hashlib
-from functools import reduce
+from functools import reduce, partial
+from concurrent.futures import ProcessPoolExecutor
 
 from .exn import Invalid_argument
+from .immutable import Immutable
 from .const import SUB_SEP, SUB_SUB_SEP
 
 import pathsetup
@@ -74,52 +79,169 @@ hash_algo_tbl = {
     HashAlgo.SHA256    : hashlib.sha256,
     HashAlgo.SHA384    : hashlib.sha384,
     HashAlgo.SHA512    : hashlib.sha512,
-    HashAlgo.RIPEMD160 : hashlib.new('ripemd160'),
+    HashAlgo.RIPEMD160 : partial(hashlib.new, 'ripemd160'),
     HashAlgo.GIT       : hashlib.sha1,
     HashAlgo.PATH      : hashlib.sha1,
 }
 
 
 
-def _compute_hash(algo, f, path=None):
-    digest = None
+HASH_BUFSIZE = 1024 * 1024
+MMAP_THRESHOLD = 64 * 1024 * 1024 # files at least this large are mmapped
+
+MIN_FILES_FOR_POOL = 64
+
+def _new_hash(algo, path=None, size=None):
     h = hash_algo_tbl.get(algo, None)
     if h == None:
         raise Invalid_argument(algo)
-
-    content = f.read()
+    h = h()
 
     if algo == HashAlgo.GIT:
-        head = 'blob %d\0' % (len(content))
-        content = head + content
+        h.update(b'blob %d\0' % size)
 
     elif algo == HashAlgo.PATH:
         if path:
-            head = '%s\0' % path
-            content = head + content
+            h.update(path.encode('utf-8', 'surrogateescape') + b'\0')
         else:
             dp.warning('path not specified')
 
-    digest = h(content).hexdigest()
+    return h
+
+def _read_chunks(f):
+    for chunk in iter(lambda: f.read(HASH_BUFSIZE), b''):
+        if not chunk:
+            break
+        if isinstance(chunk, str):
+            raise Invalid_argument('text stream (open it in binary mode)')
+        yield chunk
+
+def _compute_hash(algo, f, path=None, size=None):
+    # digests are over the bytes of the file: re-encoding decoded text
+    # would not reproduce them and would disagree with the size in the
+    # GIT header
+    if isinstance(f, io.TextIOBase):
+        raise Invalid_argument('text stream (open it in binary mode)')
+
+    chunks = _read_chunks(f)
+    if algo == HashAlgo.GIT and size == None:
+        try:
+            size = os.fstat(f.fileno()).st_size - f.tell()
+        except Exception:
+            # the size is needed before the content
+            chunks = list(chunks)
+            size = sum([len(c) for c in chunks])
 
-    return digest
+    h = _new_hash(algo, path=path, size=size)
+    for chunk in chunks:
+        h.update(chunk)
+
+    return h.hexdigest()
 
 def compute_hash(algo, fname):
-    digest = None
-    f = None
+    with open(fname, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            return _compute_hash(algo, f, path=fname, size=size)
+
+        h = _new_hash(algo, path=fname, size=size)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            h.update(m)
+        return h.hexdigest()
+
+
+def _hash_file_job(args):
+    (algo, path) = args
     try:
-        f = open(fname, 'r')
-        digest = _compute_hash(algo, f, path=fname)
+        st = os.stat(path)
+        return (st.st_size, st.st_mtime_ns, compute_hash(algo, path))
+    except OSError:
+        return None
 
-    except Exception as e:
-#        dp.warning(str(e))
-        raise
 
-    finally:
-        if f:
-            f.close()
+class HashCache(dp.base):
+    def __init__(self, path=None):
+        self._path = path
+        self._tbl = {} # algo -> path -> [size, mtime, digest]
+        self._modified = False
+        if path:
+            try:
+                with open(path, 'r') as f:
+                    self._tbl = json.load(f)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                self.warning('ignoring broken hash cache: %s' % e)
+
+    def lookup(self, algo, path, st):
+        ent = self._tbl.get(algo, {}).get(path, None)
+        if ent and ent[0] == st.st_size and ent[1] == st.st_mtime_ns:
+            return ent[2]
+        return None
+
+    def add(self, algo, path, size, mtime, digest):
+        self._tbl.setdefault(algo, {})[path] = [size, mtime, digest]
+        self._modified = True
+
+    def save(self):
+        if not self._path or not self._modified:
+            return
+        d = os.path.dirname(self._path)
+        if d and not os.path.exists(d):
+            os.makedirs(d)
+        tmp = self._path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._tbl, f)
+        os.replace(tmp, self._path)
+        self._modified = False
+
+
+def compute_hashes(algo, paths, nprocs=None, cache=None):
+    tbl = {} # path -> digest
+    todo = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if cache:
+            try:
+                digest = cache.lookup(algo, path, os.stat(path))
+            except OSError:
+                continue
+            if digest:
+                tbl[path] = digest
+                continue
+        todo.append(path)
+
+    jobs = [(algo, path) for path in todo]
+    if nprocs == 1 or len(todo) < MIN_FILES_FOR_POOL:
+        results = list(map(_hash_file_job, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=nprocs) as executor:
+            results = list(executor.map(_hash_file_job, jobs, chunksize=16))
+
+    for (path, res) in zip(todo, results):
+        if res:
+            (size, mtime, digest) = res
+            tbl[path] = digest
+            if cache:
+                cache.add(algo, path, size, mtime, digest)
+
+    return tbl
+
+def hash_tree(algo, root, exts=None, exclude=[], nprocs=None, cache=None):
+    paths = []
+    for (dpath, dns, fns) in os.walk(root):
+        dns[:] = [x for x in dns if x not in exclude]
+        for fn in fns:
+            if exts and not any(fn.endswith(ext) for ext in exts):
+                continue
+            p = os.path.join(dpath, fn)
+            if os.path.isfile(p):
+                paths.append(p)
+
+    tbl = compute_hashes(algo, paths, nprocs=nprocs, cache=cache)
 
-    return digest
+    root = os.path.abspath(root)
+    return dict((os.path.relpath(p, root), d) for (p, d) in tbl.items())
 
 
 
@@ -144,25 +266,34 @@ def decode_string(encoded):
     return s
 
 
-class FileId(dp.base):
+class FileId(dp.base, Immutable):
+    __slots__ = ('_valid', '_encoded')
+
+    _enc = None
+
     def __init__(self):
         self._valid = False
         self._encoded = None
-        self._enc = None
 
     def __str__(self):
-        if self._encoded:
-            return self._encoded
+        encoded = self.encode()
+        if encoded:
+            return encoded
         else:
             return ''
 
     def __hash__(self):
-        return hash(self._encoded)
+        return hash(self.encode())
 
     def is_valid(self):
         return self._valid
 
+    def _encode(self):
+        return None
+
     def encode(self):
+        if self._encoded == None and self._valid:
+            self._encoded = self._encode()
         return self._encoded
 
     def get_enc(self):
@@ -170,6 +301,10 @@ class FileId(dp.base):
 
 
 class FileDigest(FileId):
+    __slots__ = ('_algo', '_digest')
+
+    _enc = FidEnc.FD
+
     @classmethod
     def from_encoded(cls, encoded):
         compos = encoded.split(SUB_SEP)
@@ -178,17 +313,16 @@ class FileDigest(FileId):
         fid = FileDigest(algo, digest=digest)
         return fid
 
-    def __init__(self, algo, path=None, stream=None, digest=None):
+    def __init__(self, algo, path=None, stream=None, digest=None, size=None):
         FileId.__init__(self)
         self._algo = algo
-        self._enc = FidEnc.FD
         self._digest = digest
         try:
             if path:
                 self._digest = compute_hash(algo, path)
                 self._valid = True
             elif stream:
-                self._digest = _compute_hash(algo, stream)
+                self._digest = _compute_hash(algo, stream, size=size)
                 self._valid = True
             elif digest:
                 self._valid = True
@@ -198,8 +332,10 @@ class FileDigest(FileId):
             self.warning(str(e))
             self._valid = False
 
-        if self._valid:
-            self._encoded = self._algo + SUB_SEP + self._digest
+    def _encode(self):
+        return self._algo + SUB_SEP + self._digest
+
+    __hash__ = FileId.__hash__
 
     def __eq__(self, other):
         res = False
@@ -217,7 +353,9 @@ class FileDigest(FileId):
         return self._digest
 
 
-class Version(dp.base):
+class Version(dp.base, Immutable):
+    __slots__ = ('_valid', '_kind', '_ver', '_encoded')
+
     @classmethod
     def from_encoded(cls, encoded):
         compos = encoded.split(SUB_SUB_SEP)
@@ -232,8 +370,9 @@ class Version(dp.base):
         self._kind = k
         self._ver = v
         self._encoded = None
-        if self._valid:
-            self._encoded = self._kind + SUB_SUB_SEP + encode_string(self._ver)
+
+    def __hash__(self):
+        return hash((self._kind, self._ver))
 
     def __eq__(self, other):
         res = False
@@ -255,10 +394,14 @@ class Version(dp.base):
         return self._ver
 
     def encode(self):
+        if self._encoded == None and self._valid:
+            self._encoded = self._kind + SUB_SUB_SEP + encode_string(self._ver)
         return self._encoded
 
 
-class ProjRelPath(dp.base):
+class ProjRelPath(dp.base, Immutable):
+    __slots__ = ('_proj_root', '_path', '_proj_rel_path', '_encoded')
+
     @classmethod
     def from_encoded(cls, encoded): # should be fixed
         proj_rel_path = decode_string(encoded)
@@ -277,6 +420,9 @@ class ProjRelPath(dp.base):
                 self._proj_rel_path = ''
         self._encoded = None
 
+    def __hash__(self):
+        return hash(self._proj_rel_path)
+
     def __eq__(self, other):
         res = False
         if isinstance(other, ProjRelPath):
@@ -303,6 +449,10 @@ class ProjRelPath(dp.base):
 
 
 class FileDesc(FileId):
+    __slots__ = ('_proj', '_ver', '_proj_rel_path')
+
+    _enc = FidEnc.PVF
+
     @classmethod
     def from_encoded(cls, encoded):
         compos = encoded.split(SUB_SEP)
@@ -323,19 +473,17 @@ class FileDesc(FileId):
         self._proj = proj
         self._ver = ver
         self._proj_rel_path = rel_path
-        self._enc = FidEnc.PVF
-        self._encoded = None
-        if self._valid:
-            if self._proj_rel_path:
-                self._encoded = SUB_SEP.join([encode_string(self._proj), 
-                                              self._ver.encode(),
-                                              self._proj_rel_path.encode()])
 
-            else:
-                self._encoded = SUB_SEP.join([encode_string(self._proj), 
-                                              self._ver.encode()])
-                
+    def _encode(self):
+        if self._proj_rel_path:
+            return SUB_SEP.join([encode_string(self._proj),
+                                 self._ver.encode(),
+                                 self._proj_rel_path.encode()])
+        else:
+            return SUB_SEP.join([encode_string(self._proj),
+                                 self._ver.encode()])
 
+    __hash__ = FileId.__hash__
 
     def __eq__(self, other):
         res = False
@@ -357,12 +505,6 @@ class FileDesc(FileId):
     def get_proj_rel_path(self):
         return self._proj_rel_path
 
-    def encode(self):
-        return self._encoded
-
-    def get_enc(self):
-        return self._enc
-
     def get_value(self):
         return self.encode()
 
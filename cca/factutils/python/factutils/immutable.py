@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+'''
+  Factutils: immutable value objects
+
+  Copyright 2012-2020 Codinuum Software Lab <https://codinuum.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+'''
+
+class ImmutableMeta(type):
+    # freezes instances once they are constructed
+    def __call__(cls, *args, **kwargs):
+        obj = type.__call__(cls, *args, **kwargs)
+        object.__setattr__(obj, '_frozen', True)
+        return obj
+
+
+class Immutable(metaclass=ImmutableMeta):
+    __slots__ = ('_frozen',)
+
+    _mutable = ('_encoded',) # lazily computed caches
+
+    def __setattr__(self, name, value):
+        if name not in self._mutable and getattr(self, '_frozen', False):
+            raise AttributeError('%s object is immutable' % type(self).__name__)
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        if getattr(self, '_frozen', False):
+            raise AttributeError('%s object is immutable' % type(self).__name__)
+        object.__delattr__(self, name)
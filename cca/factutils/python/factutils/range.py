@@ -19,8 +19,10 @@
 '''
 
 from functools import reduce
+from bisect import bisect_left, bisect_right
 
 from .const import SUB_SEP
+from .immutable import Immutable
 
 import pathsetup
 import dp
@@ -36,21 +38,36 @@ def compo_to_int(s):
     return i
 
 
-class Range(dp.base):
+class Range(dp.base, Immutable):
+    # all the fields are declared here since LCORange inherits both
+    # LCRange and ORange
+    __slots__ = ('_valid', '_encoded',
+                 '_start_line', '_start_col', '_start_offset',
+                 '_end_line', '_end_col', '_end_offset')
+
+    _enc = None
+
     def __init__(self):
         self._valid = False
         self._encoded = None
-        self._enc = None
 
     def is_valid(self):
         return self._valid
 
+    def get_compos(self):
+        return ()
+
     def encode(self):
+        if self._encoded == None:
+            self._encoded = SUB_SEP.join([str(x) for x in self.get_compos()])
         return self._encoded
 
     def get_enc(self):
         return self._enc
 
+    def __hash__(self):
+        return hash((self._enc, self.get_compos()))
+
     def meet(self, other):
         self.warning('not implemented')
         return None
@@ -79,6 +96,10 @@ class LCRange(Range):
             dp.warning(str(e))
         return obj
 
+    __slots__ = ()
+
+    _enc = 'LC'
+
     def __init__(self, sl, sc, el, ec):
         Range.__init__(self)
         if sl == el:
@@ -89,11 +110,11 @@ class LCRange(Range):
         self._start_col = sc
         self._end_line = el
         self._end_col = ec
-        self._enc = 'LC'
-        self._encoded = SUB_SEP.join([str(x) for x in [self._start_line, 
-                                                       self._start_col, 
-                                                       self._end_line, 
-                                                       self._end_col]])
+
+    def get_compos(self):
+        return (self._start_line, self._start_col, self._end_line, self._end_col)
+
+    __hash__ = Range.__hash__
 
     def __eq__(self, other):
         res = False
@@ -186,14 +207,20 @@ class ORange(Range):
             dp.warning(str(e))
         return obj
 
+    __slots__ = ()
+
+    _enc = 'O'
+
     def __init__(self, so, eo):
         Range.__init__(self)
         self._valid = so <= eo
         self._start_offset = so
         self._end_offset = eo
-        self._enc = 'O'
-        self._encoded = SUB_SEP.join([str(x) for x in [self._start_offset,
-                                                       self._end_offset]])
+
+    def get_compos(self):
+        return (self._start_offset, self._end_offset)
+
+    __hash__ = Range.__hash__
 
     def __eq__(self, other):
         res = False
@@ -246,6 +273,10 @@ class LORange(ORange):
             dp.warning(str(e))
         return obj
         
+    __slots__ = ()
+
+    _enc = 'LO'
+
     def __init__(self, sl, so, el, eo):
         Range.__init__(self)
         valid0 = sl <= el and so <= eo
@@ -253,12 +284,11 @@ class LORange(ORange):
         self._end_line = el
         ORange.__init__(self, so, eo)
         self._valid = self._valid and valid0
-        self._enc = 'LO'
-        self._encoded = SUB_SEP.join([str(x) for x in [self._start_line, 
-                                                       self._start_offset,
-                                                       self._end_line, 
-                                                       self._end_offset]])
 
+    def get_compos(self):
+        return (self._start_line, self._start_offset, self._end_line, self._end_offset)
+
+    __hash__ = Range.__hash__
 
     def __eq__(self, other):
         res = False
@@ -267,6 +297,7 @@ class LORange(ORange):
                                                self._start_offset == other._start_offset,
                                                self._end_line == other._end_line,
                                                self._end_offset == other._end_offset])
+        return res
 
     def __str__(self):
         s = '%dL(%d)-%dL(%d)' % (self._start_line, 
@@ -314,19 +345,21 @@ class LCORange(LCRange, ORange):
             dp.warning(str(e))
         return obj
         
+    __slots__ = ()
+
+    _enc = 'LCO'
+
     def __init__(self, sl, sc, so, el, ec, eo):
         LCRange.__init__(self, sl, sc, el, ec)
         valid0 = self._valid
         ORange.__init__(self, so, eo)
         self._valid = self._valid and valid0
-        self._enc = 'LCO'
-        self._encoded = SUB_SEP.join([str(x) for x in [self._start_line, 
-                                                       self._start_col, 
-                                                       self._start_offset,
-                                                       self._end_line, 
-                                                       self._end_col,
-                                                       self._end_offset]])
 
+    def get_compos(self):
+        return (self._start_line, self._start_col, self._start_offset,
+                self._end_line, self._end_col, self._end_offset)
+
+    __hash__ = Range.__hash__
 
     def __eq__(self, other):
         res = False
@@ -337,6 +370,7 @@ class LCORange(LCRange, ORange):
                                                self._end_line == other._end_line,
                                                self._end_col == other._end_col,
                                                self._end_offset == other._end_offset])
+        return res
 
     def __str__(self):
         s = '%dL,%dC(%d)-%dL,%dC(%d)' % (self._start_line, 
@@ -379,11 +413,15 @@ class LCORange(LCRange, ORange):
 
 
 class MaxRange(Range):
+    __slots__ = ()
+
+    _enc = 'MAX'
+
     def __init__(self):
         Range.__init__(self)
         self._valid = True
-        self._enc = 'MAX'
-        self._encoded = ''
+
+    __hash__ = Range.__hash__
 
     def __eq__(self, other):
         return isinstance(other, MaxRange)
@@ -494,3 +532,158 @@ class Key(object):
             b = True
         return b
 
+
+# returns (kind, start, end), or None for the whole file. offsets are
+# used whenever they are available
+def get_interval(r):
+    if isinstance(r, MaxRange):
+        return None
+    if isinstance(r, ORange):
+        return ('O', r._start_offset, r._end_offset)
+    if isinstance(r, LCRange):
+        return ('LC', (r._start_line, r._start_col), (r._end_line, r._end_col))
+    return None
+
+
+class _Intervals(object):
+    # intervals sorted by start; _max_ends[mid] holds the maximum end in
+    # the implicit subtree [lo, hi) that has mid = (lo + hi) // 2 as its root
+    def __init__(self, items):
+        items.sort(key=lambda x: x[0])
+        self._starts = [x[0] for x in items]
+        self._ends = [x[1] for x in items]
+        self._values = [x[2] for x in items]
+        self._max_ends = list(self._ends)
+        self._build(0, len(items))
+
+    def __len__(self):
+        return len(self._starts)
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        m = self._ends[mid]
+        for c in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if c != None and c > m:
+                m = c
+        self._max_ends[mid] = m
+        return m
+
+    def _sort(self, idxs):
+        idxs.sort(key=lambda i: self._ends[i], reverse=True)
+        idxs.sort(key=lambda i: self._starts[i])
+        return idxs
+
+    def find_ending_after(self, hi, e):
+        # indices i < hi with _ends[i] >= e
+        res = []
+        stack = [(0, len(self._starts))]
+        while stack:
+            (lo, h) = stack.pop()
+            if lo >= h or lo >= hi:
+                continue
+            mid = (lo + h) // 2
+            if self._max_ends[mid] < e:
+                continue
+            stack.append((lo, mid))
+            if mid < hi:
+                if self._ends[mid] >= e:
+                    res.append(mid)
+                stack.append((mid + 1, h))
+        return self._sort(res)
+
+    def find_containing(self, s, e):
+        return self.find_ending_after(bisect_right(self._starts, s), e)
+
+    def find_overlapping(self, s, e):
+        return self.find_ending_after(bisect_right(self._starts, e), s)
+
+    def find_contained(self, s, e):
+        lo = bisect_left(self._starts, s)
+        hi = bisect_right(self._starts, e)
+        return self._sort([i for i in range(lo, hi) if self._ends[i] <= e])
+
+    def all(self):
+        return list(range(len(self._starts)))
+
+    def get_values(self, idxs):
+        return [self._values[i] for i in idxs]
+
+
+# an index of the ranges in a file: each query takes O(log n + k) time
+# and returns k values from the outermost range to the innermost one.
+# a query only finds ranges of the same kind (see get_interval)
+class RangeIndex(dp.base):
+    def __init__(self, items=()):
+        self._pending = []
+        self._whole = []     # values of MaxRange
+        self._tbl = {}       # kind -> _Intervals
+        self._size = 0
+        for (r, v) in items:
+            self.add(r, v)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, r, v):
+        if r == None or not r.is_valid():
+            return
+        self._size += 1
+        intv = get_interval(r)
+        if intv == None:
+            self._whole.append(v)
+        else:
+            self._pending.append((intv, v))
+
+    def _get_tbl(self):
+        if self._pending:
+            groups = {}
+            for (kind, intvs) in self._tbl.items():
+                groups[kind] = [(intvs._starts[i], intvs._ends[i], intvs._values[i]) for i in intvs.all()]
+            for ((kind, s, e), v) in self._pending:
+                groups.setdefault(kind, []).append((s, e, v))
+            self._tbl = dict((kind, _Intervals(items)) for (kind, items) in groups.items())
+            self._pending = []
+        return self._tbl
+
+    def _query(self, r, meth):
+        tbl = self._get_tbl()
+        intv = get_interval(r)
+        if intv == None:
+            return None
+        (kind, s, e) = intv
+        intvs = tbl.get(kind, None)
+        if intvs == None:
+            return []
+        return intvs.get_values(getattr(intvs, meth)(s, e))
+
+    def _get_all(self):
+        res = list(self._whole)
+        for intvs in self._get_tbl().values():
+            res += intvs.get_values(intvs.all())
+        return res
+
+    def get_containing(self, r):
+        res = self._query(r, 'find_containing')
+        if res == None:
+            return list(self._whole)
+        return self._whole + res
+
+    def get_innermost(self, r):
+        res = self.get_containing(r)
+        if res:
+            return res[-1]
+        return None
+
+    def get_contained(self, r):
+        res = self._query(r, 'find_contained')
+        if res == None:
+            return self._get_all()
+        return res
+
+    def get_overlapping(self, r):
+        res = self._query(r, 'find_overlapping')
+        if res == None:
+            return self._get_all()
+        return self._whole + res
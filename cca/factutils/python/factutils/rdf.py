@@ -34,6 +34,8 @@ def uri_split(uri):
 
 
 class RDFNode(dp.base):
+    __slots__ = ('_valid', '_node')
+
     def __init__(self, nd):
         self._valid = True
         self._node = nd
@@ -52,6 +54,8 @@ class RDFNode(dp.base):
         return self._node
 
 class Resource(RDFNode):
+    __slots__ = ()
+
     def __init__(self, uri=None, **args):
         nd = args.get('node', None)
         if nd != None:
@@ -110,6 +114,8 @@ class Resource(RDFNode):
 
 
 class Literal(RDFNode):
+    __slots__ = ()
+
     def __init__(self, literal="", **args):
         nd = args.get('node', None)
         if nd != None:
@@ -133,6 +139,8 @@ class Literal(RDFNode):
 
 
 class Predicate(Resource):
+    __slots__ = ('_ns', '_lname')
+
     def __init__(self, ns=None, lname=None, **args):
         self._lname = None
         self._ns = None
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+'''
+  Compares the columnar decoding of entity URIs with the per-row one
+
+  Copyright 2012-2020 Codinuum Software Lab <https://codinuum.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+'''
+
+import os
+import sys
+import unittest
+from importlib.util import find_spec
+
+FACTUTILS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(FACTUTILS_DIR)), 'scripts'))
+sys.path.insert(0, FACTUTILS_DIR)
+
+HAS_NUMPY = find_spec('numpy') != None
+
+FID = 'SHA1_0123456789abcdef0123456789abcdef01234567'
+
+
+def mkuri(enc, r):
+    from factutils.const import ENTITY_NS
+    return ENTITY_NS + 'FD' + enc + '-' + FID + '-' + r
+
+
+@unittest.skipUnless(HAS_NUMPY, 'numpy is not installed')
+class DecodeURIsTest(unittest.TestCase):
+
+    def decode(self, uris):
+        from factutils.entity_columns import decode_uris
+        return decode_uris(uris)
+
+    def check_row(self, cols, i, r):
+        from factutils import range
+        rng = range.from_encoded(r)
+        self.assertEqual(cols.valid[i], rng.is_valid())
+        for name in ('sl', 'sc', 'so', 'el', 'ec', 'eo'):
+            get = getattr(rng, 'get_%s_%s' % ({'s':'start','e':'end'}[name[0]],
+                                               {'l':'line','c':'col','o':'offset'}[name[1]]), None)
+            if get == None:
+                continue
+            v = get()
+            self.assertEqual(getattr(cols, name)[i], v, name)
+
+    def test_malformed_component(self):
+        rs = [('LC', '1_2_3_4'), ('LC', '5_0_5_9'), ('LC', 'x_1_3_9'), ('LCO', '1_2_10_3_4_40')]
+        cols = self.decode([mkuri(enc, r) for (enc, r) in rs])
+
+        self.assertEqual(list(cols.kind), [3, 3, 3, 5])
+        self.assertEqual(list(cols.valid), [True, True, True, True])
+        self.assertEqual(cols.sl[2], -1)
+        self.assertEqual((cols.sc[2], cols.el[2], cols.ec[2]), (1, 3, 9))
+        self.assertEqual((cols.sl[0], cols.sc[0], cols.el[0], cols.ec[0]), (1, 2, 3, 4))
+        self.assertEqual(cols.get_fid(3), '0123456789abcdef0123456789abcdef01234567')
+
+    def test_unknown_component(self):
+        cols = self.decode([mkuri('LC', 'U_U_U_U'), mkuri('LC', '1_0_2_0')])
+        self.assertEqual(list(cols.sl), [-1, 1])
+        self.assertEqual(list(cols.kind), [3, 3])
+
+    def test_ncompos_mismatch(self):
+        rs = [('LC', '1_2_10_3_4_40'), ('LC', '1_2_3_4'), ('O', '1_2_3'), ('LC', '10_20')]
+        cols = self.decode([mkuri(enc, r) for (enc, r) in rs])
+
+        self.assertEqual(list(cols.kind), [5, 3, 0, 2])
+        self.assertEqual(list(cols.valid), [True, True, False, True])
+        self.assertEqual((cols.so[0], cols.eo[0]), (10, 40))
+        self.assertEqual((cols.so[3], cols.eo[3]), (10, 20))
+
+    def test_per_row(self):
+        try:
+            from factutils import range
+        except ImportError:
+            self.skipTest('range is not importable')
+        rs = ['1_2_3_4', '3_5_3_1', 'x_1_3_9', '1_2_10_3_4_40', '1_2_10_3_4_x', '10_20', '20_10']
+        cols = self.decode([mkuri('LC', r) for r in rs])
+        for (i, r) in enumerate(rs):
+            self.check_row(cols, i, r)
+
+
+if __name__ == '__main__':
+    unittest.main()
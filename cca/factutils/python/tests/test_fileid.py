@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+'''
+  Checks file digests of paths and streams
+
+  Copyright 2012-2020 Codinuum Software Lab <https://codinuum.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+'''
+
+import io
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+FACTUTILS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(FACTUTILS_DIR)), 'scripts'))
+sys.path.insert(0, FACTUTILS_DIR)
+
+# non-ASCII text with CRLF line ends, which a text stream would alter
+CONTENT = 'program p\r\n  print *, "é"\r\nend program\r\n'.encode('utf-8')
+
+
+def git_blob_digest(data):
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+class ComputeHashTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'p.f90')
+        with open(self.path, 'wb') as f:
+            f.write(CONTENT)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_git_path(self):
+        from factutils.fileid import compute_hash, HashAlgo
+        self.assertEqual(compute_hash(HashAlgo.GIT, self.path), git_blob_digest(CONTENT))
+
+    def test_git_stream(self):
+        from factutils.fileid import _compute_hash, HashAlgo
+        expected = git_blob_digest(CONTENT)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(_compute_hash(HashAlgo.GIT, f), expected)
+        # no file descriptor, so the size comes from the content
+        self.assertEqual(_compute_hash(HashAlgo.GIT, io.BytesIO(CONTENT)), expected)
+        self.assertEqual(_compute_hash(HashAlgo.GIT, io.BytesIO(CONTENT), size=len(CONTENT)),
+                         expected)
+
+    def test_text_stream(self):
+        from factutils.fileid import _compute_hash, HashAlgo, FileDigest
+        from factutils.exn import Invalid_argument
+        for algo in (HashAlgo.GIT, HashAlgo.SHA1):
+            with open(self.path, 'r', encoding='utf-8', newline=None) as f:
+                with self.assertRaises(Invalid_argument):
+                    _compute_hash(algo, f)
+            with self.assertRaises(Invalid_argument):
+                _compute_hash(algo, io.StringIO(CONTENT.decode('utf-8')))
+        with open(self.path, 'r') as f:
+            self.assertFalse(FileDigest(HashAlgo.GIT, stream=f).is_valid())
+
+    def test_stream_agrees_with_path(self):
+        from factutils.fileid import compute_hash, _compute_hash, HashAlgo
+        for algo in (HashAlgo.MD5, HashAlgo.SHA1, HashAlgo.SHA256, HashAlgo.GIT):
+            with open(self.path, 'rb') as f:
+                self.assertEqual(_compute_hash(algo, f), compute_hash(algo, self.path), algo)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+'''
+  Compares the range and entity indexes with a brute-force scan
+
+  Copyright 2012-2020 Codinuum Software Lab <https://codinuum.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+'''
+
+import os
+import sys
+import random
+import unittest
+from importlib.util import find_spec
+
+FACTUTILS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(FACTUTILS_DIR)), 'scripts'))
+sys.path.insert(0, FACTUTILS_DIR)
+
+HAS_RDF = find_spec('RDF') != None
+
+FIDS = ['SHA1_0123456789abcdef0123456789abcdef01234567',
+        'SHA1_89abcdef0123456789abcdef0123456789abcdef']
+
+NRANGES = 300
+NQUERIES = 200
+
+
+def mkuri(fid, r):
+    from factutils.const import ENTITY_NS
+    return ENTITY_NS + 'O-' + fid + '-' + r
+
+
+def random_oranges(rnd, n, size=200):
+    from factutils.range import ORange
+    res = []
+    for _ in range(n):
+        s = rnd.randrange(size)
+        e = s + rnd.randrange(size // 4)
+        res.append(ORange(s, e))
+    return res
+
+
+def random_lcranges(rnd, n, size=20):
+    from factutils.range import LCRange
+    res = []
+    for _ in range(n):
+        sl = rnd.randrange(size)
+        el = sl + rnd.randrange(4)
+        sc = rnd.randrange(10)
+        ec = rnd.randrange(10) if el > sl else sc + rnd.randrange(5)
+        res.append(LCRange(sl, sc, el, ec))
+    return res
+
+
+def lc(r):
+    return ((r.get_start_line(), r.get_start_col()), (r.get_end_line(), r.get_end_col()))
+
+
+def o(r):
+    return (r.get_start_offset(), r.get_end_offset())
+
+
+class RangeIndexTest(unittest.TestCase):
+
+    def check(self, ranges, queries, bounds):
+        from factutils.range import RangeIndex
+        idx = RangeIndex((r, i) for (i, r) in enumerate(ranges))
+        self.assertEqual(len(idx), len(ranges))
+        for q in queries:
+            (qs, qe) = bounds(q)
+            spans = [bounds(r) for r in ranges]
+            containing = [i for (i, (s, e)) in enumerate(spans) if s <= qs and qe <= e]
+            contained = [i for (i, (s, e)) in enumerate(spans) if qs <= s and e <= qe]
+            overlapping = [i for (i, (s, e)) in enumerate(spans) if s <= qe and qs <= e]
+            self.assertEqual(sorted(idx.get_containing(q)), containing, str(q))
+            self.assertEqual(sorted(idx.get_contained(q)), contained, str(q))
+            self.assertEqual(sorted(idx.get_overlapping(q)), overlapping, str(q))
+
+            res = idx.get_containing(q)
+            for (i, j) in zip(res, res[1:]):
+                self.assertTrue(bounds(ranges[i])[0] <= bounds(ranges[j])[0])
+
+    def test_offsets(self):
+        rnd = random.Random(0)
+        ranges = random_oranges(rnd, NRANGES)
+        self.check(ranges, random_oranges(rnd, NQUERIES) + ranges[:20], o)
+
+    def test_offsets_agree_with_range(self):
+        from factutils.range import RangeIndex
+        rnd = random.Random(1)
+        ranges = random_oranges(rnd, NRANGES)
+        idx = RangeIndex((r, i) for (i, r) in enumerate(ranges))
+        for q in random_oranges(rnd, NQUERIES):
+            self.assertEqual(sorted(idx.get_containing(q)),
+                             [i for (i, r) in enumerate(ranges) if r.contains(q)])
+            self.assertEqual(sorted(idx.get_overlapping(q)),
+                             [i for (i, r) in enumerate(ranges) if r.overlaps(q)])
+
+    def test_lines_and_columns(self):
+        rnd = random.Random(2)
+        ranges = random_lcranges(rnd, NRANGES)
+        self.check(ranges, random_lcranges(rnd, NQUERIES) + ranges[:20], lc)
+
+    def test_incremental(self):
+        from factutils.range import RangeIndex
+        rnd = random.Random(3)
+        ranges = random_oranges(rnd, NRANGES)
+        idx = RangeIndex()
+        for (i, r) in enumerate(ranges):
+            idx.add(r, i)
+            if i % 50 == 0:
+                idx.get_containing(r)
+        queries = random_oranges(rnd, NQUERIES)
+        for q in queries:
+            self.assertEqual(sorted(idx.get_containing(q)),
+                             [i for (i, r) in enumerate(ranges) if r.contains(q)])
+
+    def test_whole_file(self):
+        from factutils.range import RangeIndex, ORange, MAX_RANGE
+        idx = RangeIndex([(MAX_RANGE, 'file'), (ORange(0, 10), 'a'), (ORange(2, 5), 'b')])
+        self.assertEqual(idx.get_containing(ORange(3, 4)), ['file', 'a', 'b'])
+        self.assertEqual(idx.get_innermost(ORange(3, 4)), 'b')
+        self.assertEqual(idx.get_contained(ORange(1, 6)), ['b'])
+        self.assertEqual(sorted(idx.get_contained(MAX_RANGE)), ['a', 'b', 'file'])
+        self.assertEqual(idx.get_overlapping(ORange(6, 20)), ['file', 'a'])
+
+
+@unittest.skipUnless(HAS_RDF, 'RDF is not installed')
+class EntityIndexTest(unittest.TestCase):
+
+    def test_against_brute_force(self):
+        from factutils.entity import EntityIndex, from_uri
+        rnd = random.Random(4)
+        ents = []
+        for fid in FIDS:
+            for r in random_oranges(rnd, NRANGES // 2):
+                ents.append(from_uri(mkuri(fid, str(r).replace('-', '_'))))
+        self.assertTrue(all(ent.is_valid() for ent in ents))
+        idx = EntityIndex(ents)
+        self.assertEqual(len(idx), len(ents))
+
+        for q in ents[::3]:
+            fid = q.get_file_id()
+            qr = q.get_range()
+            same = [ent for ent in ents if ent.get_file_id() == fid]
+            self.assertEqual(set(idx.get_containing(q)),
+                             set(ent for ent in same if ent.get_range().contains(qr)))
+            self.assertEqual(set(idx.get_contained(q)),
+                             set(ent for ent in same if qr.contains(ent.get_range())))
+            self.assertEqual(set(idx.get_overlapping(q)),
+                             set(ent for ent in same if ent.get_range().overlaps(qr)))
+            enc = idx.get_enclosing(q)
+            if enc != None:
+                self.assertTrue(enc.contains(q))
+                self.assertNotEqual(enc, q)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -40,7 +40,7 @@ def shorten_sha(sha):
     return sha[0:7]
 
 def get_fid(blob):
-    fid = FileDigest(HashAlgo.GIT, stream=blob.data_stream.stream)
+    fid = FileDigest(HashAlgo.GIT, stream=blob.data_stream.stream, size=blob.size)
     return fid
 
 def issrc(name):
@@ -31,6 +31,7 @@ short_style  = True
 #####
 
 class base(object):
+    __slots__ = ()
 
     def __output(self, mes, kind='', stream=sys.stdout):
         s = traceback.extract_stack()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+
+'''
+  A record of fact directories loaded into an FB
+
+  Copyright 2012-2020 Codinuum Software Lab <https://codinuum.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+'''
+
+# parsesrc puts the facts of each source file into a directory named
+# after the file's cache key, which is derived from the file digest.
+# Comparing the directory names of two runs therefore tells which files
+# were added, changed or removed without looking at the source tree.
+
+import os
+import re
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pathsetup
+import dp
+from factutils.const import ENTITY_NS, SEP
+
+STATE_FILE_NAME = 'state.json'
+FB_DIR_NAME = 'fb'
+FB_FILE_NAME = 'virtuoso.db'
+
+FACT_EXTS = ['.nt.gz']
+
+SUBJ_ENTITY_PAT = re.compile(r'<%s[A-Z]+%s(?P<fid>[^%s>]+)' % (re.escape(ENTITY_NS),
+                                                                  re.escape(SEP), re.escape(SEP)))
+
+
+def find_fact_dirs(fact_dir, exts=FACT_EXTS):
+    tbl = {} # cache name -> path
+    for (dpath, dns, fns) in os.walk(fact_dir):
+        if any(fn.endswith(ext) for fn in fns for ext in exts):
+            tbl[os.path.basename(dpath)] = dpath
+    return tbl
+
+
+def scan_file_ids(path, exts=FACT_EXTS):
+    fids = set()
+    for fn in os.listdir(path):
+        if any(fn.endswith(ext) for ext in exts):
+            with gzip.open(os.path.join(path, fn), 'rt', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    m = SUBJ_ENTITY_PAT.match(line)
+                    if m:
+                        fids.add(m.group('fid'))
+    return fids
+
+
+def scan_dirs(paths, nworkers=None):
+    tbl = {} # path -> file id set
+    with ThreadPoolExecutor(max_workers=nworkers) as executor:
+        for (path, fids) in zip(paths, executor.map(scan_file_ids, paths)):
+            tbl[path] = fids
+    return tbl
+
+
+class FactState(dp.base):
+    def __init__(self, state_dir):
+        self._state_dir = state_dir
+        self._path = os.path.join(state_dir, STATE_FILE_NAME)
+        self._ver = None
+        self._pw = None
+        self._dirs = {} # cache name -> file id list
+        self._valid = False
+        try:
+            with open(self._path, 'r') as f:
+                d = json.load(f)
+            self._ver = d['ver']
+            self._pw = d['pw']
+            self._dirs = d['dirs']
+            self._valid = self.has_fb()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.warning('ignoring broken state: %s' % e)
+
+    def is_valid(self):
+        return self._valid
+
+    def get_fb_dir(self):
+        return os.path.join(self._state_dir, FB_DIR_NAME)
+
+    def has_fb(self):
+        return os.path.exists(os.path.join(self.get_fb_dir(), FB_FILE_NAME))
+
+    def get_version(self):
+        return self._ver
+
+    def get_password(self):
+        return self._pw
+
+    def reset(self, ver, pw):
+        self._ver = ver
+        self._pw = pw
+        self._dirs = {}
+        self._valid = False
+
+    def diff(self, fact_dir):
+        cur = find_fact_dirs(fact_dir)
+        added = [cur[n] for n in sorted(cur.keys()) if n not in self._dirs]
+        removed = [n for n in sorted(self._dirs.keys()) if n not in cur]
+        return (added, removed)
+
+    def get_stale_file_ids(self, removed, added_fids):
+        removed = set(removed)
+        stale = set()
+        live = set(added_fids)
+        for (n, fids) in self._dirs.items():
+            if n in removed:
+                stale.update(fids)
+            else:
+                live.update(fids)
+        return stale - live
+
+    def record(self, fact_dir):
+        (added, removed) = self.diff(fact_dir)
+        self.update(added, removed, scan_dirs(added))
+
+    def update(self, added, removed, added_fids_tbl):
+        for n in removed:
+            del self._dirs[n]
+        for path in added:
+            n = os.path.basename(path)
+            self._dirs[n] = sorted(added_fids_tbl.get(path, []))
+
+    def save(self):
+        if not os.path.exists(self._state_dir):
+            os.makedirs(self._state_dir)
+        tmp = self._path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'ver':self._ver, 'pw':self._pw, 'dirs':self._dirs}, f)
+        os.replace(tmp, self._path)
+        self._valid = self.has_fb()
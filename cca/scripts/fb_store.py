@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+
+'''
+  A content-addressed store of prebuilt FB snapshots
+
+  Copyright 2012-2020 Codinuum Software Lab <https://codinuum.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+'''
+
+# A snapshot is keyed by everything an FB is built from: the source
+# tree, the parser, the ontologies and the materialization queries.
+# Each snapshot also records the version and password it was built
+# with, since the facts in the FB refer to the version.
+#
+# The same store holds database templates, i.e. empty databases with
+# the ontologies and the rule set loaded, keyed by the server binary and
+# the ontologies.
+
+import os
+import json
+import shutil
+import hashlib
+import time
+import fcntl
+from uuid import uuid4
+from contextlib import contextmanager
+
+import pathsetup
+import dp
+from sparql import compute_fingerprint
+import materialize_fact_for_tuning
+
+META_FILE_NAME = 'meta.json'
+LOCK_FILE_NAME = '.lock'
+
+TMP_SUFFIX = '.tmp'
+STALE_TMP_AGE = 24 * 60 * 60 # sec
+
+DEFAULT_MAX_SNAPSHOTS = 4
+
+HASH_BUFSIZE = 1024 * 1024
+
+
+def hash_file(path):
+    h = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_BUFSIZE), b''):
+                h.update(chunk)
+    except OSError:
+        return ''
+    return h.hexdigest()
+
+
+def get_query_set_fingerprint():
+    qdir = materialize_fact_for_tuning.QUERY_DIR
+    h = hashlib.sha1()
+    for lang in sorted(materialize_fact_for_tuning.QUERIES.keys()):
+        for q in materialize_fact_for_tuning.QUERIES[lang]:
+            h.update(('%s/%s:%s\n' % (lang, q, hash_file(os.path.join(qdir, q)))).encode('utf-8'))
+    return h.hexdigest()
+
+
+def combine_keys(keys):
+    h = hashlib.sha1()
+    for x in keys:
+        h.update(x.encode('utf-8')+b'\0')
+    return h.hexdigest()
+
+
+def compute_key(proj_id, src_fp, parser_path, ont_dir):
+    return combine_keys([proj_id,
+                         src_fp,
+                         hash_file(parser_path),
+                         compute_fingerprint(ont_dir),
+                         get_query_set_fingerprint()])
+
+
+def compute_template_key(server_path, ont_dir, graph_uri, rule_name):
+    return combine_keys([hash_file(server_path),
+                         compute_fingerprint(ont_dir),
+                         graph_uri,
+                         rule_name])
+
+
+class FBStore(dp.base):
+    def __init__(self, store_dir, max_snapshots=DEFAULT_MAX_SNAPSHOTS):
+        self._store_dir = store_dir
+        self._max_snapshots = max_snapshots
+
+    def get_path(self, key):
+        return os.path.join(self._store_dir, key)
+
+    def get_tmp_path(self, path):
+        return '%s%s.%d.%s' % (path, TMP_SUFFIX, os.getpid(), uuid4().hex)
+
+    @contextmanager
+    def lock(self, shared=False):
+        # snapshots are shared among processes through the store directory
+        os.makedirs(self._store_dir, exist_ok=True)
+        with open(os.path.join(self._store_dir, LOCK_FILE_NAME), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def move_aside(self, path):
+        # so that no one sees a partially removed snapshot
+        tmp = self.get_tmp_path(path)
+        try:
+            os.rename(path, tmp)
+        except FileNotFoundError:
+            return None
+        return tmp
+
+    def lookup(self, key):
+        meta = None
+        path = self.get_path(key)
+        try:
+            with open(os.path.join(path, META_FILE_NAME), 'r') as f:
+                meta = json.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.warning('ignoring broken snapshot "%s": %s' % (path, e))
+        return meta
+
+    def restore(self, key, files, dest):
+        path = self.get_path(key)
+        try:
+            with self.lock(shared=True):
+                if not os.path.exists(os.path.join(path, META_FILE_NAME)):
+                    raise FileNotFoundError('no snapshot')
+                for f in files:
+                    src = os.path.join(path, os.path.basename(f))
+                    if os.path.exists(src):
+                        shutil.copy2(src, os.path.join(dest, os.path.basename(f)))
+        except Exception as e:
+            self.warning('failed to restore snapshot "%s": %s' % (path, e))
+            return 1
+        return 0
+
+    def save(self, key, files, ver, pw):
+        path = self.get_path(key)
+        tmp = self.get_tmp_path(path)
+        old = None
+        try:
+            os.makedirs(tmp)
+            for f in files:
+                if os.path.exists(f):
+                    shutil.copy2(f, os.path.join(tmp, os.path.basename(f)))
+            with open(os.path.join(tmp, META_FILE_NAME), 'w') as f:
+                json.dump({'ver':ver, 'pw':pw, 'time':time.time()}, f)
+            with self.lock():
+                if os.path.exists(os.path.join(path, META_FILE_NAME)):
+                    # saved by someone else, snapshots of the same key are interchangeable
+                    self.debug('snapshot "%s" already exists' % path)
+                else:
+                    old = self.move_aside(path) # broken one if any
+                    os.rename(tmp, path)
+        except Exception as e:
+            self.warning('failed to save snapshot "%s": %s' % (path, e))
+            return 1
+        finally:
+            for p in (tmp, old):
+                if p:
+                    shutil.rmtree(p, ignore_errors=True)
+        self.prune()
+        return 0
+
+    def prune(self):
+        now = time.time()
+        removed = []
+        with self.lock():
+            snapshots = []
+            for n in os.listdir(self._store_dir):
+                p = os.path.join(self._store_dir, n)
+                try:
+                    if TMP_SUFFIX in n: # left by processes that died while saving
+                        if now - os.path.getmtime(p) > STALE_TMP_AGE:
+                            shutil.rmtree(p, ignore_errors=True)
+                    elif os.path.exists(os.path.join(p, META_FILE_NAME)):
+                        snapshots.append((os.path.getmtime(p), p))
+                except OSError:
+                    pass
+            snapshots.sort(reverse=True)
+            for (t, p) in snapshots[self._max_snapshots:]:
+                self.message('removing snapshot "%s"...' % p)
+                removed.append(self.move_aside(p))
+        for p in removed:
+            if p:
+                shutil.rmtree(p, ignore_errors=True)
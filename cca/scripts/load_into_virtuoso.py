@@ -32,13 +32,21 @@ from virtuoso import (VTMP_DIR,
                       GRAPH_URI_BASE,
                       DEFAULT_PORT,
                       DEFAULT_MAX_FILES,
+                      DEFAULT_NLOADERS,
+                      ENGINE_ODBC,
+                      ENGINE_ISQL,
+                      CKPT_BULK,
+                      CKPT_ADAPTIVE,
                       VIRTUOSO_PW)
+from fact_state import scan_dirs
+from factutils.const import ENTITY_NS, SEP
 
 
-def load(proj_id, db_dir, fact_dir, exts, port=DEFAULT_PORT, pw=VIRTUOSO_PW):
+def load(proj_id, db_dir, fact_dir, exts, port=DEFAULT_PORT, pw=VIRTUOSO_PW,
+         nprocs=DEFAULT_NLOADERS, checkpoint=CKPT_ADAPTIVE):
     graph_uri = GRAPH_URI_BASE+proj_id
 
-    loader = virtuoso.Loader(db_dir, daemonize=False, pw=pw, port=port)
+    loader = virtuoso.Loader(db_dir, daemonize=False, pw=pw, port=port, checkpoint=checkpoint)
 
     rc = loader.disable_checkpoint()
     if rc != 0:
@@ -46,7 +54,57 @@ def load(proj_id, db_dir, fact_dir, exts, port=DEFAULT_PORT, pw=VIRTUOSO_PW):
         loader.start_server()
         loader.disable_checkpoint()
 
-    rc = loader.load(graph_uri, fact_dir, exts, nprocs=1)
+    rc = loader.load(graph_uri, fact_dir, exts, nprocs=nprocs)
+
+    return rc
+
+
+def load_stream(proj_id, db_dir, fact_dir, exts, is_done, port=DEFAULT_PORT, pw=VIRTUOSO_PW,
+                nprocs=DEFAULT_NLOADERS, checkpoint=CKPT_ADAPTIVE):
+    graph_uri = GRAPH_URI_BASE+proj_id
+
+    loader = virtuoso.Loader(db_dir, daemonize=False, pw=pw, port=port, checkpoint=checkpoint)
+
+    rc = loader.disable_checkpoint()
+    if rc != 0 or not loader.wait_ready():
+        return -1
+
+    rc = loader.load_stream(graph_uri, fact_dir, exts, is_done, nprocs=nprocs)
+
+    return rc
+
+
+def update(proj_id, db_dir, fact_dir, exts, state, port=DEFAULT_PORT, pw=VIRTUOSO_PW,
+           nprocs=DEFAULT_NLOADERS):
+    graph_uri = GRAPH_URI_BASE+proj_id
+
+    loader = virtuoso.Loader(db_dir, daemonize=False, pw=pw, port=port)
+
+    (added, removed) = state.diff(fact_dir)
+
+    loader.message('%d fact directories added, %d removed' % (len(added), len(removed)))
+
+    fids_tbl = scan_dirs(added)
+    added_fids = set()
+    for fids in fids_tbl.values():
+        added_fids.update(fids)
+
+    stale = state.get_stale_file_ids(removed, added_fids)
+
+    rc = 0
+
+    if stale:
+        loader.message('deleting entities of %d files...' % len(stale))
+        rc = loader.delete_file_ids(graph_uri, stale, ENTITY_NS, SEP)
+
+    if rc == 0 and added:
+        if loader.wait_ready():
+            rc = loader.load_odbc(graph_uri, fact_dir, exts, nprocs=nprocs, dirs=added)
+        else:
+            rc = -1
+
+    if rc == 0:
+        state.update(added, removed, fids_tbl)
 
     return rc
 
@@ -79,8 +137,14 @@ if __name__ == '__main__':
     parser.add_argument('-d', '--debug', dest='debug', action='store_true',
                         help='enable debug printing')
 
-    parser.add_argument('-p', '--nprocs', dest='nprocs', type=int, default=1, metavar='N',
-                        help='run N processes')
+    parser.add_argument('-p', '--nprocs', dest='nprocs', type=int, default=DEFAULT_NLOADERS, metavar='N',
+                        help='run N loaders')
+
+    parser.add_argument('--bulk', dest='bulk', action='store_true',
+                        help='checkpoint only once at the end (for throwaway databases)')
+
+    parser.add_argument('--isql', dest='isql', action='store_true',
+                        help='drive the bulk loader through isql instead of ODBC')
 
     parser.add_argument('-n', '--nfiles', dest='nfiles', type=int, default=DEFAULT_MAX_FILES,
                         metavar='N', help='N files are loaded per load')
@@ -95,7 +159,8 @@ if __name__ == '__main__':
 
 
     def doit():
-        loader = virtuoso.Loader(args.dbdir, daemonize=args.daemon)
+        loader = virtuoso.Loader(args.dbdir, daemonize=args.daemon,
+                                 checkpoint=CKPT_BULK if args.bulk else CKPT_ADAPTIVE)
 
         if args.debug:
             loader.set_debug_flag()
@@ -111,7 +176,8 @@ if __name__ == '__main__':
                     args.exts, 
                     nprocs=args.nprocs, 
                     maxfiles=args.nfiles, 
-                    resume=args.resume)
+                    resume=args.resume,
+                    engine=ENGINE_ISQL if args.isql else ENGINE_ODBC)
 
     if args.daemon:
         log_dir = args.logdir
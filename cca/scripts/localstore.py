@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+
+
+'''
+  An embedded in-process triple store for small projects
+
+  Copyright 2012-2020 Codinuum Software Lab <https://codinuum.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+'''
+
+# The store answers the Virtuoso flavored queries of this package by
+# rewriting them into SPARQL 1.1:
+#
+#  - "DEFINE input:inference" enables RDFS inference: inferred types are
+#    kept under INFERRED_TYPE and "a" is read as INFERRED_TYPE, while
+#    "a ?c OPTION (INFERENCE NONE)" reads asserted rdf:type triples;
+#    a property p is read as the property path (p|sub-properties of p).
+#
+#  - "?s p ?o OPTION (TRANSITIVE, ...)" becomes a property path, and
+#    "{ SELECT ... } OPTION (TRANSITIVE, ...)" is evaluated here and
+#    replaced with a VALUES block.
+#
+#  - rdflib answers a GROUP BY that matches nothing with one empty
+#    solution, which joins with anything; eval_group_by drops it.
+
+import os
+import re
+import gzip
+import threading
+from collections import deque
+
+import pathsetup
+import dp
+import ns
+
+try:
+    import rdflib
+    from rdflib import URIRef, Literal, Dataset
+    from rdflib.namespace import RDF, RDFS, OWL
+    from rdflib.paths import AlternativePath, SequencePath, MulPath, InvPath
+    from rdflib.plugins.sparql import prepareQuery, CUSTOM_EVALS
+    from rdflib.plugins.sparql.evaluate import evalAggregateJoin
+    from rdflib.plugins.sparql.processor import prepareUpdate
+    from rdflib.plugins.sparql.parserutils import CompValue
+except ImportError:
+    rdflib = None
+
+
+ONT_GRAPH_URI = 'http://codinuum.com/ont/cpi'
+
+INFERRED_TYPE = 'http://codinuum.com/ont/cpi#inferredType'
+
+RDF_TYPE = ns.RDF_NS + 'type'
+
+FACT_EXTS = ['.nt.gz', '.nt']
+ONT_EXTS = ['.rdf']
+
+DEFINE_PAT = re.compile(r'^\s*DEFINE\s+(?P<name>\S+)\s+(?P<value>.*)$', re.I | re.M)
+INFERENCE_NONE_PAT = re.compile(r'\s+OPTION\s*\(\s*INFERENCE\s+NONE\s*\)', re.I)
+TRANSITIVE_PAT = re.compile(r'OPTION\s*\(\s*TRANSITIVE\b', re.I)
+TOKEN_PAT = re.compile(r'"(?:[^"\\]|\\.)*"|<[^<>\s]*>|(?<![\w?$:.-])a(?![\w:.-])')
+INSERT_PAT = re.compile(r'\bINSERT\b', re.I)
+WHERE_PAT = re.compile(r'\bWHERE\b', re.I)
+GRAPH_PAT = re.compile(r'\b(?:GRAPH|WITH)\s*<(?P<uri>[^>]*)>', re.I)
+PROLOGUE_PAT = re.compile(r'^\s*(?:PREFIX\s+\S*:\s*<[^>]*>|BASE\s+<[^>]*>)', re.I | re.M)
+T_OPT_PAT = re.compile(r'(?P<name>T_\w+)\s*(?:\((?P<args>[^()]*)\))?(?:\s+AS\s+(?P<alias>\?\w+))?', re.I)
+VAR_PAT = re.compile(r'[?$](\w+)')
+
+
+class LocalQueryError(Exception):
+    pass
+
+
+def is_available():
+    return rdflib != None
+
+
+def find_files(d, exts):
+    paths = []
+    for (dpath, dns, fns) in os.walk(d):
+        dns.sort()
+        for fn in sorted(fns):
+            if any(fn.endswith(ext) for ext in exts):
+                paths.append(os.path.join(dpath, fn))
+    return paths
+
+
+def get_data_size(d, exts=FACT_EXTS):
+    sz = 0
+    for p in find_files(d, exts):
+        sz += os.path.getsize(p)
+    return sz
+
+
+def find_close(s, i, o, c): # s[i] == o
+    lv = 0
+    for j in range(i, len(s)):
+        if s[j] == o:
+            lv += 1
+        elif s[j] == c:
+            lv -= 1
+            if lv == 0:
+                return j
+    raise LocalQueryError('unbalanced "%s" at %d' % (o, i))
+
+
+def find_open(s, i, o, c): # s[i] == c
+    lv = 0
+    for j in range(i, -1, -1):
+        if s[j] == c:
+            lv += 1
+        elif s[j] == o:
+            lv -= 1
+            if lv == 0:
+                return j
+    raise LocalQueryError('unbalanced "%s" at %d' % (c, i))
+
+
+def parse_transitive_options(s):
+    opts = {'in':[], 'out':[], 'min':0, 'max':None, 'steps':[]}
+    for m in T_OPT_PAT.finditer(s):
+        name = m.group('name').upper()
+        args = (m.group('args') or '').strip()
+        if name == 'T_IN':
+            opts['in'] = VAR_PAT.findall(args)
+        elif name == 'T_OUT':
+            opts['out'] = VAR_PAT.findall(args)
+        elif name == 'T_MIN':
+            opts['min'] = int(args)
+        elif name == 'T_MAX':
+            opts['max'] = int(args)
+        elif name == 'T_STEP':
+            alias = m.group('alias')
+            if alias:
+                opts['steps'].append((args.strip('\'"?$'), alias[1:]))
+    return opts
+
+
+def rewrite_types(s):
+    def repl(m):
+        t = m.group(0)
+        if t == 'a':
+            t = '<%s>' % INFERRED_TYPE
+        return t
+    return TOKEN_PAT.sub(repl, s)
+
+
+def rewrite_inference(q, inference):
+    # asserted types first, so that they escape the rewriting of "a"
+    q = re.sub(r'(?<![\w?$:.-])a(?=\s+\S+\s+OPTION\s*\(\s*INFERENCE\s+NONE\s*\))', '<%s>' % RDF_TYPE, q)
+    q = INFERENCE_NONE_PAT.sub('', q)
+
+    if inference:
+        m = INSERT_PAT.search(q)
+        if m: # keep the template as is
+            w = WHERE_PAT.search(q, find_close(q, q.index('{', m.end()), '{', '}'))
+            if w:
+                q = q[:w.start()] + rewrite_types(q[w.start():])
+        else:
+            q = rewrite_types(q)
+
+    return q
+
+
+def rewrite_inline_transitive(q, m):
+    # ?s p ?o OPTION (TRANSITIVE, ...) --> ?s (p)+ ?o
+    st = q.index('(', m.start())
+    ed = find_close(q, st, '(', ')')
+    opts = parse_transitive_options(q[st+1:ed])
+    head = q[:m.start()].rstrip()
+    mo = re.search(r'(\S+)\s+(\S+)$', head)
+    if not mo:
+        raise LocalQueryError('cannot find transitive predicate')
+    mod = '*' if opts['min'] == 0 else '+'
+    return '%s(%s)%s %s %s' % (head[:mo.start()], mo.group(1), mod, mo.group(2), q[ed+1:])
+
+
+def expand_property(p, subs):
+    if isinstance(p, URIRef):
+        sps = subs.get(p, None)
+        if sps:
+            p = AlternativePath(p, *sorted(sps))
+    elif isinstance(p, AlternativePath):
+        p = AlternativePath(*[expand_property(x, subs) for x in p.args])
+    elif isinstance(p, SequencePath):
+        p = SequencePath(*[expand_property(x, subs) for x in p.args])
+    elif isinstance(p, MulPath):
+        p = MulPath(expand_property(p.path, subs), p.mod)
+    elif isinstance(p, InvPath):
+        p = InvPath(expand_property(p.arg, subs))
+    return p
+
+
+def expand_properties(node, subs):
+    # replaces the predicates of the triple patterns in the algebra
+    if isinstance(node, CompValue):
+        if node.name in ('BGP', 'TriplesBlock'):
+            node['triples'] = [(t[0], expand_property(t[1], subs)) + tuple(t[2:])
+                               for t in node['triples']]
+        # the pattern of EXISTS is translated into an attribute
+        for v in list(node.values()) + list(vars(node).values()):
+            expand_properties(v, subs)
+    elif isinstance(node, (list, tuple)):
+        for v in node:
+            expand_properties(v, subs)
+
+
+def eval_group_by(ctx, part):
+    if part.name != 'AggregateJoin' or part.p.expr == None: # no GROUP BY
+        raise NotImplementedError()
+    return drop_empty_group(evalAggregateJoin(ctx, part))
+
+def drop_empty_group(sols):
+    first = next(sols, None)
+    if first == None:
+        return
+    second = next(sols, None)
+    if second == None:
+        if len(first) > 0:
+            yield first
+        return
+    yield first
+    yield second
+    for sol in sols:
+        yield sol
+
+if rdflib != None:
+    CUSTOM_EVALS['localstore_group_by'] = eval_group_by
+
+
+def fill_insert_where(q):
+    # Virtuoso allows INSERT { ... } without WHERE
+    m = INSERT_PAT.search(q)
+    if m and not re.search(r'\bDATA\b', q[m.end():m.end()+16], re.I):
+        ed = find_close(q, q.index('{', m.end()), '{', '}')
+        if not WHERE_PAT.search(q, ed):
+            q = q[:ed+1] + '\nWHERE {}' + q[ed+1:]
+    return q
+
+
+class LocalStore(dp.base):
+    def __init__(self):
+        if rdflib == None:
+            raise LocalQueryError('rdflib is not available')
+        self._ds = Dataset(default_union=True)
+        self._lock = threading.RLock()
+        self._dirty = False
+
+        self._super_classes = {}  # class -> superclass set
+        self._sub_properties = {} # property -> subproperty set
+
+    def get_dataset(self):
+        return self._ds
+
+    def __len__(self):
+        return len(self._ds)
+
+    def load_facts(self, graph_uri, d, exts=FACT_EXTS):
+        g = self._ds.graph(URIRef(graph_uri))
+        paths = find_files(d, exts)
+        self.message('loading %d files into <%s>...' % (len(paths), graph_uri))
+        with self._lock:
+            for path in paths:
+                self.debug('loading "%s"...' % path)
+                if path.endswith('.gz'):
+                    with gzip.open(path, 'rb') as f:
+                        g.parse(f, format='nt')
+                else:
+                    g.parse(path, format='nt')
+            self._dirty = True
+        return len(paths)
+
+    def load_ont(self, d, graph_uri=ONT_GRAPH_URI, exts=ONT_EXTS):
+        g = self._ds.graph(URIRef(graph_uri))
+        paths = find_files(d, exts)
+        self.message('loading %d ontologies into <%s>...' % (len(paths), graph_uri))
+        with self._lock:
+            for path in paths:
+                g.parse(path, format='xml')
+            self.setup_rules(g)
+            self._dirty = True
+        return len(paths)
+
+    def setup_rules(self, g): # rdfs_rule_set
+        def closure(pairs):
+            direct = {}
+            for (x, y) in pairs:
+                if x != y:
+                    direct.setdefault(x, set()).add(y)
+            tbl = {}
+            for x in direct.keys():
+                s = set()
+                todo = list(direct[x])
+                while todo:
+                    y = todo.pop()
+                    if y not in s:
+                        s.add(y)
+                        todo.extend(direct.get(y, []))
+                s.discard(x)
+                tbl[x] = s
+            return tbl
+
+        cpairs = list(g.subject_objects(RDFS.subClassOf))
+        for (x, y) in g.subject_objects(OWL.equivalentClass):
+            cpairs += [(x, y), (y, x)]
+
+        ppairs = list(g.subject_objects(RDFS.subPropertyOf))
+        for (x, y) in g.subject_objects(OWL.equivalentProperty):
+            ppairs += [(x, y), (y, x)]
+
+        self._super_classes = closure(cpairs)
+        self._sub_properties = closure([(y, x) for (x, y) in ppairs])
+
+    def infer(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            inferred_type = URIRef(INFERRED_TYPE)
+            for g in self._ds.graphs():
+                if g.identifier == URIRef(ONT_GRAPH_URI):
+                    continue
+                for (s, c) in list(g.subject_objects(RDF.type)):
+                    g.add((s, inferred_type, c))
+                    for sc in self._super_classes.get(c, []):
+                        g.add((s, inferred_type, sc))
+            self._dirty = False
+
+    def prepare(self, q, inference, update=False):
+        if update:
+            obj = prepareUpdate(q)
+            if inference:
+                for op in obj.algebra:
+                    expand_properties(op.get('where', None), self._sub_properties)
+        else:
+            obj = prepareQuery(q)
+            if inference:
+                expand_properties(obj.algebra, self._sub_properties)
+        return obj
+
+    def get_prologue(self, q):
+        return ''.join(m.group(0)+'\n' for m in PROLOGUE_PAT.finditer(q))
+
+    def find_graph(self, q, pos):
+        uri = None
+        for m in GRAPH_PAT.finditer(q, 0, pos):
+            if m.group('uri') != ONT_GRAPH_URI:
+                uri = m.group('uri')
+        return uri
+
+    def eval_transitive(self, q, m, inference=False):
+        ed = q.rindex('}', 0, m.start())
+        st = find_open(q, ed, '{', '}')
+        ost = q.index('(', m.start())
+        oed = find_close(q, ost, '(', ')')
+        opts = parse_transitive_options(q[ost+1:oed])
+
+        if len(opts['in']) != 1 or len(opts['out']) != 1:
+            raise LocalQueryError('unsupported transitive options: %s' % q[ost:oed+1])
+
+        vin = opts['in'][0]
+        vout = opts['out'][0]
+        sub = q[st+1:ed]
+
+        prologue = self.get_prologue(q)
+        graph = self.find_graph(q, st)
+
+        def select(body):
+            if graph:
+                body = 'GRAPH <%s> { %s }' % (graph, body)
+            sq = self.prepare('%sSELECT * WHERE { %s }' % (prologue, body), inference)
+            return self._ds.query(sq)
+
+        res = select('{ %s }' % sub)
+        qvs = [str(v) for v in res.vars]
+        extras = [v for v in qvs if v not in (vin, vout)]
+
+        succ = {}
+        for row in res:
+            d = row.asdict()
+            x = d.get(vin, None)
+            y = d.get(vout, None)
+            if x != None and y != None:
+                succ.setdefault(x, []).append((y, d))
+
+        starts = set(succ.keys())
+        if opts['min'] == 0:
+            for (ys) in succ.values():
+                starts.update(y for (y, _) in ys)
+            mt = re.search(r'\?%s\s+(<[^>]+>)\s+(\S+?)\s*[;.}]' % vin, sub)
+            if mt: # nodes the step pattern is constrained to
+                for row in select('?%s %s %s' % (vin, mt.group(1), mt.group(2))):
+                    starts.add(row[0])
+
+        rows = []
+        for x in starts:
+            # breadth first, so that each node is reached once by a shortest path
+            visited = set([x])
+            todo = deque([(x, 0, None)])
+            while todo:
+                (y, dist, d) = todo.popleft()
+                if dist >= opts['min']:
+                    r = {vin:x, vout:y}
+                    if d:
+                        for v in extras:
+                            r[v] = d.get(v, None)
+                    for (sv, alias) in opts['steps']:
+                        if sv == 'step_no':
+                            r[alias] = Literal(dist)
+                        elif sv == vin:
+                            r[alias] = y
+                    rows.append(r)
+                if opts['max'] != None and dist >= opts['max']:
+                    continue
+                for (z, dz) in succ.get(y, []):
+                    if z not in visited:
+                        visited.add(z)
+                        todo.append((z, dist + 1, dz))
+
+        vs = [vin, vout] + extras + [alias for (_, alias) in opts['steps']]
+        def conv(t):
+            if t == None:
+                return 'UNDEF'
+            return t.n3()
+        vals = '\n'.join(['(%s)' % ' '.join(conv(r.get(v, None)) for v in vs) for r in rows])
+        blk = 'VALUES (%s) {\n%s\n}' % (' '.join('?'+v for v in vs), vals)
+
+        self.debug('transitive: %d edges -> %d rows' % (len(res), len(rows)))
+
+        return q[:st] + blk + q[oed+1:]
+
+    def is_inference(self, q):
+        for m in DEFINE_PAT.finditer(q):
+            if m.group('name').lower() == 'input:inference':
+                return True
+        return False
+
+    def rewrite(self, q, inference):
+        q = DEFINE_PAT.sub('', q)
+
+        q = rewrite_inference(q, inference)
+        q = fill_insert_where(q)
+
+        while True:
+            m = TRANSITIVE_PAT.search(q)
+            if not m:
+                break
+            if q[:m.start()].rstrip().endswith('}'):
+                q = self.eval_transitive(q, m, inference=inference)
+            else:
+                q = rewrite_inline_transitive(q, m)
+
+        return q
+
+    def query(self, q):
+        with self._lock:
+            self.infer()
+            inference = self.is_inference(q)
+            q = self.rewrite(q, inference)
+            self.debug('query:\n%s' % q)
+            return self._ds.query(self.prepare(q, inference))
+
+    def update(self, q):
+        with self._lock:
+            self.infer()
+            inference = self.is_inference(q)
+            q = self.rewrite(q, inference)
+            self.debug('update:\n%s' % q)
+            self._ds.update(self.prepare(q, inference, update=True))
+            self._dirty = True
+
+
+STORE = None
+STORE_LOCK = threading.Lock()
+
+def get_store():
+    global STORE
+    with STORE_LOCK:
+        if STORE == None:
+            STORE = LocalStore()
+    return STORE
+
+def reset_store():
+    global STORE
+    with STORE_LOCK:
+        STORE = None
@@ -22,6 +22,9 @@
 import os.path
 import sys
 import re
+import time
+import gzip
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 import pathsetup
 import dp
@@ -33,6 +36,13 @@ from virtuoso import VIRTUOSO_PW, DEFAULT_PORT
 
 MAX_VER_TRIPLES = 128
 
+VER_NEXT = VER_NS + 'next'
+VER_FACT_FILE_NAME = 'ver_next.nt.gz'
+
+DEFAULT_NWORKERS = 4
+
+MAX_RETRY = 2 # concurrent INSERTs may fail on lock conflicts
+
 VER_ORDER_QUERY = '''
 PREFIX ver: <%(ver_ns)s>
 WITH <%(graph)s>
@@ -41,16 +51,29 @@ INSERT {
 }
 '''
 
+sparql.register_query('ver_order', VER_ORDER_QUERY)
+
 INSERT_PAT = re.compile(r'insert', re.I)
 
 class Materializer(dp.base):
     def __init__(self, qdir, queries, proj_id,
-                 method='odbc', pw=VIRTUOSO_PW, port=DEFAULT_PORT):
+                 method='odbc', pw=VIRTUOSO_PW, port=DEFAULT_PORT, profiler=None,
+                 deps=None, nworkers=DEFAULT_NWORKERS, ver_dir=None):
         self._query_dir = qdir
         self._queries = queries
+        self._deps = deps # lang -> query name -> query names to be run before
         self._proj_id = proj_id
         self._graph_uri = FB_NS + proj_id
-        self._sparql = sparql.get_driver(method, pw=pw, port=port)
+        # must be in DirsAllowed of virtuoso.ini
+        self._ver_dir = ver_dir or os.path.join(virtuoso.VTMP_DIR, proj_id+'.ver')
+        self._nworkers = 1
+        self._pool = None
+        if method == 'odbc' and deps != None and nworkers > 1:
+            self._nworkers = nworkers
+            self._pool = sparql.get_pool(pw=pw, port=port, maxsize=nworkers)
+        self._sparql = sparql.get_driver(method, pw=pw, port=port, pool=self._pool,
+                                         profiler=profiler)
+        self._method = method
         self._port = port
         self._pw = pw
         try:
@@ -59,33 +82,67 @@ class Materializer(dp.base):
             self._conf = None
 
 
-    def make_ver_next_triples(self):
-        triples = []
-
-        ts = []
-
+    def get_ver_next_pairs(self):
+        pairs = []
         if self._conf:
             if self._conf.vpairs:
-                for (u1, u2) in self._conf.vURIpairs:
-                    if len(ts) >= MAX_VER_TRIPLES:
-                        triples.append(ts)
-                        ts = []
-                    ts.append('<%s> ver:next <%s> .' % (u1, u2))
+                pairs = list(self._conf.vURIpairs)
             else:
                 uris = self._conf.versionURIs
-                for i in range(self._conf.nversions - 1):
-                    if len(ts) >= MAX_VER_TRIPLES:
-                        triples.append(ts)
-                        ts = []
-                    ts.append('<%s> ver:next <%s> .' % (uris[i], uris[i+1]))
+                pairs = [(uris[i], uris[i+1]) for i in range(self._conf.nversions - 1)]
+        return pairs
+
+    def make_ver_next_triples(self, pairs):
+        triples = []
+
+        ts = []
+
+        for (u1, u2) in pairs:
+            if len(ts) >= MAX_VER_TRIPLES:
+                triples.append(ts)
+                ts = []
+            ts.append('<%s> ver:next <%s> .' % (u1, u2))
 
         if ts:
             triples.append(ts)
 
         return triples
 
+    def load_ver_next_triples(self, pairs):
+        path = os.path.join(self._ver_dir, VER_FACT_FILE_NAME)
+        rc = 0
+        try:
+            if not os.path.exists(self._ver_dir):
+                os.makedirs(self._ver_dir)
+            with gzip.open(path, 'wt', encoding='utf-8') as f:
+                for (u1, u2) in pairs:
+                    f.write('<%s> <%s> <%s> .\n' % (u1, VER_NEXT, u2))
+
+            loader = virtuoso.Loader(port=self._port, pw=self._pw,
+                                     checkpoint=virtuoso.CKPT_BULK)
+            rc = loader.load(self._graph_uri, self._ver_dir, ['.nt.gz'], nprocs=1)
+
+        except Exception as e:
+            self.warning(str(e))
+            rc = -1
+
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+        return rc
+
     def insert_ver_next_triples(self):
-        for triples in self.make_ver_next_triples():
+        pairs = self.get_ver_next_pairs()
+
+        # a single file load is cheaper than many INSERTs
+        if self._method == 'odbc' and len(pairs) > MAX_VER_TRIPLES:
+            self.message('loading %d version order triples...' % len(pairs))
+            if self.load_ver_next_triples(pairs) == 0:
+                return
+            self.warning('falling back to INSERT')
+
+        for triples in self.make_ver_next_triples(pairs):
 
             params = { 'ver_ns' : VER_NS,
                        'graph' : self._graph_uri, 
@@ -103,27 +160,95 @@ class Materializer(dp.base):
             q = f.read()
             query = INSERT_PAT.sub('WITH <%s>\nINSERT' % self._graph_uri, q, count=1).rstrip('\n ;')
             f.close()
+            sparql.register_query(os.path.join(lang, name), query.replace('%', '%%'))
         except Exception as e:
             self.error(str(e))
         return query
 
 
+    def get_tasks(self):
+        tasks = []
+        deps = {} # task -> tasks
+        prev = None
+        for lang in self._queries.keys():
+            qnames = self._queries[lang]
+            for qname in qnames:
+                task = (lang, qname)
+                tasks.append(task)
+                if self._deps == None: # run in list order
+                    deps[task] = set([prev]) if prev else set()
+                else:
+                    deps[task] = set()
+                    for d in self._deps.get(lang, {}).get(qname, []):
+                        if d in qnames:
+                            deps[task].add((lang, d))
+                        else:
+                            self.warning('unknown dependency of "%s" for %s: "%s"' % (qname, lang, d))
+                prev = task
+        return (tasks, deps)
+
+    def run_query(self, lang, qname):
+        query = self.get_query(lang, qname)
+        st = time.time()
+        for i in range(MAX_RETRY+1):
+            try:
+                self._sparql.execute(query)
+                break
+            except Exception as e:
+                if i == MAX_RETRY or self._nworkers == 1:
+                    raise
+                self.warning('retrying "%s" for %s: %s' % (qname, lang, e))
+        t = time.time() - st
+        self.message('"%s" for %s done (%.3f sec)' % (qname, lang, t))
+        return t
+
+    def run_tasks(self):
+        (tasks, deps) = self.get_tasks()
+        times = {}
+        done = set()
+        running = {} # future -> task
+        with ThreadPoolExecutor(max_workers=self._nworkers) as executor:
+            while tasks or running:
+                for task in [t for t in tasks if deps[t] <= done]:
+                    if len(running) >= self._nworkers:
+                        break
+                    tasks.remove(task)
+                    self.message('processing "%s" for %s...' % (task[1], task[0]))
+                    sys.stdout.flush()
+                    running[executor.submit(self.run_query, *task)] = task
+
+                if not running:
+                    raise RuntimeError('cyclic dependencies: %s' % tasks)
+
+                (finished, _) = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for f in finished:
+                    task = running.pop(f)
+                    times[task] = f.result()
+                    done.add(task)
+        return times
+
     def materialize(self):
         self.message('materializing for "%s"...' % self._proj_id)
 
         self.message('materializing version order...')
         self.insert_ver_next_triples()
 
-        for lang in self._queries.keys():
-
-            for qname in self._queries[lang]:
-                self.message('processing \"%s\" for %s...' % (qname, lang)),
-                sys.stdout.flush()
+        st = time.time()
+        try:
+            times = self.run_tasks()
+        finally:
+            if self._pool:
+                self._pool.close()
 
-                query = self.get_query(lang, qname)
-                self._sparql.execute(query)
+        if times:
+            t = time.time() - st
+            self.message('%d queries done in %.3f sec (%.3f sec in total, %d workers)' %
+                         (len(times), t, sum(times.values()), self._nworkers))
+            for (task, qt) in sorted(times.items(), key=lambda x: x[1], reverse=True):
+                self.verbose('%8.3f %s/%s' % (qt, task[0], task[1]))
 
-                self.message('done.')
+        if self._method == 'local':
+            return 0
 
         virt = virtuoso.base(pw=self._pw, port=self._port)
         rc = virt.checkpoint()
@@ -132,7 +257,7 @@ class Materializer(dp.base):
 
 
 
-def main(qdir, queries, desc, pw=VIRTUOSO_PW):
+def main(qdir, queries, desc, pw=VIRTUOSO_PW, deps=None):
     from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
     parser = ArgumentParser(description=desc,
@@ -143,13 +268,16 @@ def main(qdir, queries, desc, pw=VIRTUOSO_PW):
                         help='enable debug printing')
     parser.add_argument('-p', '--port', dest='port', default=1111,
                         metavar='PORT', type=int, help='port number')
+    parser.add_argument('-j', '--nworkers', dest='nworkers', default=DEFAULT_NWORKERS,
+                        metavar='N', type=int, help='execute independent queries on N connections')
 
 
     args = parser.parse_args()
 
     dp.debug_flag = args.debug
 
-    m = Materializer(qdir, queries, args.proj_id, pw=pw, port=args.port)
+    m = Materializer(qdir, queries, args.proj_id, pw=pw, port=args.port,
+                     deps=deps, nworkers=args.nworkers)
 
     m.materialize()
 
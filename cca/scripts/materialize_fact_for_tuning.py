@@ -26,7 +26,7 @@ import os.path
 
 import pathsetup
 import dp
-from materialize_fact import Materializer, main
+from materialize_fact import Materializer, main, DEFAULT_NWORKERS
 from virtuoso import VIRTUOSO_PW, VIRTUOSO_PORT
 
 QUERY_DIR = os.path.join(pathsetup.CCA_HOME, 'queries', 'tuning')
@@ -75,10 +75,52 @@ QUERIES = {
     ],
 }
 
-def materialize(proj_id, pw=VIRTUOSO_PW, port=VIRTUOSO_PORT):
-    m = Materializer(QUERY_DIR, QUERIES, proj_id, pw=pw, port=port)
+# a query depends on the earlier queries that produce triples it reads
+# (taking ont.cpi into account) and on those that read triples it
+# produces, so that the result does not depend on the execution order.
+DEPENDENCIES = {
+    'fortran' : {
+        'materialize_module_ref.rq' : ['materialize_program_unit_in_srctree.rq'],
+        'materialize_transitive_provide.rq' : ['materialize_module_ref.rq'],
+        'materialize_reference.rq' : ['materialize_transitive_provide.rq'],
+        'materialize_symbol_resolution.rq' : ['materialize_reference.rq'],
+        'materialize_logical_unit_fj.rq' : ['materialize_reference.rq'],
+        'materialize_logical_unit_tc.rq' : ['materialize_logical_unit_fj.rq'],
+        'materialize_array_ref_sig1.rq' : ['materialize_expr_sig_in_loop.rq'],
+        'materialize_array_ref_sig2_0.rq' : ['materialize_expr_sig_in_loop.rq'],
+        'materialize_array_ref_sig2_1.rq' : ['materialize_expr_sig_in_loop.rq'],
+        'materialize_type_spec.rq' : ['materialize_symbol_resolution.rq'],
+        'materialize_compo_type_spec.rq' : ['materialize_type_spec.rq'],
+        'materialize_included_module_subprogram.rq' : ['materialize_reference.rq'],
+        'materialize_macro_type_spec.rq' : ['materialize_type_spec.rq'],
+        'materialize_c_func_req.rq' : ['materialize_reference.rq'],
+        'materialize_callee.rq' : ['materialize_logical_unit_tc.rq',
+                                   'materialize_compo_type_spec.rq',
+                                   'materialize_included_module_subprogram.rq',
+                                   'materialize_c_func_req.rq'],
+    },
+    'cpp' : {
+        'materialize_reference.rq' : ['materialize_translation_unit_in_srctree.rq'],
+        'materialize_symbol_resolution.rq' : ['materialize_reference.rq'],
+        'materialize_array_ref_sig1_0.rq' : ['materialize_expr_sig_in_loop.rq'],
+        'materialize_array_ref_sig1_1.rq' : ['materialize_expr_sig_in_loop.rq'],
+        'materialize_array_ref_sig2_0.rq' : ['materialize_expr_sig_in_loop.rq'],
+        'materialize_array_ref_sig2_1.rq' : ['materialize_expr_sig_in_loop.rq'],
+        'materialize_type_spec.rq' : ['materialize_symbol_resolution.rq'],
+        'materialize_type_spec_memb.rq' : ['materialize_type_spec.rq'],
+        'materialize_callee.rq' : ['materialize_symbol_resolution.rq'],
+        'materialize_call.rq' : ['materialize_expr_sig_in_loop.rq',
+                                 'materialize_type_spec_memb.rq',
+                                 'materialize_callee.rq'],
+    },
+}
+
+def materialize(proj_id, method='odbc', pw=VIRTUOSO_PW, port=VIRTUOSO_PORT, profiler=None,
+                nworkers=DEFAULT_NWORKERS, ver_dir=None):
+    m = Materializer(QUERY_DIR, QUERIES, proj_id, method=method, pw=pw, port=port, profiler=profiler,
+                     deps=DEPENDENCIES, nworkers=nworkers, ver_dir=ver_dir)
     rc = m.materialize()
     return rc
 
 if __name__ == '__main__':
-    main(QUERY_DIR, QUERIES, 'materialize facts for tuning')
+    main(QUERY_DIR, QUERIES, 'materialize facts for tuning', deps=DEPENDENCIES)
@@ -31,7 +31,8 @@ from keyword import iskeyword
 
 import pathsetup
 import dp
-from factutils.entity import SourceCodeEntity
+import sparql
+from factutils.entity import from_uri as decode_entity
 from ns import NS_TBL
 from outline_for_survey_fortran import Outline as OutlineFortran
 from outline_for_survey_base import tbl_get_dict, tbl_get_list, get_lver, ensure_dir, get_proj_list
@@ -546,6 +547,8 @@ QUERY_TBL = { 'fortran' :
               }
 }
 
+sparql.register_queries(QUERY_TBL, prefix='flops.')
+
 
 def iter_tree(node, pre=None, post=None):
     if pre:
@@ -646,7 +649,11 @@ class Outline(OutlineFortran):
                  gitrepo=GIT_REPO_BASE,
                  proj_dir=PROJECTS_DIR,
                  ver='unknown',
-                 simple_layout=False):
+                 simple_layout=False,
+                 pool=None,
+                 nworkers=0,
+                 cache=None,
+                 profiler=None):
 
         OutlineFortran.__init__(self,
                                 proj_id,
@@ -657,7 +664,11 @@ class Outline(OutlineFortran):
                                 gitrepo=gitrepo,
                                 proj_dir=proj_dir,
                                 ver=ver,
-                                simple_layout=simple_layout)
+                                simple_layout=simple_layout,
+                                pool=pool,
+                                nworkers=nworkers,
+                                cache=cache,
+                                profiler=profiler)
 
         self._fop_tbl = None # key -> nfop_tbl
         self._zop_tbl = None # key -> nzop_tbl
@@ -675,7 +686,7 @@ class Outline(OutlineFortran):
 
         lver = get_lver(ver)
 
-        ent = SourceCodeEntity(uri=constr)
+        ent = decode_entity(constr)
 
         r = ent.get_range()
         start_line = r.get_start_line()
@@ -941,15 +952,15 @@ class Outline(OutlineFortran):
         init, term, stride = init_term_stride
         niter_ln = None
         try:
-            init_ent = SourceCodeEntity(uri=init)
-            term_ent = SourceCodeEntity(uri=term)
+            init_ent = decode_entity(init)
+            term_ent = decode_entity(term)
 
             init_text = self.get_text(line_text_tbl, loc, init_ent)
             term_text = self.get_text(line_text_tbl, loc, term_ent)
 
             stride_text = None
             if stride:
-                stride_ent = SourceCodeEntity(uri=stride)
+                stride_ent = decode_entity(stride)
                 stride_text = self.get_text(line_text_tbl, loc, stride_ent)
 
             if init_text and term_text:
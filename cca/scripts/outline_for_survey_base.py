@@ -37,9 +37,9 @@ import dp
 from cca_config import PROJECTS_DIR, Config, VKIND_VARIANT, VKIND_GITREV
 import project
 
-from sparql import get_localname
+from sparql import get_localname, get_uri_id
 import sparql
-from factutils.entity import SourceCodeEntity
+from factutils.entity import from_uri as decode_entity
 from ns import FB_NS, NS_TBL
 from sourcecode_metrics_for_survey_base import get_proj_list, get_lver
 import sourcecode_metrics_for_survey_base as metrics
@@ -175,7 +175,7 @@ class NodeBase(dp.base):
 
         self._callee_name = callee_name
 
-        self.key = (ver, loc, get_localname(uri))
+        self.key = (ver, loc, get_uri_id(uri))
 
         self._ent = None
         self._fid = None
@@ -386,7 +386,7 @@ class NodeBase(dp.base):
 
     def get_ent(self):
         if not self._ent:
-            self._ent = SourceCodeEntity(uri=self.uri)
+            self._ent = decode_entity(self.uri)
         return self._ent
 
     def get_fid(self):
@@ -785,7 +785,11 @@ class OutlineBase(dp.base):
                  CALLS=set(),
                  get_root_entities=None,
                  METRICS_ROW_HEADER=[],
-                 add_root=False
+                 add_root=False,
+                 pool=None,
+                 nworkers=0,
+                 cache=None,
+                 profiler=None
                  ):
 
         self.SUBPROGS = SUBPROGS
@@ -796,7 +800,15 @@ class OutlineBase(dp.base):
 
         self._proj_id = proj_id
         self._graph_uri = FB_NS + proj_id
-        self._sparql = sparql.get_driver(method, pw=pw, port=port)
+        if pool == None and method == 'odbc':
+            pool = sparql.get_pool(pw=pw, port=port)
+        self._pool = pool # shared with metrics
+        self._nworkers = nworkers # for concurrent metrics queries
+        self._sparql = sparql.get_driver(method, pw=pw, port=port, pool=pool, profiler=profiler)
+        if cache:
+            self._sparql = sparql.CachedDriver(self._sparql, cache, graph_uri=self._graph_uri)
+        self._cache = cache
+        self._profiler = profiler
         self._method = method
         self._pw = pw
         self._port = port
@@ -820,7 +832,7 @@ class OutlineBase(dp.base):
 
         self._tree = None
 
-        self._node_tbl = {} # (ver * loc * uri) -> node
+        self._node_tbl = {} # (ver * loc * uri id) -> node
 
         self._lines_tbl = {} # ver -> loc -> line set
         self._fid_tbl = {} # (ver * loc) -> fid
@@ -28,7 +28,7 @@ import dp
 from cca_config import PROJECTS_DIR
 
 import sparql
-from factutils.entity import SourceCodeEntity
+from factutils.entity import from_uri as decode_entity
 from sourcecode_metrics_for_survey_cpp import get_proj_list, get_lver, Metrics
 import sourcecode_metrics_for_survey_cpp as metrics
 from search_topic_for_survey import search
@@ -38,6 +38,8 @@ from outline_for_survey_base import NodeBase, OutlineBase, Exit, norm_callee_nam
 from outline_for_survey_base import demangle, tbl_get_list, tbl_get_set, tbl_get_dict
 from outlining_queries_cpp import OMITTED, SUBPROGS, LOOPS, CALLS, TYPE_TBL, QUERY_TBL, get_root_entities
 
+sparql.register_queries(QUERY_TBL, prefix='outline_cpp.')
+
 ###
 
 METRICS_ROW_HEADER = list(metrics.abbrv_tbl.keys()) + metrics.META_KEYS + ['nid','root_file']
@@ -166,11 +168,16 @@ class Outline(OutlineBase):
                  ver='unknown',
                  simple_layout=False,
                  all_sps=False,
+                 pool=None,
+                 nworkers=0,
+                 cache=None,
+                 profiler=None,
                  ):
 
         OutlineBase.__init__(self, proj_id, commits, method, pw, port, gitrepo, proj_dir, ver, simple_layout, all_sps,
                              SUBPROGS=SUBPROGS, CALLS=CALLS, get_root_entities=get_root_entities,
-                             METRICS_ROW_HEADER=METRICS_ROW_HEADER)
+                             METRICS_ROW_HEADER=METRICS_ROW_HEADER, pool=pool, nworkers=nworkers,
+                             cache=cache, profiler=profiler)
 
     def setup_aa_tbl(self): # assumes self._node_tbl
         if not self._aa_tbl:
@@ -193,7 +200,7 @@ class Outline(OutlineBase):
 
                 pns = tbl_get_list(tbl, loop_node.get_mkey())
 
-                pn_ent = SourceCodeEntity(uri=pe)
+                pn_ent = decode_entity(pe)
                 r = pn_ent.get_range()
                 st = {'line':r.get_start_line(),'ch':r.get_start_col()}
                 ed = {'line':r.get_end_line(),'ch':r.get_end_col()}
@@ -212,7 +219,9 @@ class Outline(OutlineBase):
     def extract_metrics(self):
         if not self._metrics:
             self.message('extracting metrics...')
-            self._metrics = Metrics(self._proj_id, self._method, pw=self._pw, port=self._port)
+            self._metrics = Metrics(self._proj_id, self._method, pw=self._pw, port=self._port,
+                                    pool=self._pool, nworkers=self._nworkers,
+                                    cache=self._cache, profiler=self._profiler)
             self._metrics.calc()
             self.message('done.')
 
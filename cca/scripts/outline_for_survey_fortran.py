@@ -28,7 +28,7 @@ import dp
 from cca_config import PROJECTS_DIR
 
 import sparql
-from factutils.entity import SourceCodeEntity
+from factutils.entity import from_uri as decode_entity
 from sourcecode_metrics_for_survey_fortran import get_proj_list, get_lver, Metrics
 import sourcecode_metrics_for_survey_fortran as metrics
 from search_topic_for_survey import search
@@ -38,6 +38,8 @@ from outline_for_survey_base import QN_SEP, remove_leading_digits, Exit, norm_ca
 from outline_for_survey_base import NodeBase, OutlineBase, tbl_get_list, tbl_get_set, tbl_get_dict
 from outlining_queries_fortran import OMITTED, SUBPROGS, LOOPS, CALLS, TYPE_TBL, QUERY_TBL, get_root_entities
 
+sparql.register_queries(QUERY_TBL, prefix='outline_fortran.')
+
 ###
 
 METRICS_ROW_HEADER = list(metrics.abbrv_tbl.keys()) + metrics.META_KEYS + ['nid','root_file']
@@ -211,11 +213,16 @@ class Outline(OutlineBase):
                  proj_dir=PROJECTS_DIR,
                  ver='unknown',
                  simple_layout=False,
-                 all_sps=False):
+                 all_sps=False,
+                 pool=None,
+                 nworkers=0,
+                 cache=None,
+                 profiler=None):
 
         OutlineBase.__init__(self, proj_id, commits, method, pw, port, gitrepo, proj_dir, ver, simple_layout, all_sps,
                              SUBPROGS=SUBPROGS, CALLS=CALLS, get_root_entities=get_root_entities,
-                             METRICS_ROW_HEADER=METRICS_ROW_HEADER, add_root=True)
+                             METRICS_ROW_HEADER=METRICS_ROW_HEADER, add_root=True, pool=pool,
+                             nworkers=nworkers, cache=cache, profiler=profiler)
 
         self._qspn_tbl = {} # (ver * loc * start_line) -> name list
 
@@ -247,14 +254,14 @@ class Outline(OutlineBase):
 
                 pns = tbl_get_list(tbl, loop_node.get_mkey())
 
-                pn_ent = SourceCodeEntity(uri=pn)
+                pn_ent = decode_entity(pn)
                 r = pn_ent.get_range()
                 st = {'line':r.get_start_line(),'ch':r.get_start_col()}
                 ed = {'line':r.get_end_line(),'ch':r.get_end_col()}
                 d = {'start':st,'end':ed}
 
                 if dtor:
-                    dtor_ent = SourceCodeEntity(uri=dtor)
+                    dtor_ent = decode_entity(dtor)
                     dtor_fid = dtor_ent.get_file_id()
 
                     df = {'line':dtor_ent.get_range().get_start_line()}
@@ -310,7 +317,9 @@ class Outline(OutlineBase):
     def extract_metrics(self):
         if self._metrics == None:
             self.message('extracting metrics...')
-            self._metrics = Metrics(self._proj_id, self._method, pw=self._pw, port=self._port)
+            self._metrics = Metrics(self._proj_id, self._method, pw=self._pw, port=self._port,
+                                    pool=self._pool, nworkers=self._nworkers,
+                                    cache=self._cache, profiler=self._profiler)
             self._metrics.calc()
             self.message('done.')
 
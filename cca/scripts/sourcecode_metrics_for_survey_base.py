@@ -22,14 +22,18 @@
 __author__ = 'Masatomo Hashimoto <m.hashimoto@stair.center>'
 
 import pprint
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import pathsetup
 import dp
 
-from sparql import get_localname
+from sparql import get_localname, get_uri_id, get_uri
 import sparql
 from ns import FB_NS, NS_TBL
-from virtuoso import VIRTUOSO_PW, VIRTUOSO_PORT
+from virtuoso import VIRTUOSO_PW, VIRTUOSO_PORT, ROW_DICT, ROW_TUPLE
 
 
 LINES_OF_CODE        = 'lines_of_code'
@@ -176,13 +180,66 @@ class Ent:
         
 
 
+PREFETCH_BUFSIZE = 4096 # rows buffered for each prefetched query
+PREFETCH_END = object()
+
+class PrefetchError(object):
+    def __init__(self, exn):
+        self.exn = exn
+
+# rows of a query that runs ahead of its consumer
+class Prefetched(object):
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=PREFETCH_BUFSIZE)
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def put(self, x): # returns False once cancelled
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(x, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        try:
+            while True:
+                x = self._queue.get()
+                if x is PREFETCH_END:
+                    break
+                if isinstance(x, PrefetchError):
+                    raise x.exn
+                yield x
+        finally:
+            self.cancel()
+
+
 class MetricsBase(dp.base):
     def __init__(self, proj_id, method='odbc',
-                 pw=VIRTUOSO_PW, port=VIRTUOSO_PORT):
+                 pw=VIRTUOSO_PW, port=VIRTUOSO_PORT, pool=None, nworkers=0, cache=None,
+                 profiler=None):
 
         self._proj_id = proj_id
         self._graph_uri = FB_NS + proj_id
-        self._sparql = sparql.get_driver(method, pw=pw, port=port)
+        self._sparql = sparql.get_driver(method, pw=pw, port=port, pool=pool, profiler=profiler)
+        if cache:
+            self._sparql = sparql.CachedDriver(self._sparql, cache, graph_uri=self._graph_uri)
+        self._pool = pool
+        self._nworkers = nworkers
+
+        # for the largest results. the other drivers build dicts anyway and
+        # leave unbound variables out of them, which get_key relies on
+        self._row_type = ROW_TUPLE if method == 'odbc' else ROW_DICT
+
+        self._prefetched = OrderedDict() # (query * row type) -> Prefetched
+        self._prefetch_executor = None
 
         self._tree = None
 
@@ -190,13 +247,79 @@ class MetricsBase(dp.base):
 
         self._metadata_tbl = {} # (ver * loc * lnum) -> {'sub','digest'}
 
-        self._ipp_tbl = {} # uri -> uri (inter-procedural parent tbl)
+        self._ipp_tbl = {} # uri id -> uri id set (inter-procedural parent tbl)
 
-        self._ent_tbl = {} # uri -> is_loop
+        self._ent_tbl = {} # uri id -> is_loop
 
         self._loop_digest_tbl = {} # (ver * loc * sub * loop) -> digest set
 
-        self._max_loop_level_tbl = {} # uri -> lv
+        self._max_loop_level_tbl = {} # uri id -> lv
+
+    def query(self, q, row_type=ROW_DICT):
+        rows = None
+        k = (q, row_type)
+        if k in self._prefetched:
+            # queries are consumed in the order of prefetching, so the ones
+            # before q were skipped
+            while True:
+                (k_, p) = self._prefetched.popitem(last=False)
+                if k_ == k:
+                    rows = p
+                    break
+                p.cancel()
+        if rows == None:
+            rows = self._sparql.query(q, row_type=row_type)
+        return rows
+
+    def get_queries(self): # (query * row type) list
+        return []
+
+    def _prefetch(self, q, row_type, p):
+        if p.is_cancelled():
+            return
+        rows = None
+        try:
+            rows = self._sparql.query(q, row_type=row_type)
+            for x in rows:
+                if not p.put(x):
+                    return
+        except Exception as e:
+            p.put(PrefetchError(e))
+            return
+        finally:
+            close = getattr(rows, 'close', None)
+            if close:
+                close()
+        p.put(PREFETCH_END)
+
+    def prefetch(self, queries): # runs at most nworkers queries ahead of calc_* steps
+        nworkers = self._nworkers
+        if self._pool:
+            nworkers = min(nworkers, self._pool.get_maxsize())
+        else:
+            nworkers = 0
+
+        if nworkers < 2:
+            if self._nworkers > 1:
+                self.warning('concurrent queries need a connection pool')
+            return
+
+        self.message('prefetching %d queries (nworkers=%d)...' % (len(queries), nworkers))
+
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=nworkers)
+        for (q, row_type) in queries:
+            if (q, row_type) not in self._prefetched:
+                p = Prefetched()
+                self._prefetched[(q, row_type)] = p
+                self._prefetch_executor.submit(self._prefetch, q, row_type, p)
+
+    def end_prefetch(self):
+        for p in self._prefetched.values():
+            p.cancel()
+        self._prefetched.clear()
+        if self._prefetch_executor:
+            self._prefetch_executor.shutdown(wait=True)
+            self._prefetch_executor = None
 
     def get_loop_digest(self, key):
         digest = None
@@ -284,6 +407,8 @@ class MetricsBase(dp.base):
         pass
 
     def ipp_add(self, ent, parent, is_loop=False):
+        ent = get_uri_id(ent)
+        parent = get_uri_id(parent)
         try:
             s = self._ipp_tbl[ent]
         except KeyError:
@@ -362,6 +487,15 @@ class MetricsBase(dp.base):
         key = ('', '', '', '', '')
         return key
 
+    def get_tuple_key(self, qvs): # get_key for tuple rows
+        return lambda row: self.get_key(dict(zip(qvs, row)))
+
+    def get_aref_readers(self, qvs): # key and sig getters for rows of self._row_type
+        if self._row_type == ROW_TUPLE:
+            i_sig = qvs.index('sig')
+            return (self.get_tuple_key(qvs), lambda row: row[i_sig])
+        return (self.get_key, lambda row: row.get('sig'))
+
     def get_loop_of_key(self, key):
         (lver, loc, sub, loop, vname) = key
         return loop
@@ -376,7 +510,7 @@ class MetricsBase(dp.base):
             self.set_metrics(MAX_LOOP_LEVEL, key, lv)
 
     def get_max_loop_level(self, ent):
-        lv = self._get_max_loop_level([], ent)
+        lv = self._get_max_loop_level([], get_uri_id(ent))
         return lv
             
     def _get_max_loop_level(self, traversed, ent):
@@ -387,7 +521,7 @@ class MetricsBase(dp.base):
             n = len(traversed)
             lvs = []
             indent = '  '*n
-            self.debug('%s* %s ->' % (indent, ent_to_str(ent)))
+            self.debug('%s* %s ->' % (indent, ent_to_str(get_uri(ent))))
             for p in self._ipp_tbl.get(ent, []):
                 lv = 0
                 is_loop = self._ent_tbl[p]
@@ -397,7 +531,7 @@ class MetricsBase(dp.base):
                         lv += 1
                     lv += self._get_max_loop_level([ent]+traversed, p)
 
-                self.debug('%s  %s (%s) %d' % (indent, ent_to_str(p), is_loop, lv))
+                self.debug('%s  %s (%s) %d' % (indent, ent_to_str(get_uri(p)), is_loop, lv))
 
                 lvs.append(lv)
 
@@ -25,11 +25,13 @@ import pathsetup
 import dp
 
 import sparql
-from factutils.entity import SourceCodeEntity
+from factutils.entity import from_uri as decode_entity
 from virtuoso import VIRTUOSO_PW, VIRTUOSO_PORT
 from sourcecode_metrics_for_survey_base import get_lver, get_proj_list, ftbl_list_to_orange, MetricsBase
 from metrics_queries_cpp import QUERY_TBL
 
+sparql.register_queries(QUERY_TBL, prefix='metrics_cpp.')
+
 FOP_TBL = { # number of FP operations (for SPARC64 VIIIfx)
     'nint'  : 2,
     'jnint' : 2,
@@ -209,9 +211,11 @@ def ftbl_to_string(ftbl):
 
 class Metrics(MetricsBase):
     def __init__(self, proj_id, method='odbc',
-                 pw=VIRTUOSO_PW, port=VIRTUOSO_PORT):
+                 pw=VIRTUOSO_PW, port=VIRTUOSO_PORT, pool=None, nworkers=0, cache=None,
+                 profiler=None):
 
-        MetricsBase.__init__(self, proj_id, method, pw, port)
+        MetricsBase.__init__(self, proj_id, method, pw, port, pool=pool, nworkers=nworkers,
+                             cache=cache, profiler=profiler)
 
 
     def find_ftbl(self, key):
@@ -255,7 +259,7 @@ class Metrics(MetricsBase):
 
     def key_to_string(self, key):
         (ver, loc, fn, loop, vname) = key
-        e = SourceCodeEntity(uri=loop)
+        e = decode_entity(loop)
         lnum = e.get_range().get_start_line()
         s = '%s:%s:%s:%s' % (ver, loc, fn, lnum)
         return s
@@ -266,7 +270,7 @@ class Metrics(MetricsBase):
 
         (ver, loc, fn, loop, vname) = _key
 
-        ent = SourceCodeEntity(uri=loop)
+        ent = decode_entity(loop)
         lnum = ent.get_range().get_start_line()
 
         key = (ver, loc, str(lnum))
@@ -354,7 +358,7 @@ class Metrics(MetricsBase):
         for k in children_tbl.keys():
             if k not in parent_tbl:
                 roots.append(k)
-                r = SourceCodeEntity(uri=self.get_loop_of_key(k)).get_range()
+                r = decode_entity(self.get_loop_of_key(k)).get_range()
                 lines = r.get_end_line() - r.get_start_line() + 1
                 self.set_metrics(LINES_OF_CODE, k, lines)
 
@@ -378,6 +382,15 @@ class Metrics(MetricsBase):
         key = (lver, loc, fn, loop, vname)
         return key
 
+    def get_tuple_key(self, qvs):
+        idx = dict((v, i) for (i, v) in enumerate(qvs))
+        (i_ver, i_loc, i_loop) = (idx['ver'], idx['loc'], idx['loop'])
+        i_fn = idx.get('fn', None)
+        def get_key(row):
+            fn = '' if i_fn == None else row[i_fn]
+            return (get_lver(row[i_ver]), row[i_loc], fn, row[i_loop], '')
+        return get_key
+
 
     def calc_array_metrics(self):
         self.message('calculating array metrics...')
@@ -535,11 +548,15 @@ class Metrics(MetricsBase):
 
                 query = qtbl[kind] % {'proj':self._graph_uri,'level':lv}
 
-                for qvs, row in self._sparql.query(query):
+                get_key = None
+                for qvs, row in self._sparql.query(query, row_type=self._row_type):
+
+                    if get_key == None:
+                        (get_key, get_sig) = self.get_aref_readers(qvs)
 
-                    key = self.get_key(row)
+                    key = get_key(row)
 
-                    sig = row.get('sig')
+                    sig = get_sig(row)
 
                     if sig:
                         try:
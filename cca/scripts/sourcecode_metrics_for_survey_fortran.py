@@ -25,11 +25,13 @@ import pathsetup
 import dp
 
 import sparql
-from factutils.entity import SourceCodeEntity
-from virtuoso import VIRTUOSO_PW, VIRTUOSO_PORT
+from factutils.entity import from_uri as decode_entity
+from virtuoso import VIRTUOSO_PW, VIRTUOSO_PORT, ROW_DICT
 from sourcecode_metrics_for_survey_base import get_proj_list, get_lver, ftbl_list_to_orange, MetricsBase
 from metrics_queries_fortran import QUERY_TBL
 
+sparql.register_queries(QUERY_TBL, prefix='metrics_fortran.')
+
 FOP_TBL = { # number of FP operations (for SPARC64 VIIIfx)
     'nint'  : 2,
     'jnint' : 2,
@@ -208,9 +210,11 @@ def ftbl_to_string(ftbl):
 
 class Metrics(MetricsBase):
     def __init__(self, proj_id, method='odbc',
-                 pw=VIRTUOSO_PW, port=VIRTUOSO_PORT):
+                 pw=VIRTUOSO_PW, port=VIRTUOSO_PORT, pool=None, nworkers=0, cache=None,
+                 profiler=None):
 
-        MetricsBase.__init__(self, proj_id, method, pw, port)
+        MetricsBase.__init__(self, proj_id, method, pw, port, pool=pool, nworkers=nworkers,
+                             cache=cache, profiler=profiler)
 
 
     def find_ftbl(self, key):
@@ -252,7 +256,7 @@ class Metrics(MetricsBase):
         
     def key_to_string(self, key):
         (ver, loc, sub, loop, vname) = key
-        e = SourceCodeEntity(uri=loop)
+        e = decode_entity(loop)
         lnum = e.get_range().get_start_line()
         s = '%s:%s:%s:%s' % (ver, loc, sub, lnum)
         return s
@@ -262,7 +266,7 @@ class Metrics(MetricsBase):
 
         (ver, loc, sub, loop, vname) = _key
 
-        ent = SourceCodeEntity(uri=loop)
+        ent = decode_entity(loop)
         lnum = ent.get_range().get_start_line()
 
         key = (ver, loc, str(lnum))
@@ -292,14 +296,14 @@ class Metrics(MetricsBase):
 
         query = QUERY_TBL['sp_sp'] % { 'proj' : self._graph_uri }
 
-        for qvs, row in self._sparql.query(query):
+        for qvs, row in self.query(query):
             callee = row['callee']
             sp     = row['sp']
             self.ipp_add(callee, sp)
 
         query = QUERY_TBL['loop_sp'] % { 'proj' : self._graph_uri }
 
-        for qvs, row in self._sparql.query(query):
+        for qvs, row in self.query(query):
             callee = row['callee']
             loop   = row['loop']
             self.ipp_add(callee, loop, is_loop=True)
@@ -311,7 +315,7 @@ class Metrics(MetricsBase):
         children_tbl = {}
         parent_tbl = {}
 
-        for qvs, row in self._sparql.query(query):
+        for qvs, row in self.query(query):
             ver   = row['ver']
             loc   = row['loc']
             sub   = row.get('sub', '')
@@ -350,7 +354,7 @@ class Metrics(MetricsBase):
         for k in children_tbl.keys():
             if k not in parent_tbl:
                 roots.append(k)
-                r = SourceCodeEntity(uri=self.get_loop_of_key(k)).get_range()
+                r = decode_entity(self.get_loop_of_key(k)).get_range()
                 lines = r.get_end_line() - r.get_start_line() + 1
                 self.set_metrics(LINES_OF_CODE, k, lines)
 
@@ -374,6 +378,17 @@ class Metrics(MetricsBase):
         key = (lver, loc, sub, loop, vname)
         return key
 
+    def get_tuple_key(self, qvs):
+        idx = dict((v, i) for (i, v) in enumerate(qvs))
+        (i_ver, i_loc, i_loop) = (idx['ver'], idx['loc'], idx['loop'])
+        i_sub = idx.get('sub', None)
+        i_vname = idx.get('vname', None)
+        def get_key(row):
+            sub = '' if i_sub == None else row[i_sub]
+            vname = '' if i_vname == None else row[i_vname]
+            return (get_lver(row[i_ver]), row[i_loc], sub, row[i_loop], vname)
+        return get_key
+
     def calc_array_metrics(self):
         self.message('calculating array metrics...')
 
@@ -382,7 +397,7 @@ class Metrics(MetricsBase):
 
             tbl = {}
 
-            for qvs, row in self._sparql.query(query):
+            for qvs, row in self.query(query):
                 key = self.get_key(row)
 
                 array = row['edecl']
@@ -460,7 +475,7 @@ class Metrics(MetricsBase):
 
             tbl = {}
 
-            for qvs, row in self._sparql.query(query):
+            for qvs, row in self.query(query):
 
                 key = self.get_key(row)
 
@@ -530,11 +545,15 @@ class Metrics(MetricsBase):
 
                 query = qtbl[kind] % {'proj':self._graph_uri,'level':lv}
 
-                for qvs, row in self._sparql.query(query):
+                get_key = None
+                for qvs, row in self.query(query, row_type=self._row_type):
 
-                    key = self.get_key(row)
+                    if get_key == None:
+                        (get_key, get_sig) = self.get_aref_readers(qvs)
 
-                    sig = row.get('sig')
+                    key = get_key(row)
+
+                    sig = get_sig(row)
 
                     if sig:
                         try:
@@ -584,7 +603,7 @@ class Metrics(MetricsBase):
 
             tbl = {}
 
-            for qvs, row in self._sparql.query(query):
+            for qvs, row in self.query(query):
 
                 key = self.get_key(row)
 
@@ -627,7 +646,7 @@ class Metrics(MetricsBase):
 
             tbl = {} # key -> hash -> fname * nargs * is_dbl
 
-            for qvs, row in self._sparql.query(query):
+            for qvs, row in self.query(query):
 
                 key = self.get_key(row)
 
@@ -650,7 +669,7 @@ class Metrics(MetricsBase):
             #
 
             query = QUERY_TBL['dfr_in_loop'] % { 'proj' : self._graph_uri }
-            for qvs, row in self._sparql.query(query):
+            for qvs, row in self.query(query):
                 key = self.get_key(row)
                 fref_tbl = tbl.get(key, None)
                 if fref_tbl:
@@ -710,18 +729,42 @@ class Metrics(MetricsBase):
                 del tbl[k]
         
 
+    def get_queries(self): # in the order of consumption
+        params = { 'proj' : self._graph_uri }
+        queries = [(QUERY_TBL[n] % params, ROW_DICT) for n in ('loop_loop',
+                                                               'arrays',
+                                                               'fop_in_loop',
+                                                               'ffr_in_loop',
+                                                               'dfr_in_loop')]
+        for lv in range(3):
+            if lv == 0:
+                qtbl = QUERY_TBL['aref0_in_loop']
+            else:
+                qtbl = QUERY_TBL['aref12_in_loop']
+            for kind in ['aa','iaa','daa']:
+                queries.append((qtbl[kind] % {'proj':self._graph_uri,'level':lv}, self._row_type))
+
+        queries += [(QUERY_TBL[n] % params, ROW_DICT) for n in ('in_loop', 'sp_sp', 'loop_sp')]
+
+        return queries
+
     def calc(self):
         self.message('calculating for "%s"...' % self._proj_id)
-        self.calc_loop_metrics()
-        self.calc_array_metrics()
-        self.calc_fop_in_loop_metrics()
-        self.calc_ffr_in_loop_metrics()
+        if self._nworkers > 1:
+            self.prefetch(self.get_queries())
+        try:
+            self.calc_loop_metrics()
+            self.calc_array_metrics()
+            self.calc_fop_in_loop_metrics()
+            self.calc_ffr_in_loop_metrics()
 
-        for lv in range(3):
-            self.calc_aref_in_loop_metrics(lv)
+            for lv in range(3):
+                self.calc_aref_in_loop_metrics(lv)
 
-        self.calc_in_loop_metrics()
-        self.finalize_ipp()
+            self.calc_in_loop_metrics()
+            self.finalize_ipp()
+        finally:
+            self.end_prefetch()
         self.calc_max_loop_level()
         self.filter_results()
 
@@ -743,6 +786,9 @@ if __name__ == '__main__':
     parser.add_argument('-m', '--method', dest='method', default='odbc',
                         metavar='METHOD', type=str, help='execute query via METHOD (odbc|http)')
 
+    parser.add_argument('-j', '--nworkers', dest='nworkers', default=0,
+                        metavar='N', type=int, help='execute queries on N connections concurrently')
+
     parser.add_argument('proj_list', nargs='*', default=[], 
                         metavar='PROJ', type=str, help='project id (default: all projects)')
 
@@ -773,8 +819,12 @@ if __name__ == '__main__':
 
     ftbl_list = []
 
+    pool = None
+    if args.method == 'odbc' and args.nworkers > 1:
+        pool = sparql.get_pool(maxsize=args.nworkers)
+
     for proj_id in proj_list:
-        m = Metrics(proj_id, method=args.method)
+        m = Metrics(proj_id, method=args.method, pool=pool, nworkers=args.nworkers)
         m.calc()
 
         if args.key:
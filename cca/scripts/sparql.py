@@ -21,12 +21,32 @@
 
 # Fortran namespaces added by Masatomo Hashimoto <m.hashimoto@riken.jp>
 
+import os
+import sys
+import re
+import csv
+import json
+import time
+import zlib
+import codecs
+import hashlib
+import functools
+import threading
+import queue
+import http.client
+from urllib.parse import urlencode, urlsplit
+import msgpack
+
 import pathsetup
 import dp
 from siteconf import SPARQL_ENDPOINT
-from virtuoso import ODBCDriver, VIRTUOSO_PW, VIRTUOSO_PORT, get_odbc_connect_string
+from virtuoso import ODBCDriver, ODBCConnectionPool, VIRTUOSO_PW, VIRTUOSO_PORT, DEFAULT_POOL_SIZE
+from virtuoso import DEFAULT_FETCH_SIZE, ROW_DICT, ROW_TUPLE
+from virtuoso import get_odbc_connect_string
+import localstore
 import ns
 from factutils.const import ENTITY_NS, VARIANT_NS, SVNREV_NS, GITREV_NS, RELEASE_NS
+from factutils.fileid import HashAlgo, hash_tree
 
 
 
@@ -53,14 +73,83 @@ NAMESPACES = { 'xsd'  : ns.XSD_NS,
                'fjpadata' : ns.PREFIX_TBL['fjpadata'],
            }
 
+RESULT_FILE_FMT = '{}.msg'
+COMPLETE_FILE_FMT = '{}.complete'
+
+HTTP_TIMEOUT = 600 # sec
+HTTP_READ_SIZE = 64 * 1024
+
+FORMAT_JSON = 'json'
+FORMAT_TSV  = 'tsv'
+
+HTTP_FORMAT_TBL = {
+    FORMAT_JSON : 'application/sparql-results+json',
+    FORMAT_TSV  : 'text/tab-separated-values',
+}
+
+SLOW_QUERY_THRESH = 10.0 # sec
+
+PROFILE_FIELDS = ['stage', 'name', 'kind', 'wall', 'first_row', 'rows', 'bytes', 'error']
+
+HTTP_PAGE_SIZE = 10000 # should not exceed ResultSetMaxRows (see virtuoso_ini)
+
+
 
+NAME_CACHE_SIZE = 65536
 
+MAX_INTERNED_LEN = 256 # longer literals are not interned
+MAX_INTERNED_URIS = 4000000 # result URIs beyond this are not interned
+
+NS_SEPS = ('/', '#') # every namespace in NAMESPACES ends with one of these
+
+
+def mkprefixindex(nss):
+    idx = {}
+    for (n, p) in nss.items():
+        if not p.endswith(NS_SEPS):
+            dp.warning('namespace does not end with a separator: "%s"' % p)
+        idx[p] = n
+    return idx
+
+NS_INDEX = mkprefixindex(NAMESPACES) # namespace -> prefix name
+
+
+def find_prefix(v, idx=NS_INDEX):
+    # candidate namespaces are v[:i+1] for each separator position i;
+    # trying them right to left yields the longest match first
+    i = len(v)
+    while True:
+        i = max(v.rfind('/', 0, i), v.rfind('#', 0, i))
+        if i < 0:
+            return None
+        p = v[:i+1]
+        n = idx.get(p, None)
+        if n != None:
+            return (n, p)
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def to_prefixed_form(v):
+    r = v
+    if v:
+        try:
+            np = find_prefix(v)
+            if np:
+                (n, p) = np
+                r = '%s:%s' % (n, v[len(p):])
+        except Exception as e:
+            dp.warning('"%s": %s' % (v, e))
+
+    return r
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
 def get_localname(s):
     res = s
     if s:
         try:
             if s.startswith('http://'):
-                res = (s.split('/'))[-1].split('#')[-1]
+                res = s[max(s.rfind('/'), s.rfind('#'))+1:]
         except Exception as e:
             dp.warning(str(e))
 
@@ -68,30 +157,96 @@ def get_localname(s):
 
 
 
+# ids are only valid until clear() is called, which the analyzers do
+# when they are done with a project
+class UriTable(object):
+    def __init__(self, max_interned=MAX_INTERNED_URIS):
+        self._id_tbl = {}   # uri -> id
+        self._uri_list = [] # id -> uri
+        self._max_interned = max_interned
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._uri_list)
+
+    def get_id(self, uri):
+        i = self._id_tbl.get(uri, None)
+        if i == None:
+            with self._lock:
+                i = self._id_tbl.get(uri, None)
+                if i == None:
+                    i = len(self._uri_list)
+                    self._uri_list.append(uri)
+                    self._id_tbl[uri] = i
+        return i
+
+    def get_uri(self, i):
+        return self._uri_list[i]
+
+    def intern(self, uri): # returns the shared copy
+        i = self._id_tbl.get(uri, None)
+        if i == None:
+            if len(self._uri_list) >= self._max_interned:
+                return uri
+            i = self.get_id(uri)
+        return self._uri_list[i]
+
+    def clear(self):
+        with self._lock:
+            self._id_tbl = {}
+            self._uri_list = []
+
+URI_TABLE = UriTable()
+
+def clear_uri_table():
+    URI_TABLE.clear()
+
+def get_uri_id(uri):
+    return URI_TABLE.get_id(uri)
+
+def get_uri(i):
+    return URI_TABLE.get_uri(i)
+
+def intern_value(v):
+    if isinstance(v, str):
+        if v.startswith('http://'):
+            v = URI_TABLE.intern(v)
+        elif len(v) < MAX_INTERNED_LEN:
+            v = sys.intern(v)
+    return v
+
+def intern_row(row):
+    if isinstance(row, dict):
+        for (k, v) in row.items():
+            if isinstance(v, str):
+                row[k] = intern_value(v)
+    else:
+        row = tuple([intern_value(v) for v in row])
+    return row
+
+# dict rows of the drivers that build them anyway are turned into the
+# requested row type, where unbound variables become None
+def to_row_type(qvs, row, row_type=ROW_DICT):
+    if row_type == ROW_DICT:
+        return row
+    elif row_type == ROW_TUPLE:
+        return tuple([row.get(v, None) for v in qvs])
+    else:
+        raise ValueError('unknown row type: %s' % row_type)
+
+
 class Driver(dp.base):
     def __init__(self):
-        self._ns_tbl = {}
-        for (n, p) in NAMESPACES.items():
-            self._ns_tbl[p] = n
+        self._ns_tbl = NS_INDEX
 
     def to_prefixed_form(self, v):
-        r = v
-        if v:
-            try:
-                for p in self._ns_tbl.keys():
-                    if v.startswith(p):
-                        r = '%s:%s' % (self._ns_tbl[p], v[len(p):])
-                        break
-            except Exception as e:
-                dp.warning('"%s": %s' % (v, e))
-
-        return r
+        return to_prefixed_form(v)
 
 
     def execute(self, q):
         pass
 
-    def query(self, q, abbrev=False):
+    def query(self, q, abbrev=False, row_type=ROW_DICT):
         return None
 
     def fetchone(self, q, abbrev=False):
@@ -99,9 +254,9 @@ class Driver(dp.base):
 
 
 class VirtuosoODBCDriver(ODBCDriver, Driver):
-    def __init__(self, pw=VIRTUOSO_PW, port=VIRTUOSO_PORT):
+    def __init__(self, pw=VIRTUOSO_PW, port=VIRTUOSO_PORT, pool=None):
         connect_string = get_odbc_connect_string(pwd=pw, port=port)
-        ODBCDriver.__init__(self, connect_string)
+        ODBCDriver.__init__(self, connect_string, pool=pool)
         Driver.__init__(self)
 
     def conv_row(self, row, abbrev=False):
@@ -111,9 +266,17 @@ class VirtuosoODBCDriver(ODBCDriver, Driver):
 
         return row
 
-    def query(self, q, abbrev=False):
-        for qvs, row in ODBCDriver.query(self, 'SPARQL\n'+q):
-            yield qvs, self.conv_row(row, abbrev)
+    def query_batches(self, q, abbrev=False, size=DEFAULT_FETCH_SIZE, row_type=ROW_DICT):
+        conv = None
+        if abbrev:
+            conv = self.to_prefixed_form
+        return ODBCDriver.query_batches(self, 'SPARQL\n'+q, size=size,
+                                        row_type=row_type, conv=conv)
+
+    def query(self, q, abbrev=False, size=DEFAULT_FETCH_SIZE, row_type=ROW_DICT):
+        for qvs, rows in self.query_batches(q, abbrev=abbrev, size=size, row_type=row_type):
+            for row in rows:
+                yield qvs, row
 
     def execute(self, q):
         ODBCDriver.execute(self, 'SPARQL\n'+q)
@@ -126,9 +289,189 @@ class VirtuosoODBCDriver(ODBCDriver, Driver):
 
 
 
+class HTTPQueryError(Exception):
+    pass
+
+
+TSV_ESC_PAT = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+
+TSV_ESC_TBL = {
+    't'  : '\t',
+    'b'  : '\b',
+    'n'  : '\n',
+    'r'  : '\r',
+    'f'  : '\f',
+    '"'  : '"',
+    "'"  : "'",
+    '\\' : '\\',
+}
+
+def tsv_unescape(s):
+    def repl(m):
+        (u4, u8, c) = m.groups()
+        if c == None:
+            return chr(int(u4 or u8, 16))
+        return TSV_ESC_TBL.get(c, c)
+
+    if '\\' in s:
+        s = TSV_ESC_PAT.sub(repl, s)
+    return s
+
+
+def iter_text(resp, size=HTTP_READ_SIZE):
+    enc = (resp.getheader('Content-Encoding') or '').lower()
+    decomp = None
+    if enc in ('gzip', 'x-gzip'):
+        decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif enc == 'deflate':
+        decomp = zlib.decompressobj()
+
+    decoder = codecs.getincrementaldecoder('utf-8')()
+
+    while True:
+        data = resp.read1(size) # whatever has arrived, so that rows stream
+        if not data:
+            break
+        if decomp:
+            data = decomp.decompress(data)
+        s = decoder.decode(data)
+        if s:
+            yield s
+
+    if resp.length or (decomp and not decomp.eof):
+        raise HTTPQueryError('response cut off')
+
+    if decomp:
+        s = decoder.decode(decomp.flush(), final=True)
+    else:
+        s = decoder.decode(b'', final=True)
+    if s:
+        yield s
+
+
+def iter_json_results(chunks):
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+
+    def fill():
+        nonlocal buf, pos
+        c = next(chunks, None)
+        if c == None:
+            return False
+        buf = buf[pos:] + c
+        pos = 0
+        return True
+
+    def find(tok):
+        nonlocal pos
+        while True:
+            i = buf.find(tok, pos)
+            if i >= 0:
+                pos = i + len(tok)
+                return True
+            pos = max(pos, len(buf) - len(tok))
+            if not fill():
+                return False
+
+    def decode():
+        nonlocal pos
+        while True:
+            try:
+                (obj, end) = decoder.raw_decode(buf, pos)
+                pos = end
+                return obj
+            except ValueError:
+                if not fill():
+                    raise
+
+    def skip(chars):
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in chars:
+                pos += 1
+            if pos < len(buf) or not fill():
+                return
+
+    if not find('"head"'):
+        return
+    skip(' \t\r\n:')
+    head = decode()
+    qvs = [str(v) for v in head.get('vars', [])]
+
+    if not find('"bindings"'):
+        return
+    skip(' \t\r\n:[')
+
+    while True:
+        skip(' \t\r\n,')
+        if pos >= len(buf):
+            raise ValueError('incomplete results')
+        if buf[pos] == ']':
+            break
+        yield qvs, decode()
+
+    while fill(): # drain
+        pos = len(buf)
+
+
+def iter_tsv_results(chunks):
+    buf = ''
+    qvs = None
+    for c in chunks:
+        buf += c
+        lines = buf.split('\n')
+        buf = lines.pop()
+        for line in lines:
+            line = line.rstrip('\r')
+            if qvs == None:
+                qvs = [v.lstrip('?$') for v in line.split('\t')]
+            elif line:
+                yield qvs, line.split('\t')
+    if buf and qvs != None:
+        yield qvs, buf.rstrip('\r').split('\t')
+
+
 class VirtuosoHTTPDriver(Driver):
-    def __init__(self, endpoint=SPARQL_ENDPOINT):
+    def __init__(self, endpoint=SPARQL_ENDPOINT, format=FORMAT_JSON, timeout=HTTP_TIMEOUT):
+        Driver.__init__(self)
         self._endpoint = endpoint
+        self._format = format
+        self._timeout = timeout
+
+        u = urlsplit(endpoint)
+        if u.scheme == 'https':
+            self._conn_class = http.client.HTTPSConnection
+        else:
+            self._conn_class = http.client.HTTPConnection
+        self._host = u.hostname
+        self._port = u.port
+        self._path = u.path or '/'
+
+        self._local = threading.local() # one persistent connection per thread
+
+    def get_conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn == None:
+            conn = self._conn_class(self._host, self._port, timeout=self._timeout)
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn:
+            conn.close()
+            self._local.conn = None
+
+    def conv_value(self, v, dty):
+        dty = self.to_prefixed_form(dty)
+        self.debug('%s (%s)' % (v, dty))
+        if dty == 'xsd:decimal':
+            v = float(v)
+        elif dty == 'xsd:integer':
+            v = int(v)
+        return v
 
     def conv_binding(self, b, abbrev=False):
         d = {}
@@ -136,13 +479,8 @@ class VirtuosoHTTPDriver(Driver):
             data = b[k]
             v = str(data['value'])
             ty = data['type']
-            if ty == 'typed-literal':
-                dty = self.to_prefixed_form(data['datatype'])
-                self.debug('%s (%s)' % (v, dty))
-                if dty == 'xsd:decimal':
-                    v = float(v)
-                elif dty == 'xsd:integer':
-                    v = int(v)
+            if ty == 'typed-literal' or (ty == 'literal' and 'datatype' in data):
+                v = self.conv_value(v, data['datatype'])
 
             if abbrev:
                 if ty == 'uri':
@@ -151,65 +489,675 @@ class VirtuosoHTTPDriver(Driver):
             d[k] = v
         return d
 
-    def _exec(self, q, limit=-1):
-        import json
-        from urllib.parse import urlencode
-        from urllib.request import Request, urlopen
-
-        format = 'application/json'
+    def conv_term(self, t, abbrev=False):
+        if t.startswith('<') and t.endswith('>'):
+            v = t[1:-1]
+            if abbrev:
+                v = self.to_prefixed_form(v)
+        elif t.startswith('"'):
+            i = t.rfind('"')
+            v = tsv_unescape(t[1:i])
+            rest = t[i+1:]
+            if rest.startswith('^^<'):
+                v = self.conv_value(v, rest[3:-1])
+        elif t.startswith('_:'):
+            v = t[2:]
+        else: # bare numeric or boolean
+            try:
+                v = int(t)
+            except ValueError:
+                if t[-1:].isdigit() and 'e' not in t.lower():
+                    v = float(t)
+                else:
+                    v = t
+        return v
+
+    def conv_fields(self, qvs, fields, abbrev=False):
+        d = {}
+        for (k, t) in zip(qvs, fields):
+            if t:
+                d[k] = self.conv_term(t, abbrev)
+        return d
 
+    def _request(self, q, limit=-1):
         if limit < 0:
             maxrows = ''
         else:
             maxrows = str(limit)
 
-        params = { 
-            'query'  : q,
-            'format' : format,
+        params = {
+            'query'   : q,
+            'format'  : HTTP_FORMAT_TBL[self._format],
             'maxrows' : maxrows,
         }
+        body = urlencode(params).encode('utf-8')
 
-        qpart = urlencode(params)
-
-        req = Request(self._endpoint, qpart)
-
-        response = urlopen(req).read()
-        
-        result = json.loads(response)
+        headers = {
+            'Content-Type'    : 'application/x-www-form-urlencoded',
+            'Accept'          : HTTP_FORMAT_TBL[self._format],
+            'Accept-Encoding' : 'gzip, deflate',
+            'Connection'      : 'keep-alive',
+        }
 
-        return result
+        resp = None
+        for retry in (True, False):
+            conn = self.get_conn()
+            try:
+                conn.request('POST', self._path, body, headers)
+                resp = conn.getresponse()
+                break
+            except (http.client.HTTPException, OSError):
+                self.close() # the server may have dropped an idle connection
+                if not retry:
+                    raise
+
+        if resp.status != 200:
+            msg = resp.read().decode('utf-8', 'replace')
+            if resp.will_close:
+                self.close()
+            raise HTTPQueryError('%d %s: %s' % (resp.status, resp.reason, msg))
+
+        return resp
+
+    def _exec(self, q, limit=-1, abbrev=False, row_type=ROW_DICT):
+        resp = self._request(q, limit)
+        completed = False
+        try:
+            chunks = iter_text(resp)
+            if self._format == FORMAT_TSV:
+                for qvs, fields in iter_tsv_results(chunks):
+                    yield qvs, to_row_type(qvs, self.conv_fields(qvs, fields, abbrev), row_type)
+            else:
+                for qvs, b in iter_json_results(chunks):
+                    yield qvs, to_row_type(qvs, self.conv_binding(b, abbrev), row_type)
+            completed = True
+        finally:
+            if not completed or resp.will_close:
+                self.close() # unread body left on the connection
+            resp.close()
 
     def execute(self, q):
-        self._exec(q)
+        for _ in self._exec(q):
+            pass
 
     def fetchone(self, q, abbrev=False):
         row = None
         try:
-            r = self._exec(q, limit=1)
-            b = r['results']['bindings'][0]
-            row = self.conv_binding(b, abbrev)
+            for qvs, r in self._exec(q, limit=1, abbrev=abbrev):
+                if row == None:
+                    row = r
         except:
             pass
 
         return row
 
-    def query(self, q, abbrev=False, limit=-1):
-        result = self._exec(q, limit)
-        for b in result['results']['bindings']:
-            qvs = [str(v) for v in result['head']['vars']]
-            yield qvs, self.conv_binding(b, abbrev)
+    def query(self, q, abbrev=False, limit=-1, row_type=ROW_DICT):
+        return self._exec(q, limit, abbrev, row_type)
+
+
+
+class LocalDriver(Driver):
+    def __init__(self, store=None):
+        Driver.__init__(self)
+        if store == None:
+            store = localstore.get_store()
+        self._store = store
+
+    def conv_term(self, t, abbrev=False):
+        v = t
+        if isinstance(t, localstore.Literal):
+            dty = self.to_prefixed_form(str(t.datatype or ''))
+            if dty in ('xsd:integer', 'xsd:int', 'xsd:long'):
+                v = int(t)
+            elif dty in ('xsd:decimal', 'xsd:double', 'xsd:float'):
+                v = float(t)
+            else:
+                v = str(t)
+        elif t != None:
+            v = str(t)
+            if abbrev and isinstance(t, localstore.URIRef):
+                v = self.to_prefixed_form(v)
+        return v
+
+    def query(self, q, abbrev=False, row_type=ROW_DICT):
+        res = self._store.query(q)
+        qvs = [str(v) for v in res.vars]
+        for r in res:
+            if row_type == ROW_TUPLE:
+                yield qvs, tuple([self.conv_term(t, abbrev) for t in r])
+                continue
+            row = {}
+            for (k, t) in zip(qvs, r):
+                if t != None:
+                    row[k] = self.conv_term(t, abbrev)
+            yield qvs, to_row_type(qvs, row, row_type)
+
+    def execute(self, q):
+        if localstore.INSERT_PAT.search(q):
+            self._store.update(q)
+        else:
+            for _ in self.query(q):
+                pass
+
+    def fetchone(self, q, abbrev=False):
+        row = None
+        for qvs, r in self.query(q, abbrev=abbrev):
+            row = r
+            break
+        return row
+
+
+
+PROLOGUE_PAT = re.compile(r'\A(?:\s*(?:DEFINE\s+\S+\s+(?:"[^"]*"|<[^>]*>|\S+)|PREFIX\s+\S*:\s*<[^>]*>|BASE\s+<[^>]*>))*\s*',
+                          re.I)
+SELECT_PAT = re.compile(r'\ASELECT\s+(?:(?:DISTINCT|REDUCED)\s+)?(?P<vars>(?:\?\w+\s+)+)WHERE\b', re.I)
+ORDER_BY_PAT = re.compile(r'\bORDER\s+BY\b[^}]*\Z', re.I)
+LIMIT_OFFSET_PAT = re.compile(r'\b(?:LIMIT|OFFSET)\s+\d+[^}]*\Z', re.I)
+SELECT_ALL_PAT = re.compile(r'\ASELECT\s+(?:(?:DISTINCT|REDUCED)\s+)?\*', re.I)
+ORDER_VAR_PAT = re.compile(r'[?$](\w+)')
+
+def split_query(q):
+    m = PROLOGUE_PAT.match(q)
+    return (q[:m.end()], q[m.end():].rstrip())
+
+
+class PagedDriver(Driver):
+    def __init__(self, driver, page_size=HTTP_PAGE_SIZE):
+        Driver.__init__(self)
+        self._driver = driver
+        self._page_size = page_size
+        self._npages = 0 # total number of pages fetched
+
+    def get_npages(self):
+        return self._npages
+
+    def get_paged_query(self, q):
+        (prologue, body) = split_query(q)
+
+        if not body[:6].upper() == 'SELECT':
+            return None
+        if LIMIT_OFFSET_PAT.search(body):
+            return None
+
+        # the order of a subquery is not kept in the outer query, so pages
+        # are ordered outside, by the projected variables to break ties
+        pvs = None # projected variables, None for all
+        m = SELECT_PAT.match(body)
+        if m:
+            pvs = m.group('vars').split()
+        elif not SELECT_ALL_PAT.match(body):
+            self.debug('cannot determine page order: %s' % body[:64])
+            return None
+
+        order = []
+        mo = ORDER_BY_PAT.search(body)
+        if mo:
+            conds = re.sub(r'\AORDER\s+BY\s*', '', body[mo.start():], flags=re.I).strip()
+            if pvs != None and any('?'+v not in pvs for v in ORDER_VAR_PAT.findall(conds)):
+                self.debug('ordered by variables not projected: %s' % conds)
+                return None
+            order.append(conds)
+            body = body[:mo.start()].rstrip()
+        elif pvs == None:
+            self.debug('cannot determine page order: %s' % body[:64])
+            return None
+        if pvs:
+            order.extend(pvs)
+
+        return '%sSELECT * WHERE {\n{\n%s\n}\n}\nORDER BY %s\n' % (prologue, body, ' '.join(order))
+
+    def _fetch(self, q, pages, stop, abbrev=False, row_type=ROW_DICT):
+        try:
+            offset = 0
+            while not stop.is_set():
+                pq = '%sLIMIT %d OFFSET %d' % (q, self._page_size, offset)
+                page = list(self._driver.query(pq, abbrev=abbrev, row_type=row_type))
+                pages.put(page)
+                if len(page) < self._page_size:
+                    break
+                offset += self._page_size
+        except BaseException as e:
+            pages.put(e)
+        pages.put(None)
+
+    def _query(self, pq, abbrev=False, row_type=ROW_DICT):
+        pages = queue.Queue(maxsize=1) # fetch the next page while the current one is consumed
+        stop = threading.Event()
+        th = threading.Thread(target=self._fetch, args=(pq, pages, stop, abbrev, row_type), daemon=True)
+        th.start()
+        npages = 0
+        try:
+            while True:
+                page = pages.get()
+                if page == None:
+                    break
+                if isinstance(page, BaseException):
+                    raise page
+                npages += 1
+                for r in page:
+                    yield r
+        finally:
+            stop.set()
+            while th.is_alive(): # unblock the fetcher
+                try:
+                    pages.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self._npages += npages
+            self.verbose('%d page(s) fetched' % npages)
+
+    def query(self, q, abbrev=False, row_type=ROW_DICT):
+        pq = self.get_paged_query(q)
+        if pq == None:
+            return self._driver.query(q, abbrev=abbrev, row_type=row_type)
+        return self._query(pq, abbrev, row_type)
+
+    def execute(self, q):
+        self._driver.execute(q)
+
+    def fetchone(self, q, abbrev=False):
+        return self._driver.fetchone(q, abbrev=abbrev)
+
+
+
+class InternedDriver(Driver):
+    def __init__(self, driver):
+        Driver.__init__(self)
+        self._driver = driver
+
+    def _query(self, q, abbrev=False, row_type=ROW_DICT):
+        for qvs, row in self._driver.query(q, abbrev=abbrev, row_type=row_type):
+            yield qvs, intern_row(row)
+
+    def query(self, q, abbrev=False, row_type=ROW_DICT):
+        return self._query(q, abbrev, row_type)
+
+    def execute(self, q):
+        self._driver.execute(q)
+
+    def fetchone(self, q, abbrev=False):
+        row = self._driver.fetchone(q, abbrev=abbrev)
+        if row:
+            row = intern_row(row)
+        return row
+
+
+TEMPLATE_PARAM_PAT = re.compile(r'%%|%\(\w+\)[sd]')
+
+def mktemplatepat(t):
+    parts = []
+    pos = 0
+    for m in TEMPLATE_PARAM_PAT.finditer(t):
+        parts.append(re.escape(t[pos:m.start()]))
+        if m.group(0) == '%%':
+            parts.append('%')
+        else:
+            parts.append('.*?')
+        pos = m.end()
+    parts.append(re.escape(t[pos:]))
+    return re.compile(''.join(parts)+r'\Z', re.S)
+
+
+QUERY_NAMES = []     # (name * pattern) list
+QUERY_TEMPLATES = {} # name -> template
+QUERY_NAMES_LOCK = threading.Lock()
+
+def register_query(name, t):
+    global QUERY_NAMES
+    with QUERY_NAMES_LOCK:
+        if QUERY_TEMPLATES.get(name, None) == t:
+            return
+        # replaced rather than mutated, since the list is read without the lock
+        names = [x for x in QUERY_NAMES if x[0] != name]
+        names.append((name, mktemplatepat(t)))
+        QUERY_TEMPLATES[name] = t
+        QUERY_NAMES = names
+
+def register_queries(tbl, prefix=''):
+    for (k, t) in tbl.items():
+        name = prefix+str(k)
+        if isinstance(t, dict):
+            register_queries(t, prefix=name+'.')
+        else:
+            register_query(name, t)
+
+
+class QueryProfiler(dp.base):
+    def __init__(self, slow_thresh=SLOW_QUERY_THRESH):
+        self._slow_thresh = slow_thresh
+        self._records = []
+        self._name_tbl = {} # query -> name
+        self._lock = threading.Lock()
+
+    def get_name(self, q):
+        name = self._name_tbl.get(q, None)
+        if name == None:
+            for (n, pat) in QUERY_NAMES:
+                if pat.match(q):
+                    name = n
+                    break
+            else:
+                name = 'q-'+hashlib.sha1(q.encode('utf-8')).hexdigest()[:8]
+            self._name_tbl[q] = name
+        return name
+
+    def record(self, q, kind, wall, first_row=None, rows=0, nbytes=0, error=None):
+        rec = {
+            'stage'     : None,
+            'name'      : self.get_name(q),
+            'kind'      : kind,
+            'wall'      : wall,
+            'first_row' : first_row,
+            'rows'      : rows,
+            'bytes'     : nbytes,
+            'error'     : error,
+        }
+        if self._slow_thresh != None and wall > self._slow_thresh:
+            self.warning('slow query: %s (%.3fs, %d rows)' % (rec['name'], wall, rows))
+            rec['query'] = q
+        with self._lock:
+            self._records.append(rec)
+
+    def get_records(self):
+        with self._lock:
+            return list(self._records)
+
+    def get_summary(self, records):
+        tbl = {}
+        for rec in records:
+            name = rec['name']
+            try:
+                d = tbl[name]
+            except KeyError:
+                d = tbl[name] = {'name':name, 'count':0, 'wall':0.0, 'max_wall':0.0, 'rows':0, 'bytes':0}
+            d['count'] += 1
+            d['wall'] += rec['wall']
+            d['max_wall'] = max(d['max_wall'], rec['wall'])
+            d['rows'] += rec['rows']
+            d['bytes'] += rec['bytes']
+        return sorted(tbl.values(), key=lambda d: d['wall'], reverse=True)
+
+    def save(self, outdir, stage):
+        with self._lock:
+            records = self._records
+            self._records = []
+
+        if not records:
+            return
+
+        for rec in records:
+            rec['stage'] = stage
+
+        if not os.path.exists(outdir):
+            os.makedirs(outdir)
+
+        path = os.path.join(outdir, stage+'.json')
+        self.message('writing query profile to "%s"...' % path)
+        with open(path, 'w') as f:
+            summary = self.get_summary(records)
+            json.dump({'stage':stage, 'summary':summary, 'queries':records}, f, indent=1)
+
+        with open(os.path.join(outdir, stage+'.csv'), 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=PROFILE_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(records)
+
+        slow = [rec for rec in records if 'query' in rec]
+        if slow:
+            with open(os.path.join(outdir, stage+'.slow.log'), 'w') as f:
+                for rec in slow:
+                    f.write('# %s: %s %.3fs (first row: %s) %d rows\n' % (rec['name'],
+                                                                        rec['kind'],
+                                                                        rec['wall'],
+                                                                        rec['first_row'],
+                                                                        rec['rows']))
+                    f.write(rec['query'])
+                    f.write('\n\n')
+
+
+def get_row_size(row): # approximate size of the result data
+    sz = 0
+    if isinstance(row, dict):
+        row = row.values()
+    for v in row:
+        if isinstance(v, str):
+            sz += len(v)
+        elif v != None:
+            sz += 8
+    return sz
+
+
+class ProfiledDriver(Driver):
+    def __init__(self, driver, profiler):
+        Driver.__init__(self)
+        self._driver = driver
+        self._profiler = profiler
+
+    def _query(self, q, abbrev=False, row_type=ROW_DICT):
+        t0 = time.monotonic()
+        first_row = None
+        rows = 0
+        nbytes = 0
+        error = None
+        try:
+            for qvs, row in self._driver.query(q, abbrev=abbrev, row_type=row_type):
+                if first_row == None:
+                    first_row = time.monotonic() - t0
+                rows += 1
+                nbytes += get_row_size(row)
+                yield qvs, row
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self._profiler.record(q, 'query', time.monotonic() - t0, first_row=first_row,
+                                  rows=rows, nbytes=nbytes, error=error)
+
+    def query(self, q, abbrev=False, row_type=ROW_DICT):
+        return self._query(q, abbrev, row_type)
+
+    def execute(self, q):
+        t0 = time.monotonic()
+        error = None
+        try:
+            self._driver.execute(q)
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self._profiler.record(q, 'execute', time.monotonic() - t0, error=error)
+
+    def fetchone(self, q, abbrev=False):
+        t0 = time.monotonic()
+        row = self._driver.fetchone(q, abbrev=abbrev)
+        t = time.monotonic() - t0
+        rows = 0
+        nbytes = 0
+        if row:
+            rows = 1
+            nbytes = get_row_size(row)
+        self._profiler.record(q, 'fetchone', t, first_row=t, rows=rows, nbytes=nbytes)
+        return row
+
+
+
+class ResultCache(dp.base):
+    def __init__(self, cache_dir, fingerprint):
+        self._cache_dir = cache_dir
+        self._fingerprint = fingerprint
+        self._miss_handler = None
+        self._miss_error = None
+        self._lock = threading.Lock()
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def get_fingerprint(self):
+        return self._fingerprint
+
+    # f is called once before anything that is not cached reaches the
+    # server, e.g. to build the FB when it was skipped for a complete cache
+    def set_miss_handler(self, f):
+        with self._lock:
+            self._miss_handler = f
+            self._miss_error = None
+
+    def handle_miss(self):
+        # the others wait until f is done, and all get the error if it fails
+        with self._lock:
+            if self._miss_error:
+                raise self._miss_error
+            f = self._miss_handler
+            if f:
+                try:
+                    f()
+                except Exception as e:
+                    self._miss_error = e
+                    raise
+                finally:
+                    self._miss_handler = None
+
+    def get_path(self, graph_uri, q):
+        qh = hashlib.sha1(q.encode('utf-8')).hexdigest()
+        k = '\0'.join([graph_uri, qh, self._fingerprint])
+        key = hashlib.sha1(k.encode('utf-8')).hexdigest()
+        path = os.path.join(self._cache_dir, RESULT_FILE_FMT.format(key))
+        return path
+
+    def get_marker_path(self):
+        return os.path.join(self._cache_dir, COMPLETE_FILE_FMT.format(self._fingerprint))
+
+    def is_complete(self):
+        return os.path.exists(self.get_marker_path())
+
+    def get_version(self): # version recorded by mark_complete
+        ver = None
+        try:
+            with open(self.get_marker_path(), 'r') as f:
+                ver = f.read().strip()
+        except Exception as e:
+            self.warning(str(e))
+        return ver
+
+    def mark_complete(self, ver):
+        with open(self.get_marker_path(), 'w') as f:
+            f.write(ver)
+
+
+def compute_fingerprint(d, exts=None, exclude=[], nprocs=None, cache=None):
+    tbl = hash_tree(HashAlgo.SHA1, d, exts=exts, exclude=exclude, nprocs=nprocs, cache=cache)
+    h = hashlib.sha1()
+    for rel in sorted(tbl.keys()):
+        h.update(rel.encode('utf-8', 'replace')+b'\0'+tbl[rel].encode('utf-8')+b'\0')
+    return h.hexdigest()
+
+
+class CachedDriver(Driver):
+    def __init__(self, driver, cache, graph_uri=''):
+        Driver.__init__(self)
+        self._driver = driver
+        self._cache = cache
+        self._graph_uri = graph_uri
+
+    def conv_row(self, row, abbrev=False):
+        if row and abbrev:
+            if isinstance(row, dict):
+                for (k, v) in row.items():
+                    if isinstance(v, str):
+                        row[k] = self.to_prefixed_form(v)
+            else:
+                row = tuple([self.to_prefixed_form(v) if isinstance(v, str) else v for v in row])
+        return row
+
+    def _read_row(self, row, abbrev=False):
+        return self.conv_row(intern_row(row), abbrev)
+
+    def _read(self, path, abbrev=False, row_type=ROW_DICT):
+        with open(path, 'rb') as f:
+            unpacker = msgpack.Unpacker(f, raw=False)
+            qvs = None
+            for x in unpacker:
+                if qvs == None:
+                    qvs = x
+                    continue
+                if isinstance(x, dict):
+                    row = to_row_type(qvs, x, row_type)
+                elif row_type == ROW_TUPLE:
+                    row = tuple(x)
+                else:
+                    row = to_row_type(qvs, dict(zip(qvs, x)), row_type)
+                yield qvs, self._read_row(row, abbrev)
+
+    def _write(self, path, q, abbrev=False, row_type=ROW_DICT):
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        completed = False
+        try:
+            with open(tmp, 'wb') as f:
+                packer = msgpack.Packer(default=str, use_bin_type=True)
+                qvs = None
+                for qvs_, row in self._driver.query(q, row_type=row_type):
+                    if qvs == None:
+                        qvs = qvs_
+                        f.write(packer.pack(qvs))
+                    if not isinstance(row, dict):
+                        f.write(packer.pack(list(row)))
+                    elif len(row) == len(qvs):
+                        f.write(packer.pack([row[v] for v in qvs]))
+                    else:
+                        f.write(packer.pack(row))
+                    yield qvs, self.conv_row(row, abbrev)
+
+                if qvs == None:
+                    f.write(packer.pack([]))
+
+            os.replace(tmp, path)
+            completed = True
+
+        finally:
+            if not completed and os.path.exists(tmp):
+                os.remove(tmp)
+
+    def query(self, q, abbrev=False, row_type=ROW_DICT):
+        path = self._cache.get_path(self._graph_uri, q)
+        if os.path.exists(path):
+            self.debug('cache hit: %s' % os.path.basename(path))
+            return self._read(path, abbrev, row_type)
+        else:
+            self._cache.handle_miss()
+            return self._write(path, q, abbrev, row_type)
+
+    def execute(self, q):
+        self._cache.handle_miss()
+        self._driver.execute(q)
+
+    def fetchone(self, q, abbrev=False):
+        self._cache.handle_miss()
+        return self._driver.fetchone(q, abbrev=abbrev)
 
 
+def get_pool(pw=VIRTUOSO_PW, port=VIRTUOSO_PORT, maxsize=DEFAULT_POOL_SIZE):
+    connect_string = get_odbc_connect_string(pwd=pw, port=port)
+    pool = ODBCConnectionPool(connect_string, maxsize=maxsize)
+    return pool
 
 
-def get_driver(method='http', pw=VIRTUOSO_PW, port=VIRTUOSO_PORT):
+def get_driver(method='http', pw=VIRTUOSO_PW, port=VIRTUOSO_PORT, pool=None, page_size=HTTP_PAGE_SIZE,
+               profiler=None, intern=True):
     driver = None
     if method == 'http':
         driver = VirtuosoHTTPDriver()
+        if page_size > 0:
+            driver = PagedDriver(driver, page_size=page_size)
     elif method == 'odbc':
-        driver = VirtuosoODBCDriver(pw=pw, port=port)
+        driver = VirtuosoODBCDriver(pw=pw, port=port, pool=pool)
+    elif method == 'local':
+        driver = LocalDriver()
     else:
         dp.error('unknown method: "%s"' % method)
+    if driver and intern:
+        driver = InternedDriver(driver)
+    if driver and profiler:
+        driver = ProfiledDriver(driver, profiler)
     return driver
 
 
@@ -224,8 +1172,10 @@ def query():
     parser.add_argument('-d', '--debug', dest='debug', action='store_true', help='enable debug printing')
 
     parser.add_argument('-m', '--method', dest='method', default='odbc',
-                        metavar='METHOD', type=str, help='execute query via METHOD (http|odbc)')
+                        metavar='METHOD', type=str, help='execute query via METHOD (http|odbc|local)')
 
+    parser.add_argument('--page-size', dest='page_size', default=HTTP_PAGE_SIZE,
+                        metavar='N', type=int, help='split http results into pages of N rows (0: no paging)')
 
     args = parser.parse_args()
 
@@ -237,7 +1187,7 @@ def query():
     dp.message('query:  "%s"' % qfile)
 
 
-    driver = get_driver(args.method)
+    driver = get_driver(args.method, page_size=args.page_size, intern=False)
 
     count = 0
 
@@ -259,6 +1209,8 @@ def query():
         raise
 
     print('%d rows' % count)
+    if isinstance(driver, PagedDriver):
+        print('%d pages' % driver.get_npages())
 
 
 def test():
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+'''
+  Deletes the entities of stale files through a fake ODBC driver
+
+  Copyright 2012-2020 Codinuum Software Lab <https://codinuum.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+'''
+
+import os
+import re
+import sys
+import tempfile
+import unittest
+from importlib.util import find_spec
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(SCRIPTS_DIR), 'factutils', 'python'))
+sys.path.insert(0, SCRIPTS_DIR)
+
+DEPS = ['msgpack', 'pyodbc']
+HAS_DEPS = all(find_spec(m) for m in DEPS)
+
+GRAPH_URI = 'http://codinuum.com/fb/test'
+
+PREFIX_PAT = re.compile(r'STRSTARTS\(STR\(\?x\), "(?P<prefix>[^"]+)"\)')
+DELETE_PAT = re.compile(r'VALUES \?x \{ (?P<vals>[^}]*) \} GRAPH <[^>]+> \{ (?P<pat>[^}]*) \}')
+
+FID_A = 'SHA1_aaaa'
+FID_B = 'SHA1_bbbb'
+FID_AB = 'SHA1_aaaabbbb' # FID_A is a prefix of it
+
+
+class FakeDriver(object):
+    # keeps the triples in a list and understands just the queries that
+    # delete_file_ids issues
+    def __init__(self, triples):
+        self.triples = list(triples)
+        self.queries = []
+
+    def query(self, q, row_type='dict'):
+        self.queries.append(q)
+        self.assertNoContains(q)
+        prefixes = PREFIX_PAT.findall(q)
+        subjs = sorted(set(s for (s, p, o) in self.triples))
+        for s in subjs:
+            if any(s.startswith(x) for x in prefixes):
+                yield ['x'], (s,)
+
+    def execute(self, q):
+        self.queries.append(q)
+        self.assertNoContains(q)
+        m = DELETE_PAT.search(q)
+        iris = set(v.strip('<>') for v in m.group('vals').split())
+        pos = 0 if m.group('pat') == '?x ?p ?o' else 2
+        self.triples = [t for t in self.triples if t[pos] not in iris]
+
+    def assertNoContains(self, q):
+        if 'CONTAINS' in q:
+            raise AssertionError('full scan: %s' % q)
+
+
+@unittest.skipUnless(HAS_DEPS, 'requires %s' % ', '.join(DEPS))
+class DeleteFileIdsTest(unittest.TestCase):
+
+    def setUp(self):
+        from factutils.const import ENTITY_NS, SEP
+        self.ns = ENTITY_NS
+        self.sep = SEP
+
+    def ent(self, enc, fid, r=None):
+        compos = [enc, fid] + ([r] if r else [])
+        return self.ns + self.sep.join(compos)
+
+    def run_delete(self, triples, fids, batch_size=2):
+        import virtuoso
+        loader = virtuoso.Loader(dbdir=tempfile.gettempdir())
+        driver = FakeDriver(triples)
+        loader.get_driver = lambda reuse=True: driver
+        rc = loader.delete_file_ids(GRAPH_URI, fids, self.ns, self.sep, batch_size=batch_size)
+        return (rc, driver)
+
+    def test_delete(self):
+        a0 = self.ent('FD', FID_A)
+        a1 = self.ent('FDO', FID_A, '10_20')
+        a2 = self.ent('FDLC', FID_A, '1L2_3L4')
+        b1 = self.ent('FDO', FID_B, '0_5')
+        ab1 = self.ent('FDO', FID_AB, '0_5')
+        t = 'http://example.org/type'
+        triples = [
+            (a0, 'p:type', t),
+            (a1, 'p:inFile', a0),
+            (a2, 'p:parent', a1),
+            (b1, 'p:mayCall', a2), # from a live file to a stale one
+            (b1, 'p:type', t),
+            (ab1, 'p:type', t),
+            (ab1, 'p:parent', b1),
+        ]
+        (rc, driver) = self.run_delete(triples, [FID_A])
+        self.assertEqual(rc, 0)
+        self.assertEqual(driver.triples, [(b1, 'p:type', t), (ab1, 'p:type', t), (ab1, 'p:parent', b1)])
+
+    def test_batches(self):
+        import virtuoso
+        fids = ['SHA1_%04d' % i for i in range(5)]
+        triples = []
+        for fid in fids:
+            for i in range(virtuoso.DELETE_IRI_BATCH_SIZE + 1):
+                triples.append((self.ent('FDO', fid, '%d_%d' % (i, i + 1)), 'p:type', 't'))
+        live = [t for t in triples if fids[-1] in t[0]]
+        (rc, driver) = self.run_delete(triples, fids[:-1])
+        self.assertEqual(rc, 0)
+        self.assertEqual(driver.triples, live)
+        nlookups = len([q for q in driver.queries if 'SELECT' in q])
+        self.assertEqual(nlookups, 2)
+
+    def test_failure(self):
+        import virtuoso
+        triples = [(self.ent('FDO', FID_A, '0_1'), 'p:type', 't')]
+        loader = virtuoso.Loader(dbdir=tempfile.gettempdir())
+        driver = FakeDriver(triples)
+        def fail(q):
+            raise RuntimeError('connection lost')
+        driver.execute = fail
+        loader.get_driver = lambda reuse=True: driver
+        self.assertEqual(loader.delete_file_ids(GRAPH_URI, [FID_A], self.ns, self.sep), -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
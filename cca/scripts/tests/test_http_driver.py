@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+'''
+  Runs VirtuosoHTTPDriver against a stand-in SPARQL endpoint
+
+  Copyright 2012-2020 Codinuum Software Lab <https://codinuum.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+'''
+
+import os
+import sys
+import gzip
+import json
+import threading
+import unittest
+from importlib.util import find_spec
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(SCRIPTS_DIR), 'factutils', 'python'))
+sys.path.insert(0, SCRIPTS_DIR)
+
+DEPS = ['msgpack', 'pyodbc']
+HAS_DEPS = all(find_spec(m) for m in DEPS)
+
+XSD_INTEGER = 'http://www.w3.org/2001/XMLSchema#integer'
+
+NROWS = 500
+CHUNK_SIZE = 97
+GATE_TIMEOUT = 5 # sec
+
+
+def mkrows(n=NROWS):
+    return [{'x': 'http://example.org/e%d' % i, 'n': i, 's': 'tab\there é%d' % i}
+            for i in range(n)]
+
+
+def to_json(rows):
+    bindings = [{'x': {'type': 'uri', 'value': r['x']},
+                 'n': {'type': 'typed-literal', 'datatype': XSD_INTEGER, 'value': str(r['n'])},
+                 's': {'type': 'literal', 'value': r['s']}} for r in rows]
+    d = {'head': {'link': [], 'vars': ['x', 'n', 's']},
+         'results': {'distinct': False, 'ordered': True, 'bindings': bindings}}
+    return json.dumps(d, indent=1, ensure_ascii=False)
+
+
+def to_tsv(rows):
+    lines = ['?x\t?n\t?s']
+    for r in rows:
+        lines.append('<%s>\t%d\t"%s"' % (r['x'], r['n'], r['s'].replace('\t', '\\t')))
+    return '\n'.join(lines) + '\n'
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.nconns += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        srv = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        params = parse_qs(body.decode('utf-8'))
+        srv.queries.append(params['query'][0])
+
+        if self.headers['Accept'] == 'text/tab-separated-values':
+            data = to_tsv(srv.rows).encode('utf-8')
+        else:
+            data = to_json(srv.rows).encode('utf-8')
+
+        mode = srv.mode
+        use_gzip = srv.gzip and 'gzip' in (self.headers['Accept-Encoding'] or '')
+        if use_gzip:
+            data = gzip.compress(data)
+
+        self.send_response(200)
+        self.send_header('Content-Type', self.headers['Accept'])
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+
+        if mode == 'chunked':
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(data), CHUNK_SIZE):
+                self.write_chunk(data[i:i+CHUNK_SIZE])
+                if i == srv.gate_at:
+                    srv.streamed = srv.gate.wait(GATE_TIMEOUT)
+            self.write_chunk(b'')
+
+        elif mode == 'cut': # the server dies halfway through the body
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data[:len(data) // 2])
+            self.close_connection = True
+
+        elif mode == 'cut_eof': # the body ends at the close of the connection
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.wfile.write(data[:len(data) // 2])
+            self.close_connection = True
+
+        else:
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            if mode == 'drop': # as if the idle connection timed out
+                self.close_connection = True
+
+    def write_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+
+@unittest.skipUnless(HAS_DEPS, 'requires %s' % ', '.join(DEPS))
+class VirtuosoHTTPDriverTest(unittest.TestCase):
+
+    def setUp(self):
+        srv = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        srv.daemon_threads = True
+        srv.lock = threading.Lock()
+        srv.nconns = 0
+        srv.queries = []
+        srv.rows = mkrows()
+        srv.mode = 'plain'
+        srv.gzip = False
+        srv.gate = threading.Event()
+        srv.gate_at = -1
+        srv.streamed = None
+        self.server = srv
+        self.thread = threading.Thread(target=srv.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.drivers = []
+
+    def tearDown(self):
+        for drv in self.drivers:
+            drv.close()
+        self.server.gate.set()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def mkdriver(self, format=None):
+        import sparql
+        endpoint = 'http://127.0.0.1:%d/sparql' % self.server.server_address[1]
+        drv = sparql.VirtuosoHTTPDriver(endpoint=endpoint, format=format or sparql.FORMAT_JSON)
+        self.drivers.append(drv)
+        return drv
+
+    def query(self, drv, q='SELECT ?x ?n ?s WHERE { ?x ?p ?o }'):
+        rows = []
+        for (qvs, row) in drv.query(q):
+            self.assertEqual(qvs, ['x', 'n', 's'])
+            rows.append(row)
+        return rows
+
+    def test_json(self):
+        drv = self.mkdriver()
+        self.assertEqual(self.query(drv), self.server.rows)
+
+    def test_tsv(self):
+        import sparql
+        drv = self.mkdriver(sparql.FORMAT_TSV)
+        self.assertEqual(self.query(drv), self.server.rows)
+
+    def test_keep_alive(self):
+        import sparql
+        for fmt in (sparql.FORMAT_JSON, sparql.FORMAT_TSV):
+            drv = self.mkdriver(fmt)
+            for _ in range(3):
+                self.assertEqual(len(self.query(drv)), NROWS)
+        self.assertEqual(self.server.nconns, 2)
+        self.assertEqual(len(self.server.queries), 6)
+
+    def test_gzip(self):
+        import sparql
+        self.server.gzip = True
+        for fmt in (sparql.FORMAT_JSON, sparql.FORMAT_TSV):
+            drv = self.mkdriver(fmt)
+            self.assertEqual(self.query(drv), self.server.rows)
+            self.assertEqual(self.query(drv), self.server.rows)
+        self.assertEqual(self.server.nconns, 2)
+
+    def test_chunked_small_pieces(self):
+        import sparql
+        self.server.mode = 'chunked'
+        for use_gzip in (False, True):
+            self.server.gzip = use_gzip
+            for fmt in (sparql.FORMAT_JSON, sparql.FORMAT_TSV):
+                drv = self.mkdriver(fmt)
+                self.assertEqual(self.query(drv), self.server.rows)
+
+    def test_incremental(self):
+        import sparql
+        self.server.mode = 'chunked'
+        # the server holds back the rest of the body until the client has
+        # seen the first row
+        self.server.gate_at = CHUNK_SIZE * 10
+        for fmt in (sparql.FORMAT_JSON, sparql.FORMAT_TSV):
+            self.server.gate.clear()
+            self.server.streamed = None
+            drv = self.mkdriver(fmt)
+            it = iter(drv.query('SELECT ?x ?n ?s WHERE { ?x ?p ?o }'))
+            (_, first) = next(it)
+            self.server.gate.set()
+            rows = [first] + [row for (_, row) in it]
+            self.assertTrue(self.server.streamed, fmt)
+            self.assertEqual(rows, self.server.rows)
+
+    def test_stale_connection(self):
+        self.server.mode = 'drop'
+        drv = self.mkdriver()
+        self.assertEqual(self.query(drv), self.server.rows)
+        self.server.mode = 'plain'
+        self.assertEqual(self.query(drv), self.server.rows)
+        self.assertEqual(self.server.nconns, 2)
+
+    def test_cut_off(self):
+        import sparql
+        for (mode, use_gzip) in (('cut', False), ('cut', True), ('cut_eof', True)):
+            for fmt in (sparql.FORMAT_JSON, sparql.FORMAT_TSV):
+                self.server.mode = mode
+                self.server.gzip = use_gzip
+                drv = self.mkdriver(fmt)
+                with self.assertRaises(Exception, msg=(mode, use_gzip, fmt)):
+                    self.query(drv)
+                self.server.mode = 'plain'
+                self.assertEqual(self.query(drv), self.server.rows)
+
+    def test_cut_off_json(self):
+        self.server.mode = 'cut_eof'
+        drv = self.mkdriver()
+        with self.assertRaises(ValueError):
+            self.query(drv)
+
+    def test_iter_json_results(self):
+        import sparql
+        text = to_json(self.server.rows[:20])
+        for n in (1, 2, 7, 64):
+            chunks = [text[i:i+n] for i in range(0, len(text), n)]
+            res = list(sparql.iter_json_results(chunks))
+            self.assertEqual([b['x']['value'] for (_, b) in res],
+                             [r['x'] for r in self.server.rows[:20]])
+            self.assertEqual(res[0][0], ['x', 'n', 's'])
+
+    def test_iter_tsv_results(self):
+        import sparql
+        text = to_tsv(self.server.rows[:20])
+        for n in (1, 2, 7, 64):
+            chunks = [text[i:i+n] for i in range(0, len(text), n)]
+            res = list(sparql.iter_tsv_results(chunks))
+            self.assertEqual(len(res), 20)
+            self.assertEqual(res[3], (['x', 'n', 's'], ['<http://example.org/e3>', '3', '"tab\\there é3"']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+'''
+  Runs metrics queries on the embedded triple store
+
+  Copyright 2012-2020 Codinuum Software Lab <https://codinuum.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from importlib.util import find_spec
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(SCRIPTS_DIR), 'factutils', 'python'))
+sys.path.insert(0, SCRIPTS_DIR)
+
+DEPS = ['msgpack', 'pyodbc', 'rdflib']
+HAS_DEPS = all(find_spec(m) for m in DEPS)
+
+ONT_DIR = os.path.join(os.path.dirname(SCRIPTS_DIR), 'ontologies')
+ONTS = ['2013/05/fortran-entity.rdf', '2012/10/source-code-entity.rdf', '2012/10/versioning.rdf']
+
+GRAPH_URI = 'http://codinuum.com/fb/test'
+
+E = 'http://example.org/ent/'
+VER = 'http://example.org/ver/'
+V = VER + 'v1'
+
+# a main program P in a.f90 that contains subroutine S, which calls
+# subroutine S2 in b.f90. S has loop L1 with L2 nested in it, and P has
+# loop L3. the queries read f:MainProgram, f:inMainProgram, f:IfStmt,
+# f:EntityDecl, f:Real etc. through inference
+FACTS = [
+    ('F',  [('a', 'src:File'), ('src:location', '"a.f90"'), ('ver:version', 'v:v1')]),
+    ('G',  [('a', 'src:File'), ('src:location', '"b.f90"'), ('ver:version', 'v:v1')]),
+
+    ('P',  [('a', 'f:MainProgram'), ('src:inFile', 'e:F'), ('ver:version', 'v:v1')]),
+    ('S',  [('a', 'f:Subprogram'), ('f:name', '"sub1"'), ('src:inFile', 'e:F'),
+            ('f:inMainProgram', 'e:P')]),
+    ('S2', [('a', 'f:Subprogram'), ('f:name', '"sub2"'), ('src:inFile', 'e:G')]),
+
+    ('L1', [('a', 'f:DoConstruct'), ('src:treeDigest', '"d1"'), ('f:variableName', '"i"'),
+            ('f:inProgramUnitOrSubprogram', 'e:S'), ('f:inMainProgram', 'e:P'),
+            ('f:inSubprogram', 'e:S')]),
+    ('L2', [('a', 'f:DoConstruct'), ('src:treeDigest', '"d2"'), ('f:variableName', '"j"'),
+            ('f:inProgramUnitOrSubprogram', 'e:S'), ('f:inMainProgram', 'e:P'),
+            ('f:inSubprogram', 'e:S'), ('f:inDoConstruct', 'e:L1')]),
+    ('L3', [('a', 'f:DoConstruct'), ('src:treeDigest', '"d3"'),
+            ('f:inProgramUnitOrSubprogram', 'e:P'), ('f:inMainProgram', 'e:P')]),
+
+    ('IF1', [('a', 'f:IfStmt'), ('f:inDoConstruct', 'e:L2'), ('f:inDoConstruct', 'e:L1')]),
+    ('AS1', [('a', 'f:AssignmentStmt'), ('f:inDoConstruct', 'e:L2'), ('f:inDoConstruct', 'e:L1'),
+             ('src:children', 'e:AS1c')]),
+    ('AS1c', [('rdf:first', 'e:AA1')]),
+    ('C1', [('a', 'f:CallStmt'), ('f:name', '"sub2"'), ('f:mayCall', 'e:S2'),
+            ('f:inDoConstruct', 'e:L1'), ('f:inSubprogram', 'e:S')]),
+
+    ('OP1', [('a', 'f:IntrinsicOperator'), ('src:treeDigest', '"h1"'),
+             ('f:inDoConstruct', 'e:L2'), ('f:inDoConstruct', 'e:L1')]),
+    ('OP2', [('a', 'f:IntrinsicOperator'), ('src:treeDigest', '"h1"'),
+             ('f:inDoConstruct', 'e:L2'), ('f:inDoConstruct', 'e:L1')]),
+    ('OP3', [('a', 'f:IntrinsicOperator'), ('src:treeDigest', '"h2"'), ('f:inDoConstruct', 'e:L1')]),
+
+    # a(i,j) = ... with a real array a
+    ('AA1', [('a', 'f:ArrayAccess'), ('f:name', '"a"'), ('f:arrayRefSig0', '"a(i,j)"'),
+             ('f:inDoConstruct', 'e:L2'), ('f:inDoConstruct', 'e:L1')]),
+    ('PN1', [('a', 'f:PartName'), ('f:name', '"a"'), ('src:parent', 'e:AA1'),
+             ('f:declarator', 'e:ED1')]),
+    ('ED1', [('a', 'f:EntityDecl'), ('f:name', '"a"'), ('f:rank', 2),
+             ('f:declarationTypeSpec', 'e:TS1')]),
+    ('TS1', [('a', 'f:Real')]),
+
+    # a character array c, which the aref queries leave out
+    ('AA2', [('a', 'f:ArrayAccess'), ('f:name', '"c"'), ('f:arrayRefSig0', '"c(i)"'),
+             ('f:inDoConstruct', 'e:L1')]),
+    ('PN2', [('a', 'f:PartName'), ('f:name', '"c"'), ('src:parent', 'e:AA2'),
+             ('f:declarator', 'e:ED2')]),
+    ('ED2', [('a', 'f:EntityDecl'), ('f:name', '"c"'), ('f:rank', 1),
+             ('f:declarationTypeSpec', 'e:TS2')]),
+    ('TS2', [('a', 'f:Character')]),
+]
+
+
+def to_nt(facts):
+    import ns
+    tbl = {'e': E, 'v': VER, 'f': ns.F_NS, 'src': ns.SRC_NS, 'ver': ns.VER_NS, 'rdf': ns.RDF_NS}
+    def term(t):
+        if isinstance(t, int):
+            return '"%d"^^<%sinteger>' % (t, ns.XSD_NS)
+        if t.startswith('"'):
+            return t
+        if t == 'a':
+            t = 'rdf:type'
+        (p, n) = t.split(':', 1)
+        return '<%s%s>' % (tbl[p], n)
+    lines = []
+    for (s, pos) in facts:
+        for (p, o) in pos:
+            lines.append('%s %s %s .\n' % (term('e:'+s), term(p), term(o)))
+    return ''.join(lines)
+
+
+@unittest.skipUnless(HAS_DEPS, 'requires %s' % ', '.join(DEPS))
+class LocalStoreQueryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        import localstore
+        import sparql
+        cls.tmpdir = tempfile.mkdtemp()
+        fact_dir = os.path.join(cls.tmpdir, 'facts')
+        ont_dir = os.path.join(cls.tmpdir, 'ont')
+        os.makedirs(fact_dir)
+        os.makedirs(ont_dir)
+        with open(os.path.join(fact_dir, 'a.nt'), 'w') as f:
+            f.write(to_nt(FACTS))
+        for p in ONTS:
+            shutil.copy(os.path.join(ONT_DIR, p), ont_dir)
+        store = localstore.LocalStore()
+        store.load_ont(ont_dir)
+        store.load_facts(GRAPH_URI, fact_dir)
+        cls.driver = sparql.LocalDriver(store)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def query(self, q, params={}):
+        d = {'proj': GRAPH_URI}
+        d.update(params)
+        keys = None
+        rows = []
+        for (qvs, row) in self.driver.query(q % d):
+            rows.append(row)
+            keys = qvs
+        return (keys, rows)
+
+    def check(self, q, expected, params={}):
+        (qvs, rows) = self.query(q, params)
+        def key(r):
+            return sorted((k, str(v)) for (k, v) in r.items())
+        self.assertEqual(sorted(rows, key=key), sorted(expected, key=key))
+        return qvs
+
+    def test_loop_loop(self):
+        from metrics_queries_fortran import QUERY_TBL
+        base = {'ver': V, 'loc': 'a.f90'}
+        in_s = dict(base, sp=E+'S', sub='sub1')
+        self.check(QUERY_TBL['loop_loop'], [
+            dict(in_s, loop=E+'L1', vname='i', loop_d='d1',
+                 child_loop=E+'L2', child_vname='j', child_loop_d='d2'),
+            dict(in_s, loop=E+'L2', vname='j', loop_d='d2'),
+            dict(base, loop=E+'L3', loop_d='d3'),
+        ])
+
+    def test_in_loop(self):
+        from metrics_queries_fortran import QUERY_TBL
+        base = {'ver': V, 'loc': 'a.f90'}
+        in_s = dict(base, sp=E+'S', sub='sub1')
+        self.check(QUERY_TBL['in_loop'], [
+            dict(in_s, loop=E+'L1', vname='i', loop_d='d1', nop=2, nbr=1, nes=3, nc=1),
+            dict(in_s, loop=E+'L2', vname='j', loop_d='d2', nop=1, nbr=1, nes=2),
+            dict(base, loop=E+'L3', loop_d='d3'),
+        ])
+
+    def test_arrays(self):
+        import ns
+        from metrics_queries_fortran import QUERY_TBL
+        base = {'ver': V, 'loc': 'a.f90', 'sub': 'sub1', 'aname': 'a', 'rank': 2,
+                'edecl': E+'ED1', 'tyc': ns.F_NS+'Real'}
+        self.check(QUERY_TBL['arrays'], [
+            dict(base, loop=E+'L1', vname='i', loop_d='d1'),
+            dict(base, loop=E+'L2', vname='j', loop_d='d2'),
+            dict(base, loop=E+'L1', vname='i', loop_d='d1', aname='c', rank=1,
+                 edecl=E+'ED2', tyc=ns.F_NS+'Character'),
+        ])
+
+    def test_calls(self):
+        from metrics_queries_fortran import QUERY_TBL
+        self.check(QUERY_TBL['sp_sp'], [
+            {'ver': V, 'loc': 'a.f90', 'sp': E+'S', 'callee': E+'S2', 'callee_loc': 'b.f90'},
+        ])
+        self.check(QUERY_TBL['loop_sp'], [
+            {'ver': V, 'loc': 'a.f90', 'loop': E+'L1', 'vname': 'i', 'loop_d': 'd1',
+             'callee': E+'S2', 'callee_loc': 'b.f90'},
+        ])
+
+    def test_aref(self):
+        from metrics_queries_fortran import QUERY_TBL
+        base = {'ver': V, 'loc': 'a.f90', 'sp': E+'S', 'sub': 'sub1', 'sig': ',a(i,j)'}
+        qvs = self.check(QUERY_TBL['aref0_in_loop']['aa'], [
+            dict(base, loop=E+'L1', vname='i', loop_d='d1'),
+            dict(base, loop=E+'L2', vname='j', loop_d='d2'),
+        ], params={'level': 0})
+        self.assertEqual(qvs, ['ver', 'loc', 'sp', 'sub', 'loop', 'vname', 'loop_d', 'sig'])
+
+    def test_no_inference(self):
+        # without input:inference, f:MainProgram is not an f:ProgramUnit, so
+        # the grouped subquery matches nothing and neither does the query
+        from metrics_queries_fortran import QUERY_TBL
+        q = QUERY_TBL['loop_loop'].replace('DEFINE input:inference "ont.cpi"\n', '')
+        self.check(q, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
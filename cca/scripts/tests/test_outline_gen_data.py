@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+'''
+  Runs Outline.gen_data end to end on canned query results
+
+  Copyright 2012-2020 Codinuum Software Lab <https://codinuum.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+'''
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from importlib.util import find_spec
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(SCRIPTS_DIR), 'factutils', 'python'))
+sys.path.insert(0, SCRIPTS_DIR)
+
+DEPS = ['msgpack', 'pyodbc', 'pygit2', 'gensim', 'RDF']
+HAS_DEPS = all(find_spec(m) for m in DEPS)
+
+PROJ_ID = 'gen_data_test'
+LOC = 'src/a.f90'
+DIGEST = '0123456789abcdef0123456789abcdef01234567'
+
+SOURCE = '''subroutine foo(a, n)
+  integer n, i
+  real a(n)
+  do i = 1, n
+    a(i) = a(i) * 2.0
+  end do
+end subroutine foo
+'''
+
+
+class FakeDriver(object):
+    def __init__(self, tbl):
+        self._tbl = tbl # query -> row list
+
+    def query(self, q, abbrev=False):
+        for row in self._tbl.get(q, []):
+            yield {}, dict(row)
+
+    def execute(self, q):
+        pass
+
+    def fetchone(self, q, abbrev=False):
+        return None
+
+
+class FakeMetrics(object):
+    def find_ftbl(self, key):
+        raise KeyError(key)
+
+    def get_max_loop_level(self, ent):
+        return 0
+
+
+@unittest.skipUnless(HAS_DEPS, 'requires %s' % ', '.join(DEPS))
+class GenDataTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        src = os.path.join(self._dir, 'projects', PROJ_ID, LOC)
+        os.makedirs(os.path.dirname(src))
+        with open(src, 'w') as f:
+            f.write(SOURCE)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def get_ent(self, sl, sc, el, ec):
+        from factutils.const import ENTITY_NS
+        return '%sFDLC-SHA1_%s-%d_%d_%d_%d' % (ENTITY_NS, DIGEST, sl, sc, el, ec)
+
+    def test_gen_data(self):
+        import msgpack
+        import sparql
+        from outline_for_survey_fortran import Outline
+        from outlining_queries_fortran import QUERY_TBL
+
+        ol = Outline(PROJ_ID, method='http', proj_dir=os.path.join(self._dir, 'projects'),
+                     ver='v0', simple_layout=True)
+        ver = ol._conf.versionURIs[0]
+
+        row = {
+            'ver'    : ver,
+            'loc'    : LOC,
+            'sp'     : self.get_ent(1, 0, 7, 22),
+            'sp_cat' : 'subroutine-external-subprogram',
+            'sub'    : 'foo',
+            'constr' : self.get_ent(4, 2, 6, 8),
+            'cat'    : 'do-construct',
+        }
+        q = QUERY_TBL['constr_constr'] % {'proj':ol._graph_uri}
+        ol._sparql = FakeDriver({q:[row]})
+        ol._metrics = FakeMetrics()
+
+        outdir = os.path.join(self._dir, 'out')
+        try:
+            ol.gen_data('fortran', outdir=outdir, extract_metrics=False, all_roots=True)
+        finally:
+            sparql.clear_uri_table()
+
+        lver_dir = os.path.join(outdir, 'outline', PROJ_ID, 'v', 'v0')
+
+        with open(os.path.join(lver_dir, 'path_list.json')) as f:
+            self.assertEqual(json.load(f), [LOC])
+
+        with open(os.path.join(lver_dir, 'fid_list.json')) as f:
+            self.assertEqual(json.load(f), [DIGEST])
+
+        with open(os.path.join(lver_dir, LOC, DIGEST+'.msg'), 'rb') as f:
+            d = msgpack.unpack(f)
+
+        codes = []
+        def collect(x):
+            if 'code' in x:
+                codes.append(x['code'])
+            for c in x.get('children', []):
+                collect(c)
+        collect(d)
+
+        self.assertIn('subroutine foo(a, n)', codes)
+        self.assertIn('do i = 1, n', codes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+'''
+  Checks that PagedDriver returns the same rows as an unpaged query
+
+  Copyright 2012-2020 Codinuum Software Lab <https://codinuum.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+'''
+
+import os
+import re
+import sys
+import random
+import unittest
+from importlib.util import find_spec
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(SCRIPTS_DIR), 'factutils', 'python'))
+sys.path.insert(0, SCRIPTS_DIR)
+
+DEPS = ['msgpack', 'pyodbc']
+HAS_DEPS = all(find_spec(m) for m in DEPS)
+
+LIMIT_PAT = re.compile(r'LIMIT (?P<limit>\d+) OFFSET (?P<offset>\d+)\s*\Z')
+OUTER_ORDER_PAT = re.compile(r'\}\s*ORDER BY (?P<conds>[^{}]*?)\s*(?:LIMIT|\Z)')
+
+
+class FakeDriver(object):
+    # rows come in no particular order unless the outermost query is ordered,
+    # as SPARQL does not keep the order of subqueries
+    def __init__(self, rows, seed=0):
+        self._rows = rows
+        self._random = random.Random(seed)
+        self.queries = []
+
+    def query(self, q, abbrev=False, row_type='dict'):
+        self.queries.append(q)
+        rows = list(self._rows)
+        self._random.shuffle(rows)
+        m = OUTER_ORDER_PAT.search(q)
+        if m:
+            for c in reversed(m.group('conds').split()):
+                mc = re.match(r'(DESC|ASC)?\(?\?(\w+)\)?', c)
+                rows.sort(key=lambda r: r[mc.group(2)], reverse=mc.group(1) == 'DESC')
+        m = LIMIT_PAT.search(q)
+        if m:
+            offset = int(m.group('offset'))
+            rows = rows[offset:offset+int(m.group('limit'))]
+        for row in rows:
+            yield {}, dict(row)
+
+
+@unittest.skipUnless(HAS_DEPS, 'requires %s' % ', '.join(DEPS))
+class PagedDriverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = [{'x':'x%02d' % (i % 7), 'y':'y%02d' % i} for i in range(50)]
+
+    def run_query(self, q, page_size):
+        import sparql
+        fake = FakeDriver(self.rows)
+        driver = sparql.PagedDriver(fake, page_size=page_size)
+        res = [r for (_, r) in driver.query(q)]
+        return (res, fake, driver)
+
+    def key(self, r):
+        return (r['x'], r['y'])
+
+    def test_same_rows(self):
+        q = 'SELECT ?x ?y WHERE { ?x <http://e/p> ?y }'
+        (res, fake, driver) = self.run_query(q, 8)
+        self.assertEqual(driver.get_npages(), 7)
+        self.assertEqual(len(res), len(self.rows))
+        self.assertEqual(sorted(res, key=self.key), sorted(self.rows, key=self.key))
+        self.assertEqual(res, sorted(self.rows, key=self.key))
+
+    def test_own_order(self):
+        q = 'SELECT ?x ?y WHERE { ?x <http://e/p> ?y } ORDER BY DESC(?x)'
+        (res, fake, driver) = self.run_query(q, 6)
+        self.assertEqual(sorted(res, key=self.key), sorted(self.rows, key=self.key))
+        xs = [r['x'] for r in res]
+        self.assertEqual(xs, sorted(xs, reverse=True))
+        for pq in fake.queries:
+            self.assertTrue(OUTER_ORDER_PAT.search(pq), pq)
+
+    def test_not_paged(self):
+        # ordered by a variable that the outer query cannot see
+        q = 'SELECT ?x WHERE { ?x <http://e/p> ?y } ORDER BY ?y'
+        (res, fake, driver) = self.run_query(q, 8)
+        self.assertEqual(fake.queries, [q])
+        self.assertEqual(driver.get_npages(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
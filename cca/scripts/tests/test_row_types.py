@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+'''
+  Checks that the driver wrappers pass tuple rows through
+
+  Copyright 2012-2020 Codinuum Software Lab <https://codinuum.com>
+
+  Licensed under the Apache License, Version 2.0 (the "License");
+  you may not use this file except in compliance with the License.
+  You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+  Unless required by applicable law or agreed to in writing, software
+  distributed under the License is distributed on an "AS IS" BASIS,
+  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+  See the License for the specific language governing permissions and
+  limitations under the License.
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from importlib.util import find_spec
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(SCRIPTS_DIR), 'factutils', 'python'))
+sys.path.insert(0, SCRIPTS_DIR)
+
+DEPS = ['msgpack', 'pyodbc']
+HAS_DEPS = all(find_spec(m) for m in DEPS)
+
+QVS = ['x', 'y', 'n']
+
+ROWS = [('http://example.org/a', None, 1),
+        ('http://example.org/b', 'b', 2),
+        ('http://example.org/c', 'c', None)]
+
+
+class FakeODBCDriver(object):
+    # rows as VirtuosoODBCDriver makes them: unbound variables are None
+    def __init__(self):
+        self.row_types = []
+
+    def query(self, q, abbrev=False, row_type='dict'):
+        self.row_types.append(row_type)
+        for row in ROWS:
+            if row_type == 'tuple':
+                yield QVS, tuple(row)
+            else:
+                yield QVS, dict(zip(QVS, row))
+
+
+@unittest.skipUnless(HAS_DEPS, 'requires %s' % ', '.join(DEPS))
+class RowTypeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def query(self, driver, row_type):
+        return [row for (qvs, row) in driver.query('SELECT ?x ?y ?n WHERE {}', row_type=row_type)]
+
+    def test_interned(self):
+        import sparql
+        fake = FakeODBCDriver()
+        driver = sparql.InternedDriver(fake)
+        self.assertEqual(self.query(driver, sparql.ROW_TUPLE), ROWS)
+        self.assertEqual(self.query(driver, sparql.ROW_DICT), [dict(zip(QVS, r)) for r in ROWS])
+        self.assertEqual(fake.row_types, [sparql.ROW_TUPLE, sparql.ROW_DICT])
+
+    def test_profiled(self):
+        import sparql
+        profiler = sparql.QueryProfiler(slow_thresh=None)
+        driver = sparql.ProfiledDriver(FakeODBCDriver(), profiler)
+        self.assertEqual(self.query(driver, sparql.ROW_TUPLE), ROWS)
+        self.assertEqual(self.query(driver, sparql.ROW_DICT), [dict(zip(QVS, r)) for r in ROWS])
+        (rec_t, rec_d) = profiler.get_records()
+        self.assertEqual(rec_t['rows'], 3)
+        self.assertEqual((rec_t['rows'], rec_t['bytes']), (rec_d['rows'], rec_d['bytes']))
+
+    def test_cached(self):
+        import sparql
+        cache = sparql.ResultCache(self.tmpdir, 'fp')
+        for (first, second) in ((sparql.ROW_TUPLE, sparql.ROW_DICT), (sparql.ROW_DICT, sparql.ROW_TUPLE)):
+            fake = FakeODBCDriver()
+            driver = sparql.CachedDriver(fake, cache, graph_uri='http://example.org/g/'+first)
+            expected = {sparql.ROW_TUPLE: ROWS, sparql.ROW_DICT: [dict(zip(QVS, r)) for r in ROWS]}
+            self.assertEqual(self.query(driver, first), expected[first])  # miss
+            self.assertEqual(self.query(driver, second), expected[second]) # hit
+            self.assertEqual(self.query(driver, first), expected[first])   # hit
+            self.assertEqual(fake.row_types, [first])
+
+    def test_to_row_type(self):
+        import sparql
+        row = {'x': 'http://example.org/a', 'n': 1} # y is unbound
+        self.assertEqual(sparql.to_row_type(QVS, row, sparql.ROW_TUPLE), ('http://example.org/a', None, 1))
+        self.assertIs(sparql.to_row_type(QVS, row, sparql.ROW_DICT), row)
+        with self.assertRaises(ValueError):
+            sparql.to_row_type(QVS, row, 'list')
+
+
+if __name__ == '__main__':
+    unittest.main()
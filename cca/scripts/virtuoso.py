@@ -19,11 +19,14 @@
 '''
 
 import os
+import gzip
+import zlib
 import subprocess
 import time
 import threading
 import re
 import sys
+from collections import namedtuple
 
 import pathsetup
 from pathsetup import LOG_DIR
@@ -39,6 +42,7 @@ from siteconf import (VIRTUOSO_HOST,
                       VIRTUOSO_DIR)
 import ns
 from run_workers import spawn, dump_log
+from factutils.fileid import FidEnc, Enc
 
 
 DEFAULT_MAX_FILES = 500
@@ -47,6 +51,46 @@ RESTART_INTERVAL = 100
 
 DEFAULT_PORT = 1111
 
+DEFAULT_POOL_SIZE = 8
+
+POOL_CHECK_INTERVAL = 60 # sec
+
+DEFAULT_FETCH_SIZE = 1000
+
+DEFAULT_NLOADERS = max(1, int((os.cpu_count() or 1) / 2.5)) # recommended for rdf_loader_run
+
+READY_TIMEOUT = 300 # sec
+READY_POLL_INTERVAL = 0.5 # sec
+
+PROGRESS_INTERVAL = 10 # sec
+
+ENGINE_ODBC = 'odbc'
+ENGINE_ISQL = 'isql'
+
+DELETE_BATCH_SIZE = 64 # file ids per lookup query
+DELETE_IRI_BATCH_SIZE = 512 # entities per delete query
+
+ENTITY_ENCS = [FidEnc.FD, FidEnc.PVF,
+               Enc.FDO, Enc.FDL, Enc.FDLC, Enc.FDLCO,
+               Enc.PVFO, Enc.PVFL, Enc.PVFLC, Enc.PVFLCO]
+
+CKPT_BULK     = 'bulk'     # checkpoint once at the end (for throwaway FBs)
+CKPT_ADAPTIVE = 'adaptive' # checkpoint when the server is under pressure
+
+CKPT_BYTES = 2 * 1024 * 1024 * 1024 # bytes of files loaded since the last checkpoint
+CKPT_LOG_SIZE = 1024 * 1024 * 1024 # bytes of transaction log
+CKPT_DIRTY_RATIO = 0.5 # of the buffers
+CKPT_MIN_INTERVAL = 60 # sec
+
+BUFFER_STAT_PAT = re.compile(r'(?P<bufs>[0-9]+) buffers, (?P<used>[0-9]+) used, (?P<dirty>[0-9]+) dirty')
+
+STREAM_POLL_INTERVAL = 2 # sec
+STREAM_QUIET_PERIOD = 5 # sec, files left untouched this long are checked for completeness
+
+ROW_DICT       = 'dict'
+ROW_TUPLE      = 'tuple'
+ROW_NAMEDTUPLE = 'namedtuple'
+
 ###
 
 GRAPH_URI_BASE = ns.FB_NS
@@ -77,22 +121,153 @@ def get_odbc_connect_string(driver=VIRTUOSO_DRIVER,
 ODBC_CONNECT_STRING = get_odbc_connect_string(pwd=VIRTUOSO_PW)
 
 
-class ODBCDriver(dp.base):
-    def __init__(self, connect_string=ODBC_CONNECT_STRING):
+def connect(connect_string=ODBC_CONNECT_STRING):
+    try:
+        import pyodbc
+    except Exception as e:
+        dp.debug(str(e))
+        dp.message('using pypyodbc')
+        import pypyodbc as pyodbc
+        pyodbc.lowercase = False
+
+    db = pyodbc.connect(connect_string, ansi=True, autocommit=True)
+    db.setdecoding(pyodbc.SQL_CHAR, encoding='utf-8')
+    db.setdecoding(pyodbc.SQL_WCHAR, encoding='utf-8')
+    db.setdecoding(pyodbc.SQL_WMETADATA, encoding='utf-32le')
+    db.setencoding(encoding='utf-8')
+
+    return db
+
+
+class ODBCConnectionPool(dp.base):
+    def __init__(self, connect_string=ODBC_CONNECT_STRING,
+                 maxsize=DEFAULT_POOL_SIZE,
+                 check_interval=POOL_CHECK_INTERVAL):
+
+        self._connect_string = connect_string
+        self._maxsize = maxsize
+        self._check_interval = check_interval # sec
+
+        self._idle = []       # (connection * last released) list
+        self._borrowed = set() # connections in use
+        self._nconns = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def get_maxsize(self):
+        return self._maxsize
+
+    def is_alive(self, db):
+        b = True
         try:
-            import pyodbc
+            cur = db.cursor()
+            cur.execute('SELECT 1').fetchone()
+            cur.close()
         except Exception as e:
             self.debug(str(e))
-            self.message('using pypyodbc')
-            import pypyodbc as pyodbc
-            pyodbc.lowercase = False
+            b = False
+        return b
 
-        self._db = pyodbc.connect(connect_string, ansi=True, autocommit=True)
-        self._db.setdecoding(pyodbc.SQL_CHAR, encoding='utf-8')
-        self._db.setdecoding(pyodbc.SQL_WCHAR, encoding='utf-8')
-        self._db.setdecoding(pyodbc.SQL_WMETADATA, encoding='utf-32le')
-        self._db.setencoding(encoding='utf-8')
+    def _discard(self, db):
+        try:
+            db.close()
+        except Exception as e:
+            self.debug(str(e))
 
+    def acquire(self):
+        while True:
+            db = None
+            stale = False
+
+            with self._cond:
+                while not self._closed and not self._idle and self._nconns >= self._maxsize:
+                    self._cond.wait()
+
+                if self._closed:
+                    raise RuntimeError('connection pool is closed')
+
+                if self._idle:
+                    (db, t) = self._idle.pop()
+                    stale = time.time() - t > self._check_interval
+                else:
+                    self._nconns += 1
+
+            if db == None:
+                try:
+                    db = connect(self._connect_string)
+                except:
+                    with self._cond:
+                        self._nconns -= 1
+                        self._cond.notify()
+                    raise
+                return self._lend(db)
+
+            if not stale or self.is_alive(db):
+                return self._lend(db)
+
+            self.warning('discarding dead connection')
+            self._discard(db)
+            with self._cond:
+                self._nconns -= 1
+                self._cond.notify()
+
+    def _lend(self, db):
+        with self._cond:
+            if self._closed: # closed while connecting
+                self._nconns -= 1
+                closed = True
+            else:
+                self._borrowed.add(db)
+                closed = False
+        if closed:
+            self._discard(db)
+            raise RuntimeError('connection pool is closed')
+        return db
+
+    def release(self, db, failed=False):
+        with self._cond:
+            self._borrowed.discard(db)
+            closed = self._closed
+        if closed or (failed and not self.is_alive(db)):
+            if not closed:
+                self.warning('discarding dead connection')
+            self._discard(db)
+            with self._cond:
+                self._nconns -= 1
+                self._cond.notify()
+        else:
+            with self._cond:
+                self._idle.append((db, time.time()))
+                self._cond.notify()
+
+    def close(self):
+        # connections in use are closed when they are released
+        with self._cond:
+            self._closed = True
+            for (db, _) in self._idle:
+                self._discard(db)
+            self._nconns -= len(self._idle)
+            self._idle = []
+            if self._borrowed:
+                self.debug('%d connections in use' % len(self._borrowed))
+            self._cond.notify_all()
+
+
+class ODBCDriver(dp.base):
+    def __init__(self, connect_string=ODBC_CONNECT_STRING, pool=None):
+        self._pool = pool
+        self._db = None
+        if pool == None:
+            self._db = connect(connect_string)
+
+    def acquire(self):
+        if self._pool:
+            return self._pool.acquire()
+        return self._db
+
+    def release(self, db, failed=False):
+        if self._pool:
+            self._pool.release(db, failed=failed)
 
     def conv_row(self, row):
         d = {}
@@ -104,25 +279,81 @@ class ODBCDriver(dp.base):
             idx += 1
         return d
 
-    def query(self, query):
-        cur = self._db.cursor()
-        for row in cur.execute(query):
-            vs = [d[0] for d in row.cursor_description]
-            converted = ODBCDriver.conv_row(self, row)
-            yield vs, converted
-        cur.close()
+    def get_row_maker(self, labels, row_type=ROW_DICT, conv=None):
+        if row_type == ROW_DICT:
+            if conv:
+                return lambda row: dict(zip(labels, map(conv, row)))
+            return lambda row: dict(zip(labels, row))
+
+        elif row_type == ROW_TUPLE:
+            if conv:
+                return lambda row: tuple(map(conv, row))
+            return tuple
+
+        elif row_type == ROW_NAMEDTUPLE:
+            make = namedtuple('Row', labels, rename=True)._make
+            if conv:
+                return lambda row: make(map(conv, row))
+            return make
+
+        else:
+            raise ValueError('unknown row type: %s' % row_type)
+
+    def query_batches(self, query, size=DEFAULT_FETCH_SIZE, row_type=ROW_DICT, conv=None):
+        db = self.acquire()
+        cur = None
+        failed = False
+        try:
+            cur = db.cursor()
+            cur.execute(query)
+            if cur.description:
+                vs = [d[0] for d in cur.description]
+                make = self.get_row_maker(vs, row_type=row_type, conv=conv)
+                while True:
+                    rows = cur.fetchmany(size)
+                    if not rows:
+                        break
+                    yield vs, [make(row) for row in rows]
+        except Exception:
+            failed = True
+            raise
+        finally:
+            if cur:
+                cur.close()
+            self.release(db, failed=failed)
+
+    def query(self, query, size=DEFAULT_FETCH_SIZE, row_type=ROW_DICT, conv=None):
+        for vs, rows in self.query_batches(query, size=size, row_type=row_type, conv=conv):
+            for row in rows:
+                yield vs, row
 
     def execute(self, query):
-        cur = self._db.cursor()
-        cur.execute(query)
-        cur.close()
+        db = self.acquire()
+        failed = False
+        try:
+            cur = db.cursor()
+            cur.execute(query)
+            cur.close()
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.release(db, failed=failed)
 
     def fetchone(self, query):
-        cur = self._db.cursor()
-        row = cur.execute(query).fetchone()
-        if row:
-            row = ODBCDriver.conv_row(self, row)
-        cur.close()
+        db = self.acquire()
+        failed = False
+        try:
+            cur = db.cursor()
+            row = cur.execute(query).fetchone()
+            if row:
+                row = ODBCDriver.conv_row(self, row)
+            cur.close()
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.release(db, failed=failed)
         return row
 
 
@@ -223,12 +454,26 @@ class base(log.Logger):
         return b
 
 
+    def get_connect_string(self):
+        return get_odbc_connect_string(pwd=self._pw, port=self._port)
+
     def get_driver(self, reuse=True):
         if not self._driver or not reuse:
-            connect_string = get_odbc_connect_string(pwd=self._pw, port=self._port)
-            self._driver = ODBCDriver(connect_string=connect_string)
+            self._driver = ODBCDriver(connect_string=self.get_connect_string())
         return self._driver
 
+    def wait_ready(self, timeout=READY_TIMEOUT):
+        t = time.time()
+        while True:
+            try:
+                self.get_driver(reuse=False).fetchone('SELECT 1')
+                return True
+            except Exception as e:
+                if time.time() - t > timeout:
+                    self.warning('server not ready: %s' % e)
+                    return False
+            time.sleep(READY_POLL_INTERVAL)
+
     def exec_cmd_ini(self, _cmd):
         cmd = '%s EXEC="%s"' % (self._isql_cmd_ini, _cmd)
         rc = exec_cmd(cmd)
@@ -294,7 +539,380 @@ class base(log.Logger):
 
 
 
+# in adaptive mode, checkpoints when CKPT_BYTES of fact files have been
+# loaded, the transaction log reaches CKPT_LOG_SIZE or CKPT_DIRTY_RATIO of
+# the buffers are dirty. the loaded volume is measured in bytes from the
+# load list; it was a triple count (CKPT_TRIPLES) until counting RDF_QUAD
+# for progress was dropped
+class CheckpointPolicy(dp.base):
+    def __init__(self, mode=CKPT_ADAPTIVE,
+                 nbytes=CKPT_BYTES,
+                 log_size=CKPT_LOG_SIZE,
+                 dirty_ratio=CKPT_DIRTY_RATIO,
+                 min_interval=CKPT_MIN_INTERVAL):
+        self._mode = mode
+        self._nbytes = nbytes
+        self._log_size = log_size
+        self._dirty_ratio = dirty_ratio
+        self._min_interval = min_interval
+        self._last_bytes = None
+        self._last_time = time.time()
+
+    def get_mode(self):
+        return self._mode
+
+    def get_dirty_ratio(self, driver):
+        ratio = None
+        try:
+            for _, row in driver.query('status(\'\')'):
+                for v in row.values():
+                    m = BUFFER_STAT_PAT.search(str(v))
+                    if m:
+                        ratio = float(m.group('dirty')) / max(1, int(m.group('bufs')))
+        except Exception as e:
+            self.debug(str(e))
+        return ratio
+
+    def get_reason(self, driver, trx_file, nbytes):
+        if self._last_bytes == None or nbytes < self._last_bytes: # a new load list
+            self._last_bytes = nbytes
+
+        if self._mode != CKPT_ADAPTIVE:
+            return None
+
+        if time.time() - self._last_time < self._min_interval:
+            return None
+
+        if nbytes - self._last_bytes >= self._nbytes:
+            return '%d bytes loaded' % (nbytes - self._last_bytes)
+
+        try:
+            sz = os.path.getsize(trx_file)
+            if sz >= self._log_size:
+                return 'transaction log is %d bytes' % sz
+        except OSError:
+            pass
+
+        ratio = self.get_dirty_ratio(driver)
+        if ratio != None and ratio >= self._dirty_ratio:
+            return '%.0f%% of buffers dirty' % (ratio * 100)
+
+        return None
+
+    def done(self, nbytes):
+        self._last_bytes = nbytes
+        self._last_time = time.time()
+
+
 class Loader(base):
+    def __init__(self, dbdir=DB_DIR, port=DEFAULT_PORT, daemonize=False, pw=VIRTUOSO_PW,
+                 checkpoint=CKPT_ADAPTIVE):
+        base.__init__(self, dbdir=dbdir, port=port, daemonize=daemonize, pw=pw)
+        self._trx_file = os.path.join(dbdir, 'virtuoso.trx')
+        self._checkpoint = CheckpointPolicy(mode=checkpoint)
+        self._file_sizes = {} # loaded file -> size
+        self._incomplete = {} # file -> (size * mtime) when found incomplete
+
+    def checkpoint_if_needed(self, driver, nbytes):
+        reason = self._checkpoint.get_reason(driver, self._trx_file, nbytes)
+        if reason:
+            self.message('checkpoint (%s)...' % reason)
+            driver.execute('checkpoint')
+            self._checkpoint.done(nbytes)
+
+    def prepare_load_odbc(self, driver, graph_uri, d, exts, resume=False, dirs=None):
+
+        if resume:
+            driver.execute('update DB.DBA.load_list set ll_state=0 WHERE ll_state=1')
+
+        elif dirs != None:
+            driver.execute('delete from DB.DBA.load_list')
+            for x in dirs:
+                for ext in exts:
+                    driver.execute('ld_dir(\'%s\', \'*%s\', \'%s\')' % (x, ext, graph_uri))
+
+        else:
+            driver.execute('delete from DB.DBA.load_list')
+            for ext in exts:
+                driver.execute('ld_dir_all(\'%s\', \'*%s\', \'%s\')' % (d, ext, graph_uri))
+
+        row = driver.fetchone('SELECT COUNT(*) FROM DB.DBA.load_list WHERE ll_state=0')
+
+        nfiles = row['count']
+
+        return nfiles
+
+    def count_loaded(self, driver, graph_uri):
+        # only the load list is consulted, counting RDF_QUAD would scan the graph
+        nfiles = 0
+        nbytes = 0
+        for _, row in driver.query('SELECT ll_file FROM DB.DBA.load_list WHERE ll_state=2'):
+            path = row['ll_file']
+            sz = self._file_sizes.get(path, None)
+            if sz == None:
+                try:
+                    sz = os.path.getsize(path)
+                except OSError:
+                    sz = 0
+                self._file_sizes[path] = sz
+            nfiles += 1
+            nbytes += sz
+        return (nfiles, nbytes)
+
+    def report_progress(self, driver, graph_uri, nfiles, stop, interval=PROGRESS_INTERVAL):
+        st = time.time()
+        (f0, b0) = self.count_loaded(driver, graph_uri)
+        (tp, fp, bp) = (st, f0, b0)
+        while not stop.wait(interval):
+            try:
+                (f, b) = self.count_loaded(driver, graph_uri)
+            except Exception as e:
+                self.warning(str(e))
+                continue
+            now = time.time()
+            dt = now - tp
+            if nfiles == None:
+                prog = '%d' % (f - f0)
+            else:
+                prog = '%d/%d' % (f - f0, nfiles)
+            self.message('%s files loaded (%.1f files/sec, %.1f KB/sec)' % (prog,
+                                                                            (f - fp) / dt,
+                                                                            (b - bp) / dt / 1024))
+            (tp, fp, bp) = (now, f, b)
+            try:
+                self.checkpoint_if_needed(driver, b)
+            except Exception as e:
+                self.warning(str(e))
+
+    def count_pending(self, driver):
+        row = driver.fetchone('SELECT COUNT(*) FROM DB.DBA.load_list WHERE ll_state=0')
+        return row['count']
+
+    def start_loaders(self, driver, graph_uri, nprocs, maxfiles, nfiles=None, registered=None):
+        # loaders exit when the load list is drained after registered is set
+        errors = []
+        cmd = 'rdf_loader_run(max_files=>%d)' % maxfiles
+
+        def run():
+            try:
+                while True:
+                    done = registered == None or registered.is_set()
+                    if self.count_pending(driver) > 0:
+                        driver.execute(cmd)
+                    elif done:
+                        break
+                    else:
+                        registered.wait(STREAM_POLL_INTERVAL)
+            except Exception as e:
+                errors.append(e)
+
+        stop = threading.Event()
+        monitor = threading.Thread(target=self.report_progress,
+                                   args=(driver, graph_uri, nfiles, stop))
+        monitor.daemon = True
+        monitor.start()
+
+        loaders = [threading.Thread(target=run) for i in range(nprocs)]
+        for th in loaders:
+            th.start()
+
+        def join():
+            for th in loaders:
+                th.join()
+            stop.set()
+            monitor.join()
+            return errors
+
+        return join
+
+    def finish_load(self, driver, graph_uri, st, errors):
+        rc = 0
+
+        for e in errors:
+            self.warning('Failure: %s' % e)
+            rc = -1
+
+        q = 'SELECT ll_file, ll_error FROM DB.DBA.load_list WHERE ll_error IS NOT NULL'
+        for _, row in driver.query(q):
+            self.warning('%s: %s' % (row['ll_file'], row['ll_error']))
+            rc = -1
+
+        driver.execute('checkpoint')
+
+        t = time.time() - st
+        (f, b) = self.count_loaded(driver, graph_uri)
+        self._checkpoint.done(b)
+        self.message('%d files (%d bytes) loaded in %.2f sec' % (f, b, t))
+
+        return rc
+
+    def load_odbc(self, graph_uri, d, exts, nprocs=DEFAULT_NLOADERS, maxfiles=DEFAULT_MAX_FILES,
+                  resume=False, dirs=None):
+
+        pool = ODBCConnectionPool(self.get_connect_string(), maxsize=nprocs+1)
+        driver = ODBCDriver(pool=pool)
+
+        rc = 0
+        try:
+            nfiles = self.prepare_load_odbc(driver, graph_uri, d, exts, resume=resume, dirs=dirs)
+
+            self.message('loading {} files with {} loaders...'.format(nfiles, nprocs))
+
+            st = time.time()
+
+            join = self.start_loaders(driver, graph_uri, nprocs, maxfiles, nfiles=nfiles)
+            errors = join()
+
+            rc = self.finish_load(driver, graph_uri, st, errors)
+
+        except Exception as e:
+            self.warning('Failure: %s' % e)
+            rc = -1
+
+        finally:
+            pool.close()
+
+        return rc
+
+    def is_complete(self, path):
+        # a file is still being written unless it ends as a whole
+        try:
+            if path.endswith('.gz'):
+                with gzip.open(path, 'rb') as f:
+                    while f.read(1024 * 1024):
+                        pass
+            else:
+                with open(path, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        return False
+        except (EOFError, OSError, zlib.error) as e:
+            self.debug('"%s": %s' % (path, e))
+            return False
+        return True
+
+    def scan_new_files(self, d, exts, registered, quiet):
+        paths = []
+        now = time.time()
+        for (dpath, dns, fns) in os.walk(d):
+            for fn in fns:
+                if any(fn.endswith(ext) for ext in exts):
+                    path = os.path.join(dpath, fn)
+                    if path in registered:
+                        continue
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    if quiet == 0:
+                        paths.append(path)
+                    elif st.st_size > 0 and now - st.st_mtime > quiet:
+                        stamp = (st.st_size, st.st_mtime)
+                        if self._incomplete.get(path, None) == stamp:
+                            continue
+                        if self.is_complete(path):
+                            paths.append(path)
+                        else:
+                            self._incomplete[path] = stamp
+        return paths
+
+    def load_stream(self, graph_uri, d, exts, is_done, nprocs=DEFAULT_NLOADERS,
+                    maxfiles=DEFAULT_MAX_FILES, quiet=STREAM_QUIET_PERIOD):
+        # loads files in d while they are being produced until is_done() holds
+
+        pool = ODBCConnectionPool(self.get_connect_string(), maxsize=nprocs+2)
+        driver = ODBCDriver(pool=pool)
+
+        rc = 0
+        try:
+            driver.execute('delete from DB.DBA.load_list')
+
+            self.message('loading files in "%s" with %d loaders...' % (d, nprocs))
+
+            st = time.time()
+            registered = set()
+            all_registered = threading.Event()
+
+            join = self.start_loaders(driver, graph_uri, nprocs, maxfiles, registered=all_registered)
+
+            try:
+                while True:
+                    done = is_done()
+                    for path in self.scan_new_files(d, exts, registered, 0 if done else quiet):
+                        driver.execute('ld_add(\'%s\', \'%s\')' % (path, graph_uri))
+                        registered.add(path)
+                    if done:
+                        break
+                    time.sleep(STREAM_POLL_INTERVAL)
+            finally:
+                all_registered.set()
+                errors = join()
+
+            self.message('%d files registered' % len(registered))
+
+            # files picked up while still being written
+            row = driver.fetchone('SELECT COUNT(*) FROM DB.DBA.load_list WHERE ll_error IS NOT NULL')
+            if row['count'] > 0 and not errors:
+                self.message('reloading %d files...' % row['count'])
+                driver.execute('update DB.DBA.load_list set ll_state=0, ll_error=NULL WHERE ll_error IS NOT NULL')
+                join = self.start_loaders(driver, graph_uri, nprocs, maxfiles, nfiles=row['count'])
+                errors = join()
+
+            rc = self.finish_load(driver, graph_uri, st, errors)
+
+        except Exception as e:
+            self.warning('Failure: %s' % e)
+            rc = -1
+
+        finally:
+            pool.close()
+
+        return rc
+
+    def find_file_entities(self, driver, graph_uri, fids, ns, sep, encs=ENTITY_ENCS):
+        # entities of the files are named ns+enc+sep+fid[+sep+range]
+        prefixes = ['%s%s%s%s' % (ns, enc, sep, fid) for fid in fids for enc in encs]
+        cond = ' || '.join('STRSTARTS(STR(?x), "%s")' % p for p in prefixes)
+        q = ('SPARQL SELECT DISTINCT ?x '
+             'WHERE { GRAPH <%(g)s> { ?x ?p ?o . FILTER (isIRI(?x) && (%(cond)s)) } }'
+             % {'g':graph_uri, 'cond':cond})
+        pat = re.compile(r'%s[A-Z]+%s(?P<fid>[^%s]+)' % (re.escape(ns), re.escape(sep), re.escape(sep)))
+        fids = set(fids)
+        iris = []
+        for (_, row) in driver.query(q, row_type=ROW_TUPLE):
+            m = pat.match(row[0])
+            if m and m.group('fid') in fids: # not a longer file id with the same prefix
+                iris.append(row[0])
+        return iris
+
+    def delete_entities(self, driver, graph_uri, iris, batch_size=DELETE_IRI_BATCH_SIZE):
+        for i in range(0, len(iris), batch_size):
+            vals = ' '.join('<%s>' % x for x in iris[i:i+batch_size])
+            for pat in ['?x ?p ?o', '?s ?p ?x']:
+                q = ('SPARQL DEFINE sql:log-enable 3 '
+                     'DELETE { GRAPH <%(g)s> { %(pat)s } } '
+                     'WHERE { VALUES ?x { %(vals)s } GRAPH <%(g)s> { %(pat)s } }'
+                     % {'g':graph_uri, 'pat':pat, 'vals':vals})
+                driver.execute(q)
+
+    def delete_file_ids(self, graph_uri, fids, ns, sep, batch_size=DELETE_BATCH_SIZE):
+        # removes triples mentioning entities of the files. the entities are
+        # looked up first so that the deletes go through the S and O indexes
+        # instead of scanning the graph for each file id
+        driver = self.get_driver()
+        fids = sorted(fids)
+        rc = 0
+        for i in range(0, len(fids), batch_size):
+            try:
+                iris = self.find_file_entities(driver, graph_uri, fids[i:i+batch_size], ns, sep)
+                self.delete_entities(driver, graph_uri, iris)
+            except Exception as e:
+                self.warning('Failure: %s' % e)
+                rc = -1
+                continue
+            self.message('%d/%d files deleted (%d entities)'
+                         % (min(i+batch_size, len(fids)), len(fids), len(iris)))
+        return rc
 
     def prepare_load(self, graph_uri, d, exts, resume=False):
 
@@ -323,7 +941,13 @@ class Loader(base):
 
 
     def load(self, graph_uri, d, exts, nprocs=1, maxfiles=DEFAULT_MAX_FILES,
-             resume=False):
+             resume=False, engine=ENGINE_ODBC):
+
+        if engine == ENGINE_ODBC:
+            if self.wait_ready():
+                return self.load_odbc(graph_uri, d, exts, nprocs=nprocs, maxfiles=maxfiles,
+                                      resume=resume)
+            self.warning('falling back to isql')
 
         nfiles = self.prepare_load(graph_uri, d, exts, resume=resume)
 
@@ -355,9 +979,11 @@ class Loader(base):
             if rc != 0:
                 self.warning('Failure')
                 return -1
-            time.sleep(1)
-            self.checkpoint()
-            time.sleep(1)
+            driver = self.get_driver()
+            (_, nbytes) = self.count_loaded(driver, graph_uri)
+            self.checkpoint_if_needed(driver, nbytes)
+
+        self.checkpoint()
 
         return rc
 
@@ -39,6 +39,7 @@ DEFAULT_SRV_PORT = 18000
 CCA_HOME = '/opt/cca'
 CCA_VAR = '/var/lib/cca'
 PROJS_DIR = CCA_VAR+'/projects'
+TEMPLATE_VOL_NAME = 'vol_cca_template' # database templates shared by analyses
 CCA_LOG_DIR = '/var/log/cca'
 WWW_DIR = '/var/www'
 SRV_CMD = '/usr/local/bin/supervisord'
@@ -150,7 +151,8 @@ def get_image_name(image_name, devel=False):
     return image
 
 def run_cmd(subcmd_name, dpath, mem, dry_run=False, devel=False, keep_fb=False,
-            all_roots=False, all_sps=False, image=IMAGE_NAME):
+            all_roots=False, all_sps=False, cache=False, profile=False, local_thresh=0,
+            incremental=False, pipeline=False, snapshot=False, image=IMAGE_NAME):
 
     dpath = check_path(dpath)
 
@@ -181,6 +183,18 @@ def run_cmd(subcmd_name, dpath, mem, dry_run=False, devel=False, keep_fb=False,
     subcmd += ' -m %d' % mem
     if keep_fb:
         subcmd += ' -k'
+    if cache:
+        subcmd += ' -c'
+    if profile:
+        subcmd += ' --profile'
+    if local_thresh > 0:
+        subcmd += ' --local-store-thresh %d' % local_thresh
+    if incremental:
+        subcmd += ' -i'
+    if pipeline:
+        subcmd += ' --pipeline'
+    if snapshot:
+        subcmd += ' --snapshot'
     subcmd += ' %s' % proj_path
 
     if all_roots:
@@ -199,6 +213,7 @@ def run_cmd(subcmd_name, dpath, mem, dry_run=False, devel=False, keep_fb=False,
 
     vol_opt = '-v "%s:%s"' % (dpath, proj_path)
     vol_opt += ' -v "%s:%s"' % (log_dir, CCA_LOG_DIR)
+    vol_opt += ' -v "%s:%s/template"' % (TEMPLATE_VOL_NAME, CCA_VAR)
 
     run_cmd = '%s run' % CONTAINER_CMD
     run_cmd += ' --rm'
@@ -417,10 +432,14 @@ def update(args):
 
 def opcount(args):
     run_cmd('opcount', args.proj_dir, args.mem, dry_run=args.dry_run, keep_fb=args.keep_fb,
+            cache=args.cache, profile=args.profile, local_thresh=args.local_thresh,
+            incremental=args.incremental, pipeline=args.pipeline, snapshot=args.snapshot,
             devel=args.devel, image=args.image)
 
 def outline(args):
     run_cmd('outline', args.proj_dir, args.mem, dry_run=args.dry_run, keep_fb=args.keep_fb,
+            cache=args.cache, profile=args.profile, local_thresh=args.local_thresh,
+            incremental=args.incremental, pipeline=args.pipeline, snapshot=args.snapshot,
             devel=args.devel, all_roots=args.all_roots, all_sps=args.all_sps, image=args.image)
 
 def treeview_start(args):
@@ -436,8 +455,8 @@ def main():
                             formatter_class=ArgumentDefaultsHelpFormatter)
 
     parser.add_argument('-m', '--mem', dest='mem', metavar='GB', type=int,
-                        choices=[2, 4, 8, 16, 32, 48, 64],
-                        help='available memory (GB)', default=4)
+                        choices=[0, 2, 4, 8, 16, 32, 48, 64],
+                        help='available memory (GB, 0: auto)', default=4)
 
     parser.add_argument('-n', '--dry-run', dest='dry_run', action='store_true',
                         help='only print container commands')
@@ -463,6 +482,18 @@ def main():
                                 help='directory that subject programs reside')
     parser_opcount.add_argument('-k', '--keep-fb', dest='keep_fb', action='store_true',
                                 help='keep FB')
+    parser_opcount.add_argument('-c', '--cache', dest='cache', action='store_true',
+                                help='reuse query results cached for unchanged source code')
+    parser_opcount.add_argument('--profile', dest='profile', action='store_true',
+                                help='write a profile of SPARQL queries to the output directory')
+    parser_opcount.add_argument('--local-store-thresh', dest='local_thresh', metavar='MB', type=int, default=0,
+                                help='analyze without virtuoso if facts are smaller than MB')
+    parser_opcount.add_argument('-i', '--incremental', dest='incremental', action='store_true',
+                                help='reuse FB of the previous analysis and load changed files only')
+    parser_opcount.add_argument('--pipeline', dest='pipeline', action='store_true',
+                                help='load facts while source files are being parsed')
+    parser_opcount.add_argument('--snapshot', dest='snapshot', action='store_true',
+                                help='reuse FB built for the same source code instead of rebuilding it')
     parser_opcount.set_defaults(func=opcount)
 
     parser_outline = subparsers.add_parser('outline',
@@ -476,6 +507,18 @@ def main():
                                 help='allow subprograms to be shown as roots')
     parser_outline.add_argument('-s', '--all-sps', dest='all_sps', action='store_true',
                                 help='allow loop-free subprograms to be shown')
+    parser_outline.add_argument('-c', '--cache', dest='cache', action='store_true',
+                                help='reuse query results cached for unchanged source code')
+    parser_outline.add_argument('--profile', dest='profile', action='store_true',
+                                help='write a profile of SPARQL queries to the output directory')
+    parser_outline.add_argument('--local-store-thresh', dest='local_thresh', metavar='MB', type=int, default=0,
+                                help='analyze without virtuoso if facts are smaller than MB')
+    parser_outline.add_argument('-i', '--incremental', dest='incremental', action='store_true',
+                                help='reuse FB of the previous analysis and load changed files only')
+    parser_outline.add_argument('--pipeline', dest='pipeline', action='store_true',
+                                help='load facts while source files are being parsed')
+    parser_outline.add_argument('--snapshot', dest='snapshot', action='store_true',
+                                help='reuse FB built for the same source code instead of rebuilding it')
     parser_outline.set_defaults(func=outline)
 
     parser_tv = subparsers.add_parser('treeview')